@@ -41,6 +41,10 @@ class AccountTestCase(unittest.TestCase):
             'is_synthetic': True,
         })
 
+        # Transaction records (see. Account._calc_transactions)
+        self.trans1 = (pd.Timestamp('2018-01-02'), self.asset1, 1, 1, 2, 3, -1.0, -1.5, -1.0, -1.5, None)
+        self.trans2 = (pd.Timestamp('2018-01-02'), self.asset2, 1, 2, 2, 3, -2.0, -3.0, -2.0, -3.0, None)
+
 
     def test__calc_transations_new(self):
         new_pos = {self.asset1: (2, 2, 3, None)}
@@ -490,7 +494,7 @@ class AccountTestCase(unittest.TestCase):
         with mock.patch('yauber_backtester._account.Account._calc_transactions') as mock_calc_trans:
             with mock.patch('yauber_backtester._account.Account._calc_account_margin') as mock_acc_margin:
                 mock_calc_trans.return_value = (
-                        ['trans1', 'trans2'],
+                        [self.trans1, self.trans2],
                         100, 200,
                         -0.5, -1.0,
                         -3, -4,
@@ -508,7 +512,7 @@ class AccountTestCase(unittest.TestCase):
                 self.assertEqual(True, mock_calc_trans.called)
                 self.assertEqual((pd.Timestamp('2018-01-02'), {self.asset1: (1, 2, 3, None)}, {}), mock_calc_trans.call_args[0])
 
-                self.assertEqual(['trans1', 'trans2'], acc._transactions)
+                self.assertEqual([self.trans1, self.trans2], acc._transactions)
                 self.assertEqual(1100, acc._equity_close)
                 self.assertEqual(1200, acc._equity_exec)
 
@@ -543,7 +547,7 @@ class AccountTestCase(unittest.TestCase):
         with mock.patch('yauber_backtester._account.Account._calc_transactions') as mock_calc_trans:
             with mock.patch('yauber_backtester._account.Account._calc_account_margin') as mock_acc_margin:
                 mock_calc_trans.return_value = (
-                    ['trans1', 'trans2'],
+                    [self.trans1, self.trans2],
                     100, 200,
                     -0.5, -1.0,
                     -3, -4,
@@ -563,7 +567,7 @@ class AccountTestCase(unittest.TestCase):
         with mock.patch('yauber_backtester._account.Account._calc_transactions') as mock_calc_trans:
             with mock.patch('yauber_backtester._account.Account._calc_account_margin') as mock_acc_margin:
                 mock_calc_trans.return_value = (
-                        ['trans1', 'trans2'],
+                        [self.trans1, self.trans2],
                         100, 200,
                         -0.5, -1.0,
                         -3, -4,
@@ -614,7 +618,7 @@ class AccountTestCase(unittest.TestCase):
         with mock.patch('yauber_backtester._account.Account._calc_transactions') as mock_calc_trans:
             with mock.patch('yauber_backtester._account.Account._calc_account_margin') as mock_acc_margin:
                 mock_calc_trans.return_value = (
-                        ['trans1', 'trans2'],
+                        [self.trans1, self.trans2],
                         100, 200,
                         -0.5, -1.0,
                         -3, -4,
@@ -763,7 +767,7 @@ class AccountTestCase(unittest.TestCase):
         with mock.patch('yauber_backtester._account.Account._calc_transactions') as mock_calc_trans:
             with mock.patch('yauber_backtester._account.Account._calc_account_margin') as mock_acc_margin:
                 mock_calc_trans.return_value = (
-                        ['trans1', 'trans2'],
+                        [self.trans1, self.trans2],
                         100, 200,
                         -0.5, -1.0,
                         -3, -4,
@@ -788,6 +792,54 @@ class AccountTestCase(unittest.TestCase):
                 self.assertEqual(200, df['pnl'][0])
                 self.assertEqual(pd.Timestamp('2018-01-02'), df.index[0])
 
+    def test_bind_timeline(self):
+        idx = pd.date_range('2018-01-01', periods=30)
+        rnd = np.random.RandomState(7)
+        px = pd.DataFrame({'c': 100 + rnd.randn(30).cumsum(), 'exec': 100 + rnd.randn(30).cumsum()}, index=idx)
+
+        class CustomPricesAsset(Asset):
+            def get_prices(self, date):
+                cpx, epx = super().get_prices(date)
+                return cpx + 1, epx + 1
+
+        assets = [
+            # Quotes gaps are filled by previous prices
+            Asset(ticker='GAP', quotes=px.iloc[::3], costs={'type': 'percent', 'value': 0.01}, margin=0.5),
+            Asset(ticker='DYN', quotes=px, costs={'type': 'dynamic', 'value': pd.DataFrame({'c': 0.1, 'exec': 0.2}, index=idx)},
+                  margin=pd.Series(50.0, index=idx), point_value=pd.Series(np.linspace(1, 2, 30), index=idx)),
+            CustomPricesAsset(ticker='CUS', quotes=px),
+        ]
+        accounts = []
+        for bind in [False, True]:
+            acc = Account(buffer_len=len(idx), name='acc')
+            if bind:
+                acc._bind_timeline(idx)
+            rnd = np.random.RandomState(1)
+            for dt in idx:
+                acc._process_position(dt, {a: float(q) for a, q in zip(assets, rnd.randint(-2, 3, size=3))})
+            accounts.append(acc)
+
+        df, df_bound = accounts[0].as_dataframe(), accounts[1].as_dataframe()
+        self.assertTrue(df.index.equals(df_bound.index))
+        for col in df.columns:
+            self.assertTrue(np.array_equal(df[col].values, df_bound[col].values), col)
+        tr, tr_bound = accounts[0].as_transactions(), accounts[1].as_transactions()
+        self.assertTrue(tr.drop(columns='asset').equals(tr_bound.drop(columns='asset')))
+        self.assertEqual(accounts[1]._timeline_rows[id(assets[0])][1][:4], [0, 0, 0, 1])
+        self.assertIsNone(accounts[1]._timeline_rows[id(assets[2])][1])
+
+        acc = Account(buffer_len=5)
+        self.assertRaises(ValueError, acc._bind_timeline, idx)
+        acc._process_position(idx[0], {})
+        self.assertRaises(ValueError, acc._bind_timeline, idx[:4])
+        self.assertRaises(ValueError, acc._bind_timeline, idx[1:6])
+
+        # The timeline continues the account bars
+        acc._bind_timeline(idx[1:5])
+        acc._process_position(idx[1], {assets[0]: 1.0})
+        self.assertEqual(assets[0].get_prices(idx[1]), acc._position[assets[0]][1:3])
+        self.assertEqual([idx[0], idx[1]], list(acc.as_dataframe().index))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -550,6 +550,22 @@ class AssetTestCase(unittest.TestCase):
         # Valid case
         self.assertEqual(True, a.is_synthetic)
 
+    def test_synthetic_state(self):
+        idx = self.quotes.index
+        px = np.arange(1.0, 7.0)
+        costs = pd.DataFrame({'c': -np.ones(6), 'exec': -np.ones(6) * 2}, index=idx)
+        a = Asset._synthetic('test_ticker', idx, px, px + 1, np.full(6, 10.0), -np.ones(6), -np.ones(6) * 2,
+                             {'test_ticker': 1.0})
+        b = Asset(**a.kwargs)
+
+        self.assertEqual(sorted(vars(b)), sorted(vars(a)))
+        self.assertEqual(True, a.is_synthetic)
+        self.assertEqual(b._costs_func.__func__, a._costs_func.__func__)
+        self.assertEqual(True, np.array_equal(b._costs_bar_values, a._costs_bar_values))
+        self.assertEqual(True, costs.equals(a._costs_value))
+        self.assertEqual(b.get_prices(idx[2]), a.get_prices(idx[2]))
+        self.assertEqual(b.get_costs(idx[2], 2), a.get_costs(idx[2], 2))
+
     def test_legs(self):
         _asset_dict = {
             'ticker': 'test_ticker',
@@ -688,6 +704,48 @@ class AssetTestCase(unittest.TestCase):
         # raise ValueError(f"'point_value' unsupported type, it must be pd.Series or float, got {type(self._point_value)}")
         self.assertRaises(ValueError, Asset, **_asset_dict)
 
+    def test_aligned_arrays_errors(self):
+        index = self.quotes.index
+        pv = pd.Series([10, 10, 10, 20, 0, -20], index=index)
+        a = Asset(ticker='test_ticker', quotes=self.quotes, point_value=pv)
+        self.assertEqual([10, 10, 10, 20], list(a._aligned_arrays(index[:4])['point_value']))
+        # The same errors as get_point_value()
+        self.assertRaises(ValueError, a._aligned_arrays, index)
+        self.assertRaises(KeyError, a._aligned_arrays, pd.DatetimeIndex(['2017-12-31', '2018-01-01']))
+
+        margin = pd.Series([1, 1, 1, -1, 1, 1], index=index)
+        a = Asset(ticker='test_ticker', quotes=self.quotes, margin=margin)
+        self.assertEqual([1, 1, 1], list(a._aligned_arrays(index[:3])['margin']))
+        # The same errors as get_margin_requirements()
+        self.assertRaises(ValueError, a._aligned_arrays, index)
+
+        # Dates before the first quote
+        a = Asset(ticker='test_ticker', quotes=self.quotes)
+        self.assertEqual(index[0], a._data_start())
+        self.assertRaises(KeyError, a._aligned_arrays, pd.DatetimeIndex(['2017-12-31']))
+        self.assertEqual([1, 1, 3], list(a._aligned_arrays(pd.DatetimeIndex(['2018-01-01', '2018-01-01',
+                                                                               '2018-01-04']))['c']))
+
+    def test_row_lookups(self):
+        index = self.quotes.index
+        costs = pd.DataFrame({'c': [1, 2, 3, 4, 5, 6], 'exec': [2, 3, 4, 5, 6, 7]}, index=index)
+        for kwargs in [dict(point_value=pd.Series([1, 2, 3, 4, 5, 6], index=index),
+                            margin=pd.Series([6, 5, 4, 3, 2, 1], index=index),
+                            costs={'type': 'dynamic', 'value': costs}),
+                       dict(point_value=2.0, costs={'type': 'percent', 'value': 0.1}),
+                       dict(margin=0.5)]:
+            a = Asset(ticker='test_ticker', quotes=self.quotes, **kwargs)
+            # The quotes row of the date gives the same results as the date lookup
+            for row, date in zip(a._timeline_rows(index), index):
+                self.assertEqual(a.get_prices(date), a.get_prices(date, row))
+                self.assertEqual(a.get_point_value(date), a.get_point_value(date, row))
+                self.assertEqual(a.get_costs(date, -2), a.get_costs(date, -2, row))
+                self.assertEqual(a.get_margin_requirements(date, -2), a.get_margin_requirements(date, -2, row))
+                self.assertEqual(a.calc_dollar_pnl(date, 1, 2, 3), a.calc_dollar_pnl(date, 1, 2, 3, row))
+
+        a = Asset(ticker='test_ticker', quotes=self.quotes, point_value=pd.Series([1, 0, 3, 4, 5, 6], index=index))
+        self.assertRaises(ValueError, a.get_point_value, index[1], 1)
+
     def test__eq__(self):
         _asset_dict = {
             'ticker': 'test_ticker',
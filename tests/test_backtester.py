@@ -1,9 +1,10 @@
 import unittest
 import unittest
-from yauber_backtester._backtester import Backtester
+from yauber_backtester._backtester import Backtester, _dumps_account, _loads_account
 
-from yauber_backtester import Asset, Strategy, Account
+from yauber_backtester import Report, Asset, Strategy, Account
 from unittest import mock
+import multiprocessing
 import pandas as pd
 import numpy as np
 
@@ -35,6 +36,99 @@ class TestStrategy(Strategy):
         return asset.quotes().rolling(20).mean()[['o', 'h', 'l', 'c', 'exec']]
 
 
+class NotebookStrategy(Strategy):
+    """
+    Strategy from notebooks/ examples, but deterministic (picks the asset with the lowest MA200 instead of random)
+    """
+    name = 'NotebookStrategy'
+
+    def calculate(self, asset: Asset) -> pd.DataFrame:
+        ohlc = asset.quotes()
+        ma200 = ohlc['c'].rolling(200).mean()
+        if self.params.get('long', True):
+            is_gt_ma200 = ohlc['c'] > ma200
+        else:
+            is_gt_ma200 = ohlc['c'] < ma200
+        return pd.DataFrame({
+            'is_gt_ma200': is_gt_ma200,
+            'ma200': ma200,
+        })
+
+    def compose_portfolio(self, date, account, mf) -> dict:
+        flt_assets, flt_data = mf.get_filtered(mf['is_gt_ma200'] == 1, sort_by_col='ma200')
+        if len(flt_assets) > 0:
+            return {flt_assets[0]: 1.0 if self.params.get('long', True) else -1.0}
+        return {}
+
+
+class NotebookUniverseStrategy(NotebookStrategy):
+    """
+    Vectorized version of NotebookStrategy (metrics are calculated for the whole universe at once)
+    """
+    def calculate_universe(self, panel):
+        close = panel.close
+        ma200 = pd.DataFrame(close).rolling(200).mean().values
+        with np.errstate(invalid='ignore'):
+            is_gt_ma200 = close > ma200 if self.params.get('long', True) else close < ma200
+        return {
+            'is_gt_ma200': is_gt_ma200,
+            'ma200': ma200,
+        }
+
+
+class EqualWeightStrategy(Strategy):
+    name = 'EqualWeightStrategy'
+
+    def calculate(self, asset: Asset) -> pd.DataFrame:
+        return pd.DataFrame({'c': asset.quotes()['c']})
+
+    def compose_portfolio(self, date, account, mf) -> dict:
+        return {a: 1.0 for a in mf.assets}
+
+
+class MonthlyNotebookStrategy(NotebookStrategy):
+    """
+    NotebookStrategy which changes the position only at the first bar of the month (rebalances at every bar)
+    """
+    def initialize(self):
+        self._month = None
+        self._last_pos = {}
+        self.n_calls = 0
+
+    def calculate(self, asset: Asset) -> pd.DataFrame:
+        df = super().calculate(asset)
+        df['is_new_month'] = df.index.month != pd.Series(df.index.month, index=df.index).shift(1)
+        return df
+
+    def compose_portfolio(self, date, account, mf) -> dict:
+        self.n_calls += 1
+        if self._month != date.month:
+            self._month = date.month
+            self._last_pos = super().compose_portfolio(date, account, mf)
+        return self._last_pos
+
+
+class WarmupStrategy(TestStrategy):
+    """
+    Holds all assets after 20-bars MA warm-up (counts compose_portfolio() calls)
+    """
+    def initialize(self):
+        self.n_calls = 0
+
+    def compose_portfolio(self, date, account, mf) -> dict:
+        self.n_calls += 1
+        return {a: 1.0 for a, c, o in zip(mf.assets, mf['c'], mf['o']) if c >= o}
+
+
+def _fit_in_worker(strategy, train_dates):
+    """
+    Picklable Backtester.run_cv() fit function, fails if it's called in the main process
+    """
+    if multiprocessing.parent_process() is None:
+        raise AssertionError('Folds must be fitted in the worker processes')
+    return NotebookStrategy()
+
+
 class BacktesterTestCase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -117,11 +211,466 @@ class BacktesterTestCase(unittest.TestCase):
         smock.compose_portfolio.return_value = {self.asset_universe[0]: 1}
 
         metrics_reversed = Backtester._process_metrics(smock, self.asset_universe).sort_index(ascending=False)
-        mock__process_metrics = mock.Mock()
-        mock__process_metrics.return_value = metrics_reversed
-        Backtester._process_metrics = mock__process_metrics
-        # ValueError: Inconsistent datetime index order, quotes must be sorted in ascending order
-        self.assertRaises(ValueError, Backtester.run, smock, self.asset_universe)
+        with mock.patch.object(Backtester, '_process_metrics') as mock__process_metrics:
+            mock__process_metrics.return_value = metrics_reversed
+            # ValueError: Inconsistent datetime index order, quotes must be sorted in ascending order
+            self.assertRaises(ValueError, Backtester.run, smock, self.asset_universe)
+
+    def test__process_metrics_typed(self):
+        def calc_side(asset):
+            q = asset.quotes()
+            ma = q['c'].rolling(20).mean()
+            return pd.DataFrame({
+                'is_gt_ma': q['c'] > ma,
+                'side': np.sign(q['c'] - ma).fillna(0).astype(np.int8),
+                'ma': ma.astype(np.float32),
+            })
+        smock = mock.MagicMock(self.strategy)
+        smock.calculate.side_effect = calc_side
+
+        mstore = Backtester._process_metrics_typed(smock, self.asset_universe)
+        self.assertEqual({'is_gt_ma': np.bool_, 'side': np.int8, 'ma': np.float32},
+                         {k: v.type for k, v in mstore.dtypes.items()})
+        self.assertEqual(len(self.asset_universe[0].quotes()), len(mstore))
+
+        df_all_metrics = Backtester._process_metrics(smock, self.asset_universe)
+        self.assertLess(mstore.nbytes, df_all_metrics.values.nbytes / 4)
+
+        for i in [0, 100, len(mstore) - 1]:
+            row = df_all_metrics.values[i].reshape(len(self.asset_universe), 3)
+            self.assertTrue(np.allclose(row, mstore.row_matrix(i), equal_nan=True))
+
+        # Non-numeric metrics are not allowed
+        smock.calculate.side_effect = lambda a: pd.DataFrame({'test': 'A'}, index=a.quotes().index)
+        self.assertRaises(ValueError, Backtester._process_metrics_typed, smock, self.asset_universe)
+
+    def test__run_metrics_float32_tolerance(self):
+        # float32 metrics keep ~7 significant digits, with notebook strategies (signals are flags and rank of MA200)
+        # positions must be the same, so account values must match float64 run up to float64 rounding
+        universe = [make_rnd_asset(f'f32_{i}') for i in range(10)]
+
+        for params in [{'long': True}, {'long': False}]:
+            acc64 = Backtester.run(NotebookStrategy(params=params), universe, acc_initial_capital=1000)
+            acc32 = Backtester.run(NotebookStrategy(params=params), universe, acc_initial_capital=1000,
+                                   metrics_dtype=np.float32)
+            df64, df32 = acc64.as_dataframe(), acc32.as_dataframe()
+            self.assertEqual(df64['equity'].dtype, np.float64)
+            self.assertEqual(df32['equity'].dtype, np.float64)
+            for col in ['equity', 'pnl', 'costs', 'margin']:
+                self.assertTrue(np.allclose(df64[col], df32[col], rtol=1e-6, atol=1e-9, equal_nan=True), col)
+
+            acc32_typed = Backtester.run(NotebookStrategy(params=params), universe, acc_initial_capital=1000,
+                                         metrics_dtype=np.float32, metrics_typed=True)
+            self.assertTrue(np.allclose(df64['equity'], acc32_typed.as_dataframe()['equity'],
+                                        rtol=1e-6, atol=1e-9, equal_nan=True))
+
+        self.assertRaises(ValueError, Backtester.run, NotebookStrategy(), universe, metrics_dtype=np.int32)
+
+    def test__run_metrics_typed(self):
+        class GtMaStrategy(Strategy):
+            def calculate(self, asset):
+                q = asset.quotes()
+                ma = q['c'].rolling(20).mean()
+                return pd.DataFrame({'is_gt_ma': q['c'] > ma, 'ma': ma})
+
+            def compose_portfolio(self, date, account, mf):
+                return {a: 1.0 for a in mf.assets[mf['is_gt_ma'] == 1]}
+
+        acc = Backtester.run(GtMaStrategy(), self.asset_universe, acc_initial_capital=1000)
+        acc_typed = Backtester.run(GtMaStrategy(), self.asset_universe, acc_initial_capital=1000, metrics_typed=True)
+        self.assertTrue(np.allclose(acc.as_dataframe()['equity'], acc_typed.as_dataframe()['equity'], equal_nan=True))
+
+
+    def test__process_metrics_universe(self):
+        universe = [make_rnd_asset(f'u_{i}') for i in range(5)]
+        df_expected = Backtester._process_metrics(NotebookStrategy(), universe)
+
+        with mock.patch.object(NotebookUniverseStrategy, 'calculate') as mock_calculate:
+            df_all_metrics = Backtester._process_metrics(NotebookUniverseStrategy(), universe)
+            self.assertEqual(False, mock_calculate.called)
+
+        assert all(df_all_metrics.columns.levels[0] == universe)
+        assert all(df_all_metrics.columns.levels[1] == ['is_gt_ma200', 'ma200'])
+        self.assertTrue(df_expected.index.equals(df_all_metrics.index))
+        self.assertTrue(df_expected.columns.equals(df_all_metrics.columns))
+        self.assertTrue(np.allclose(df_expected.values, df_all_metrics.values, equal_nan=True))
+
+        mstore = Backtester._process_metrics_typed(NotebookUniverseStrategy(), universe)
+        self.assertEqual({'is_gt_ma200': np.bool_, 'ma200': np.float64}, {k: v.type for k, v in mstore.dtypes.items()})
+        for i in [0, 300, len(mstore) - 1]:
+            self.assertTrue(np.allclose(df_expected.values[i].reshape(5, 2), mstore.row_matrix(i), equal_nan=True))
+
+        # Validation of the metric cube
+        strategy = NotebookUniverseStrategy()
+        with mock.patch.object(strategy, 'calculate_universe', return_value={'m': np.zeros((10, 5))}):
+            self.assertRaises(ValueError, Backtester._process_metrics, strategy, universe)
+        with mock.patch.object(strategy, 'calculate_universe', return_value={}):
+            self.assertRaises(ValueError, Backtester._process_metrics, strategy, universe)
+        with mock.patch.object(strategy, 'calculate_universe',
+                               return_value={'m': np.full((len(df_expected), 5), 'A')}):
+            self.assertRaises(ValueError, Backtester._process_metrics, strategy, universe)
+
+    def test__run_universe(self):
+        universe = [make_rnd_asset(f'u_{i}') for i in range(5)]
+        for params in [{'long': True}, {'long': False}]:
+            acc = Backtester.run(NotebookStrategy(params=params), universe, acc_initial_capital=1000)
+            acc_u = Backtester.run(NotebookUniverseStrategy(params=params), universe, acc_initial_capital=1000)
+            acc_typed = Backtester.run(NotebookUniverseStrategy(params=params), universe, acc_initial_capital=1000,
+                                       metrics_typed=True)
+            for a in [acc_u, acc_typed]:
+                self.assertTrue(np.allclose(acc.as_dataframe()['equity'], a.as_dataframe()['equity'], equal_nan=True))
+
+    def test__account_pickling(self):
+        universe = [make_rnd_asset(f'p_{i}') for i in range(3)]
+        acc = Backtester.run(NotebookStrategy(), universe, acc_initial_capital=1000)
+        acc2 = _loads_account(_dumps_account(acc), {a.ticker: a for a in universe})
+        self.assertTrue(np.allclose(acc.as_dataframe()['equity'], acc2.as_dataframe()['equity'], equal_nan=True))
+        for a in acc2.position():
+            self.assertTrue(any(a is u for u in universe))
+        for t in acc2._transactions:
+            self.assertTrue(any(t[1] is u for u in universe))
+
+    def test__run_composite(self):
+        universe = [make_rnd_asset(f'comp_{i}') for i in range(5)]
+        children = [
+            (NotebookStrategy(params={'long': True}), {'acc_name': 'Long', 'acc_initial_capital': 1000}),
+            (NotebookStrategy(params={'long': False}), {'acc_name': 'Short', 'acc_initial_capital': 1000}),
+        ]
+
+        # Reference serial chain
+        synt_assets = [Backtester.run(s, universe, **kw).as_asset() for s, kw in children]
+        acc_expected = Backtester.run(EqualWeightStrategy(), synt_assets, acc_name='Meta')
+        df_expected = acc_expected.as_dataframe()
+
+        for n_jobs in [1, 2]:
+            acc = Backtester.run_composite(EqualWeightStrategy(), children, universe, n_jobs=n_jobs, acc_name='Meta')
+            self.assertEqual('Meta', acc.name)
+            self.assertEqual(['Long', 'Short'], sorted(str(a) for a in acc.position()))
+            df = acc.as_dataframe()
+            for col in ['equity', 'pnl', 'costs', 'margin']:
+                self.assertTrue(np.allclose(df_expected[col], df[col], equal_nan=True), (n_jobs, col))
+
+        # Children account names must be unique
+        self.assertRaises(ValueError, Backtester.run_composite, EqualWeightStrategy(),
+                          [NotebookStrategy(), NotebookStrategy()], universe)
+        self.assertRaises(ValueError, Backtester.run_composite, EqualWeightStrategy(), ['wrong'], universe)
+
+    def test__run_rebalance(self):
+        universe = [make_rnd_asset(f'rb_{i}') for i in range(5)]
+        dt_idx = universe[0].quotes().index
+        n_months = len(np.unique(dt_idx.to_period('M')))
+
+        s_every_bar = MonthlyNotebookStrategy()
+        df_expected = Backtester.run(s_every_bar, universe, acc_initial_capital=1000).as_dataframe()
+        self.assertEqual(len(dt_idx), s_every_bar.n_calls)
+
+        strategies = [
+            MonthlyNotebookStrategy(rebalance_calendar='M'),
+            MonthlyNotebookStrategy(rebalance_trigger='is_new_month'),
+            MonthlyNotebookStrategy(rebalance_calendar=list(dt_idx[dt_idx.is_month_start])),
+        ]
+        for s in strategies:
+            for typed in [False, True]:
+                df = Backtester.run(s, universe, acc_initial_capital=1000, metrics_typed=typed).as_dataframe()
+                self.assertEqual(n_months, s.n_calls)
+                self.assertTrue(df_expected.index.equals(df.index))
+                for col in ['equity', 'pnl', 'costs', 'margin']:
+                    self.assertTrue(np.allclose(df_expected[col], df[col], equal_nan=True), col)
+
+        # Weekly
+        s = MonthlyNotebookStrategy(rebalance_calendar='W')
+        Backtester.run(s, universe)
+        self.assertEqual(len(np.unique(dt_idx.to_period('W'))), s.n_calls)
+
+        self.assertRaises(ValueError, Backtester.run, MonthlyNotebookStrategy(rebalance_trigger='wrong'), universe)
+        self.assertRaises(ValueError, Backtester.run, MonthlyNotebookStrategy(rebalance_calendar='wrong'), universe)
+
+    def test__run_validate(self):
+        universe = [make_rnd_asset(f'v_{i}') for i in range(5)]
+        df_expected = Backtester.run(NotebookStrategy(), universe, acc_initial_capital=1000).as_dataframe()
+        for validate in ['first_n', 'off']:
+            for typed in [False, True]:
+                df = Backtester.run(NotebookStrategy(), universe, acc_initial_capital=1000, validate=validate,
+                                    validate_n=10, metrics_typed=typed).as_dataframe()
+                self.assertTrue(np.allclose(df_expected['equity'], df['equity'], equal_nan=True))
+
+        self.assertRaises(ValueError, Backtester.run, NotebookStrategy(), universe, validate='unknown')
+
+        # Only the first N assets are validated
+        def calc_side(asset):
+            df = pd.DataFrame({'a': 1.0, 'b': 2.0}, index=asset.quotes().index)
+            return df if asset is self.asset_universe[0] else df[['b', 'a']]
+        smock = mock.MagicMock(self.strategy)
+        smock.calculate.side_effect = calc_side
+        self.assertRaises(ValueError, Backtester._process_metrics, smock, self.asset_universe)
+        self.assertRaises(ValueError, Backtester._process_metrics, smock, self.asset_universe, validate_n=2)
+        self.assertEqual((len(self.asset_universe[0].quotes()), 6),
+                         Backtester._process_metrics(smock, self.asset_universe, validate_n=1).shape)
+
+        # Unsorted index is detected before the loop in 'first_n' mode
+        metrics_reversed = Backtester._process_metrics(self.strategy, self.asset_universe).sort_index(ascending=False)
+        with mock.patch.object(Backtester, '_process_metrics') as mock__process_metrics:
+            mock__process_metrics.return_value = metrics_reversed
+            self.assertRaises(ValueError, Backtester.run, EqualWeightStrategy(), self.asset_universe,
+                              validate='first_n', validate_n=1)
+
+    def test__run_warmup(self):
+        universe = [make_rnd_asset(f'w_{i}') for i in range(3)]
+        n_bars = len(universe[0].quotes())
+        df_expected = Backtester.run(WarmupStrategy(), universe, acc_initial_capital=1000).as_dataframe()
+
+        for typed in [False, True]:
+            strategy = WarmupStrategy()
+            acc = Backtester.run(strategy, universe, acc_initial_capital=1000, skip_warmup=True, metrics_typed=typed)
+            self.assertEqual(n_bars - 19, strategy.n_calls)
+            df = acc.as_dataframe()
+            self.assertTrue(df.index.equals(df_expected.index))
+            for col in df.columns:
+                self.assertTrue(np.array_equal(df_expected[col].values, df[col].values, equal_nan=True), col)
+
+        # Strategy declared warm-up
+        strategy = WarmupStrategy(warmup=50)
+        df = Backtester.run(strategy, universe, acc_initial_capital=1000).as_dataframe()
+        self.assertEqual(n_bars - 50, strategy.n_calls)
+        self.assertEqual(n_bars, len(df))
+        self.assertTrue(np.all(df['equity'].values[:51] == 1000))
+        self.assertTrue(np.all(df['margin'].values[:50] == 0))
+        self.assertTrue(df['margin'].values[50] != 0)
+
+        strategy = WarmupStrategy(warmup=n_bars + 10)
+        df = Backtester.run(strategy, universe, acc_initial_capital=1000).as_dataframe()
+        self.assertEqual(0, strategy.n_calls)
+        self.assertEqual(n_bars, len(df))
+
+        # Boolean metrics are always finite
+        self.assertEqual(0, Backtester._warmup_bars(NotebookStrategy(), 10, ['a'], lambda j: np.zeros((10, 2), dtype=bool), auto=True))
+        self.assertRaises(ValueError, Backtester.run, WarmupStrategy(warmup=-1), universe)
+        self.assertRaises(ValueError, Backtester.run, WarmupStrategy(warmup=10.0), universe)
+
+    def test__run_slices(self):
+        universe = [make_rnd_asset(f's_{i}') for i in range(4)]
+        df_full = Backtester.run(NotebookStrategy(), universe, acc_initial_capital=1000).as_dataframe()
+
+        acc = Backtester.run(NotebookStrategy(), universe, acc_initial_capital=1000, start='2017-01-01', end='2017-06-30')
+        df = acc.as_dataframe()
+        self.assertEqual(pd.Timestamp('2017-01-01'), df.index[0])
+        self.assertEqual(pd.Timestamp('2017-06-30'), df.index[-1])
+        # Indicators are warmed up at the first bar, positions depend only on the bar metrics
+        self.assertNotEqual(0, df['margin'][0])
+        self.assertTrue(np.allclose(df_full['pnl'].loc['2017-01-02':'2017-06-30'], df['pnl'].iloc[1:]))
+
+        for typed in [False, True]:
+            slices = [('2016-03-05', '2016-12-31'), (None, '2016-06-01'), ('2017-06-01', None)]
+            accounts = Backtester.run_slices(MonthlyNotebookStrategy(), universe, slices, acc_name='acc',
+                                             metrics_typed=typed)
+            accounts_mp = Backtester.run_slices(MonthlyNotebookStrategy(), universe, slices, n_jobs=2,
+                                                acc_name='acc', metrics_typed=typed)
+            self.assertEqual(['acc 2016-03-05..2016-12-31', 'acc 2016-01-01..2016-06-01', 'acc 2017-06-01..2018-01-01'],
+                             [a.name for a in accounts])
+            for (start, end), a, a_mp in zip(slices, accounts, accounts_mp):
+                expected = Backtester.run(MonthlyNotebookStrategy(), universe, acc_name='acc', start=start, end=end,
+                                          metrics_typed=typed).as_dataframe()
+                for df in [a.as_dataframe(), a_mp.as_dataframe()]:
+                    self.assertTrue(expected.index.equals(df.index))
+                    self.assertTrue(np.allclose(expected['equity'], df['equity'], equal_nan=True))
+                tr, tr_mp = a.as_transactions(), a_mp.as_transactions()
+                self.assertEqual(len(tr), len(tr_mp))
+                self.assertTrue(all(x is y for x, y in zip(tr['asset'], tr_mp['asset'])))
+
+        self.assertRaises(ValueError, Backtester.run, NotebookStrategy(), universe, start='2019-01-01')
+        self.assertRaises(ValueError, Backtester.run_slices, NotebookStrategy(), universe, [(None, None)], start='2017-01-01')
+
+    def test__run_walk_forward(self):
+        universe = [make_rnd_asset(f'wf_{i}') for i in range(4)]
+        grid = [{'long': True}, {'long': False}]
+        acc, df_windows = Backtester.run_walk_forward(MonthlyNotebookStrategy(), universe, grid, train=250, test=120,
+                                                      acc_name='wf', acc_initial_capital=1000)
+        n_bars = len(universe[0].quotes())
+        self.assertEqual('wf', acc.name)
+        self.assertEqual(len(range(250, n_bars, 120)), len(df_windows))
+
+        df = acc.as_dataframe()
+        self.assertEqual(n_bars - 250, len(df))
+        self.assertTrue(df.index.equals(universe[0].quotes().index[250:]))
+        self.assertEqual(list(df_windows['oos_start']), list(universe[0].quotes().index[250::120]))
+
+        pnl = []
+        for _, w in df_windows.iterrows():
+            # The best in-sample candidate
+            scores = [Backtester.run(MonthlyNotebookStrategy(params=p), universe, start=w['is_start'],
+                                     end=w['is_end']).capital_equity for p in grid]
+            self.assertEqual(grid[int(np.argmax(scores))], w['params'])
+            self.assertAlmostEqual(max(scores), w['score'])
+
+            oos = Backtester.run(MonthlyNotebookStrategy(params=w['params']), universe, start=w['oos_start'],
+                                 end=w['oos_end']).as_dataframe()
+            pnl.append(oos['pnl'].values[1:])
+        # PnL of segments except the first bar (which is transition from the previous window positions)
+        self.assertTrue(np.allclose(np.concatenate(pnl),
+                                    np.concatenate([df['pnl'].values[i + 1:i + 120] for i in range(0, len(df), 120)]),
+                                    equal_nan=True))
+
+        acc_mp, df_windows_mp = Backtester.run_walk_forward(MonthlyNotebookStrategy(), universe, grid, train=250,
+                                                            test=120, anchored=True, n_jobs=2, acc_initial_capital=1000)
+        acc_anch, df_windows_anch = Backtester.run_walk_forward(MonthlyNotebookStrategy(), universe, grid, train=250,
+                                                                test=120, anchored=True, acc_initial_capital=1000)
+        self.assertTrue((df_windows_anch['is_start'] == universe[0].quotes().index[0]).all())
+        self.assertTrue(df_windows_anch.equals(df_windows_mp))
+        self.assertTrue(np.allclose(acc_mp.as_dataframe()['equity'], acc_anch.as_dataframe()['equity'],
+                                    equal_nan=True))
+
+        # Metrics are shared by candidates with the same metric params
+        candidates, groups = Backtester._params_groups(NotebookStrategy(), universe, [{'long': True, 'x': 1},
+                                                                                      {'long': True, 'x': 2}],
+                                                       metric_params=['long'])
+        self.assertEqual(1, len(groups))
+        self.assertEqual([{'long': True, 'x': 1}, {'long': True, 'x': 2}], [p for p, _ in candidates])
+        self.assertEqual(2, len(Backtester._params_groups(NotebookStrategy(), universe, [{'x': 1}, {'x': 2}])[1]))
+
+        self.assertRaises(ValueError, Backtester.run_walk_forward, NotebookStrategy(), universe, grid, 0, 10)
+        self.assertRaises(ValueError, Backtester.run_walk_forward, NotebookStrategy(), universe, grid, n_bars, 10)
+        self.assertRaises(ValueError, Backtester.run_walk_forward, NotebookStrategy(), universe, [], 100, 10)
+
+    def test__run_cv(self):
+        universe = [make_rnd_asset(f'cv_{i}') for i in range(3)]
+        dt_idx = universe[0].quotes().index
+
+        folds = Backtester.purged_folds(dt_idx, n_folds=4, purge=5, embargo=10)
+        self.assertEqual(4, len(folds))
+        self.assertEqual(list(range(len(dt_idx))), [i for _, (i0, i1) in folds for i in range(i0, i1)])
+        train, (i0, i1) = folds[1]
+        self.assertEqual(i0 - 5, train[i0 - 5 - 1] + 1)
+        self.assertEqual(len(dt_idx) - (i1 - i0) - 15, len(train))
+        self.assertEqual(i1 + 10, train[i0 - 5])
+        self.assertEqual(len(dt_idx) - (folds[0][1][1] + 10), len(folds[0][0]))
+        self.assertRaises(ValueError, Backtester.purged_folds, dt_idx, 1)
+        self.assertRaises(ValueError, Backtester.purged_folds, dt_idx, 4, -1)
+
+        df_cv = Backtester.run_cv(NotebookStrategy(), universe, n_folds=4, purge=5, embargo=10, acc_initial_capital=1000)
+        self.assertEqual([0, 1, 2, 3], list(df_cv.index))
+        self.assertEqual([len(train) for train, _ in folds], list(df_cv['train_bars']))
+        for k, (_, (i0, i1)) in enumerate(folds):
+            acc = Backtester.run(NotebookStrategy(), universe, start=dt_idx[i0], end=dt_idx[i1 - 1],
+                                 acc_initial_capital=1000)
+            stats = Report([acc]).stats()[acc]
+            self.assertEqual(dt_idx[i0], df_cv.loc[k, 'test_start'])
+            self.assertEqual(dt_idx[i1 - 1], df_cv.loc[k, 'test_end'])
+            self.assertTrue(np.allclose(stats['MaxDD $'], df_cv.loc[k, 'MaxDD $'], equal_nan=True))
+            self.assertEqual(stats['NumberOfTrades'], df_cv.loc[k, 'NumberOfTrades'])
+
+        fitted = []
+
+        def fit(strategy, train_dates):
+            fitted.append(train_dates)
+            return NotebookStrategy()
+
+        df_cv_fit = Backtester.run_cv(NotebookStrategy(), universe, n_folds=4, purge=5, embargo=10, fit=fit,
+                                      acc_initial_capital=1000)
+        self.assertEqual([len(train) for train, _ in folds], [len(d) for d in fitted])
+        self.assertTrue(fitted[1].equals(dt_idx[folds[1][0]]))
+        self.assertTrue(np.allclose(df_cv['MaxDD $'].astype(float), df_cv_fit['MaxDD $'].astype(float), equal_nan=True))
+
+        # Folds are fitted in the worker processes
+        df_cv_mp = Backtester.run_cv(NotebookStrategy(), universe, n_folds=4, purge=5, embargo=10, fit=_fit_in_worker,
+                                     n_jobs=2, acc_initial_capital=1000)
+        self.assertTrue(np.allclose(df_cv['MaxDD $'].astype(float), df_cv_mp['MaxDD $'].astype(float), equal_nan=True))
+        self.assertEqual([len(train) for train, _ in folds], list(df_cv_mp['train_bars']))
+
+    def test__run_stop(self):
+        universe = [make_rnd_asset(f'stop_{i}') for i in range(3)]
+        dt_idx = universe[0].quotes().index
+        df_full = Backtester.run(EqualWeightStrategy(), universe, acc_initial_capital=1000).as_dataframe()
+        equity = df_full['equity'].values
+        peak = np.maximum(np.maximum.accumulate(equity), 1000.0)
+        dd = peak - equity
+        dd_pct = (1.0 - equity / peak) * 100.0
+
+        # Thresholds are taken from the random history, so the rules are triggered at the first 100 bars
+        stop_dd = dd[:100].max()
+        acc = Backtester.run(EqualWeightStrategy(), universe, acc_initial_capital=1000, stop_max_drawdown=stop_dd)
+        i_stop = int(np.flatnonzero(dd >= stop_dd)[0])
+        self.assertEqual(dt_idx[i_stop], acc.stopped_at)
+        df = acc.as_dataframe()
+        self.assertEqual(i_stop + 1, len(df))
+        self.assertTrue(np.allclose(df_full['equity'].values[:i_stop + 1], df['equity'].values))
+        self.assertEqual(3, len(acc.position()))
+
+        stop_dd_pct = dd_pct[:100].max()
+        acc = Backtester.run(EqualWeightStrategy(), universe, acc_initial_capital=1000,
+                             stop_max_drawdown_pct=stop_dd_pct)
+        self.assertEqual(dt_idx[int(np.flatnonzero(dd_pct >= stop_dd_pct)[0])], acc.stopped_at)
+
+        stop_floor = equity[50] + 1e-6
+        acc = Backtester.run(EqualWeightStrategy(), universe, acc_initial_capital=1000, stop_equity_floor=stop_floor)
+        self.assertEqual(dt_idx[int(np.flatnonzero(equity < stop_floor)[0])], acc.stopped_at)
+
+        calls = []
+
+        def callback(acc):
+            calls.append(acc)
+            return len(calls) == 10
+        acc = Backtester.run(EqualWeightStrategy(), universe, stop_callback=callback)
+        self.assertEqual(dt_idx[9], acc.stopped_at)
+        self.assertEqual([acc] * 10, calls)
+
+        # Rules are not triggered
+        acc = Backtester.run(EqualWeightStrategy(), universe, acc_initial_capital=1000, stop_equity_floor=-1e9)
+        self.assertIsNone(acc.stopped_at)
+        self.assertEqual(len(dt_idx), len(acc.as_dataframe()))
+
+        self.assertRaises(ValueError, Backtester.run, EqualWeightStrategy(), universe, stop_max_drawdown=0)
+        self.assertRaises(ValueError, Backtester.run, EqualWeightStrategy(), universe, stop_callback=1)
+
+    def test__run_sweep(self):
+        universe = [make_rnd_asset(f'sw_{i}') for i in range(4)]
+        n_bars = len(universe[0].quotes())
+        grid = [{'long': True}, {'long': False}, {'long': True, 'x': 1}, {'long': False, 'x': 1}]
+
+        df_full = Backtester.run_sweep(MonthlyNotebookStrategy(), universe, grid, metric_params=['long'])
+        self.assertEqual([0] * 4, list(df_full['round']))
+        self.assertEqual([n_bars] * 4, list(df_full['bars']))
+        scores = [Backtester.run(MonthlyNotebookStrategy(params=dict(p)), universe).capital_equity for p in grid]
+        self.assertEqual(int(np.argmax(scores)), df_full.index[0])
+        self.assertTrue(np.allclose(sorted(scores, reverse=True), df_full['score']))
+
+        df_halving = Backtester.run_sweep(MonthlyNotebookStrategy(), universe, grid, mode='halving', n_jobs=2,
+                                          metric_params=['long'])
+        self.assertEqual(sorted(df_halving.index), [0, 1, 2, 3])
+        self.assertEqual([2, 1, 0, 0], list(df_halving['round']))
+        self.assertEqual([n_bars, n_bars // 2, n_bars // 4, n_bars // 4], list(df_halving['bars']))
+        # The winner of the full history is evaluated on the whole history
+        self.assertEqual(df_halving['score'].iloc[0], scores[df_halving.index[0]])
+        # Less bars are evaluated than in full sweep
+        self.assertLess(df_halving['bars'].sum(), df_full['bars'].sum())
+        # Promoted candidates continue their runs, the scores are the same as of runs on the prefix
+        dt_idx = universe[0].quotes().index
+        for k, row in df_halving.iterrows():
+            acc = Backtester.run(MonthlyNotebookStrategy(params=dict(grid[k])), universe, end=dt_idx[row['bars'] - 1])
+            self.assertAlmostEqual(acc.capital_equity, row['score'])
+
+        # Resumed run is the same as uninterrupted one (no rebalance is forced at the resume bar)
+        strategy = MonthlyNotebookStrategy(rebalance_calendar='W')
+        ctx = Backtester._prepare_metrics(strategy, universe)
+        strategy.initialize()
+        acc = Backtester._new_account(strategy, n_bars)
+        Backtester._run_bars(strategy, ctx, 0, n_bars // 3, acc=acc)
+        Backtester._run_bars(strategy, ctx, n_bars // 3, n_bars, acc=acc, resume=True)
+        acc_full = Backtester.run(MonthlyNotebookStrategy(rebalance_calendar='W'), universe)
+        self.assertTrue(acc_full.as_dataframe().equals(acc.as_dataframe()))
+
+        df_min = Backtester.run_sweep(MonthlyNotebookStrategy(), universe, grid, mode='halving', eta=4, min_bars=300)
+        self.assertEqual([1, 0, 0, 0], list(df_min['round']))
+        self.assertEqual([n_bars, 300, 300, 300], list(df_min['bars']))
+
+        # Stopped candidates are the worst
+        df_stop = Backtester.run_sweep(MonthlyNotebookStrategy(), universe, grid, stop_equity_floor=-1e9,
+                                       stop_callback=lambda acc: len(acc.position()) > 0)
+        self.assertTrue(np.all(np.isneginf(df_stop['score'])))
+
+        self.assertRaises(ValueError, Backtester.run_sweep, NotebookStrategy(), universe, grid, mode='x')
+        self.assertRaises(ValueError, Backtester.run_sweep, NotebookStrategy(), universe, grid, mode='halving', eta=1)
+        self.assertRaises(ValueError, Backtester.run_sweep, NotebookStrategy(), universe, grid, mode='halving',
+                          min_bars=0)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,149 @@
+import unittest
+import pickle
+import gc
+import functools
+from unittest import mock
+from yauber_backtester._cache import IndicatorCache, default_cache
+from yauber_backtester import Strategy, Backtester
+from .test_backtester import make_rnd_asset
+import pandas as pd
+import numpy as np
+
+
+def _ma(asset, period):
+    return asset.quotes()['c'].rolling(period).mean()
+
+
+class CachedMaStrategy(Strategy):
+    name = 'CachedMaStrategy'
+
+    def calculate(self, asset):
+        ma = self.cache.get_or_compute(asset, 'ma', _ma, self.params.get('period', 20))
+        return pd.DataFrame({'is_gt_ma': asset.quotes()['c'] > ma, 'ma': ma})
+
+    def compose_portfolio(self, date, account, mf):
+        return {a: 1.0 for a in mf.assets[mf['is_gt_ma'] == 1]}
+
+
+class IndicatorCacheTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.asset_universe = [make_rnd_asset('c1'), make_rnd_asset('c2')]
+
+    def test_get_or_compute(self):
+        cache = IndicatorCache()
+        a1, a2 = self.asset_universe
+        calls = mock.Mock(side_effect=_ma)
+        fn = functools.partial(calls)
+
+        r1 = cache.get_or_compute(a1, 'ma', fn, 20)
+        self.assertIs(r1, cache.get_or_compute(a1, 'ma', fn, 20))
+        self.assertEqual(1, calls.call_count)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+        # Different args / asset / name / function -> different values
+        cache.get_or_compute(a1, 'ma', fn, 50)
+        cache.get_or_compute(a2, 'ma', fn, 20)
+        cache.get_or_compute(a1, 'ma_other', fn, 20)
+        self.assertEqual(4, calls.call_count)
+        cache.get_or_compute(a1, 'ma', lambda a, p: _ma(a, p) * 2, 20)
+        self.assertEqual(5, len(cache))
+
+        # Closure values are the part of the fingerprint
+        for period in [20, 30, 20]:
+            cache.get_or_compute(a1, 'ma_cl', lambda a: _ma(a, period))
+        self.assertEqual(7, len(cache))
+        self.assertEqual(2, cache.hits)
+
+        # functools.partial
+        self.assertTrue(cache.get_or_compute(a1, 'ma', functools.partial(_ma, period=20)).equals(r1))
+        self.assertIs(cache.get_or_compute(a1, 'ma', functools.partial(_ma, period=20)),
+                      cache.get_or_compute(a1, 'ma', functools.partial(_ma, period=20)))
+
+        cache.clear()
+        self.assertEqual((0, 0, 0, 0), (len(cache), cache.nbytes, cache.hits, cache.misses))
+
+    def test_new_quotes_instance(self):
+        cache = IndicatorCache()
+        a1 = make_rnd_asset('c3')
+        r1 = cache.get_or_compute(a1, 'ma', _ma, 20)
+        # The same ticker, but different quotes
+        a1_new = make_rnd_asset('c3')
+        r2 = cache.get_or_compute(a1_new, 'ma', _ma, 20)
+        self.assertIsNot(r1, r2)
+        self.assertEqual(2, cache.misses)
+
+    def test_identity_keys(self):
+        cache = IndicatorCache()
+        a1 = self.asset_universe[0]
+
+        class ClosureStrategy(Strategy):
+            def calculate(self, asset):
+                return self.cache.get_or_compute(asset, 'ma', lambda x: x.quotes()['c'].rolling(self.params['n']).mean())
+
+        # id() of the garbage collected strategy is reused by the next instance
+        for n in range(2, 40):
+            ma = ClosureStrategy(params={'n': n}, cache=cache).calculate(a1)
+            self.assertTrue(ma.equals(_ma(a1, n)), n)
+            gc.collect()
+
+        # The same instance hits the cache
+        s = ClosureStrategy(params={'n': 5}, cache=cache)
+        self.assertIs(s.calculate(a1), s.calculate(a1))
+
+        # Nested code objects (lambda in lambda) are hashed by value
+        misses = cache.misses
+        for _ in range(2):
+            cache.get_or_compute(a1, 'nested', lambda a: (lambda x: x * 2)(a.quotes()['c']))
+        self.assertEqual(misses + 1, cache.misses)
+        # Only attribute names differ
+        self.assertIsNot(cache.get_or_compute(a1, 'attr', lambda a: a.quotes().min()),
+                         cache.get_or_compute(a1, 'attr', lambda a: a.quotes().max()))
+
+    def test_lru_eviction(self):
+        a1 = self.asset_universe[0]
+        item_size = _ma(a1, 5).memory_usage(index=True)
+        cache = IndicatorCache(max_bytes=item_size * 3)
+        for p in range(5):
+            cache.get_or_compute(a1, 'ma', _ma, p + 1)
+            # Touch the first item, so it's not evicted
+            cache.get_or_compute(a1, 'ma', _ma, 1)
+        self.assertEqual(3, len(cache))
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        misses = cache.misses
+        cache.get_or_compute(a1, 'ma', _ma, 1)
+        cache.get_or_compute(a1, 'ma', _ma, 5)
+        self.assertEqual(misses, cache.misses)
+        cache.get_or_compute(a1, 'ma', _ma, 2)
+        self.assertEqual(misses + 1, cache.misses)
+
+        # Too large items are not cached
+        cache.get_or_compute(a1, 'ohlc', lambda a: pd.concat([a.quotes()] * 2, axis=1))
+        self.assertEqual(3, len(cache))
+
+        self.assertRaises(ValueError, IndicatorCache, max_bytes=0)
+
+    def test_strategy_cache(self):
+        s1 = CachedMaStrategy()
+        s2 = CachedMaStrategy()
+        self.assertIs(default_cache(), s1.cache)
+        self.assertIs(s1.cache, s2.cache)
+
+        cache = IndicatorCache()
+        acc1 = Backtester.run(CachedMaStrategy(cache=cache), self.asset_universe)
+        self.assertEqual((0, 2), (cache.hits, cache.misses))
+        acc2 = Backtester.run(CachedMaStrategy(cache=cache), self.asset_universe)
+        self.assertEqual((2, 2), (cache.hits, cache.misses))
+        self.assertTrue(np.allclose(acc1.as_dataframe()['equity'], acc2.as_dataframe()['equity'], equal_nan=True))
+
+    def test_pickle(self):
+        cache = IndicatorCache(max_bytes=1000)
+        cache.get_or_compute(self.asset_universe[0], 'ma', _ma, 2)
+        cache2 = pickle.loads(pickle.dumps(cache))
+        self.assertEqual((0, 1000), (len(cache2), cache2.max_bytes))
+        self.assertIs(default_cache(), pickle.loads(pickle.dumps(default_cache())))
+        self.assertIs(default_cache(), pickle.loads(pickle.dumps(CachedMaStrategy())).cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
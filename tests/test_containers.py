@@ -1,5 +1,6 @@
 import unittest
-from yauber_backtester._containers import MFrame, _unstack, PositionInfo, RowTuple
+from yauber_backtester._containers import MFrame, _unstack, PositionInfo, RowTuple, MetricStore, UniversePanel
+from collections import OrderedDict
 from yauber_backtester import Backtester, Asset
 from .test_backtester import make_rnd_asset, TestStrategy
 import pandas as pd
@@ -83,6 +84,58 @@ class ContainersTestCase(unittest.TestCase):
             self.assertEqual(r['e'], mf.get_at(a, 'e'))
             self.assertEqual(r['d'], mf.get_at(a, 'd'))
 
+    def test_mframe_metric_store(self):
+        idx = pd.date_range('2018-01-01', periods=3)
+        metrics = OrderedDict()
+        for k, a in enumerate(self.asset_universe):
+            metrics[a] = pd.DataFrame({
+                'flag': np.array([True, False, True]) ^ (k == 1),
+                'val': np.array([1, 2, 3], dtype=np.int8) * (k + 1),
+            }, index=idx)
+
+        store = MetricStore.from_frames(metrics, ['flag', 'val'])
+        self.assertEqual((3, 1), store._arrays[0].shape)  # 3 assets bit-packed into one byte
+
+        mf = MFrame(assets=store.assets, columns=store.columns)
+        mf._fill_store(store, 1)
+        self.assertEqual(np.bool_, mf['flag'].dtype)
+        self.assertEqual(np.int8, mf['val'].dtype)
+        self.assertEqual([False, True, False], list(mf['flag']))
+        self.assertEqual([2, 4, 6], list(mf['val']))
+        self.assertEqual(4, mf.get_at('RND_a2', 'val'))
+        self.assertEqual(1.0, mf.get_at('RND_a2', 'flag'))
+
+        flt_assets, flt_val = mf.get_filtered(mf['flag'])
+        self.assertEqual(['RND_a2'], [str(a) for a in flt_assets])
+        self.assertEqual(True, np.all(np.array([[1.0, 4.0]]) == flt_val))
+
+        # Unaligned metrics are promoted to floats to keep NaNs
+        metrics[self.asset_universe[2]] = metrics[self.asset_universe[2]].iloc[1:]
+        store = MetricStore.from_frames(metrics, ['flag', 'val'])
+        self.assertEqual(np.float32, store.dtypes['flag'])
+        self.assertEqual(np.float32, store.dtypes['val'])
+        self.assertEqual(True, np.isnan(store.get(1, 0)[2]))
+
+    def test_universe_panel(self):
+        idx = pd.date_range('2018-01-01', periods=10)
+        a1 = Asset(ticker='P1', quotes=pd.DataFrame({'c': np.arange(10.0), 'exec': np.arange(10.0) + 0.5}, index=idx))
+        a2 = Asset(ticker='P2', quotes=pd.DataFrame({'c': np.arange(5.0), 'exec': np.arange(5.0)}, index=idx[3:8]))
+
+        panel = UniversePanel([a1, a2])
+        self.assertTrue(panel.index.equals(idx))
+        self.assertEqual([a1, a2], panel.assets)
+        self.assertEqual((10, 2), panel.shape)
+
+        self.assertTrue(np.allclose(panel.close[:, 0], np.arange(10.0)))
+        self.assertTrue(np.all(np.isnan(panel.close[:3, 1])))
+        self.assertTrue(np.all(np.isnan(panel.close[8:, 1])))
+        self.assertTrue(np.allclose(panel.close[3:8, 1], np.arange(5.0)))
+        self.assertTrue(np.allclose(panel.exec[:, 0], np.arange(10.0) + 0.5))
+        # Cached
+        self.assertIs(panel.close, panel['c'])
+        # Missing fields are NaN
+        self.assertTrue(np.all(np.isnan(panel.open)))
+
     def test_position_info(self):
         p = PositionInfo(self.asset_universe[0], -1, ('ctx',))
         self.assertEqual(p.asset, self.asset_universe[0])
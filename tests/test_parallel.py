@@ -0,0 +1,36 @@
+import unittest
+import os
+import time
+from yauber_backtester._parallel import pool_map
+
+
+_worker_offset = 0
+
+
+def _init_offset(offset):
+    global _worker_offset
+    _worker_offset = offset
+
+
+def _add_offset_pid(x):
+    # Keeps the worker busy, so the pool hands out the tasks to other workers
+    time.sleep(0.2)
+    return x + _worker_offset, os.getpid()
+
+
+class ParallelTestCase(unittest.TestCase):
+    def test_pool_map(self):
+        results = pool_map(_add_offset_pid, [1, 2, 3, 4], n_jobs=2, initializer=_init_offset, initargs=(10,))
+        self.assertEqual([11, 12, 13, 14], [x for x, _ in results])
+        pids = {pid for _, pid in results}
+        self.assertEqual(2, len(pids))
+        self.assertNotIn(os.getpid(), pids)
+
+        # Serial run calls initializer in the current process
+        results = pool_map(_add_offset_pid, [1, 2], n_jobs=1, initializer=_init_offset, initargs=(20,))
+        self.assertEqual([(21, os.getpid()), (22, os.getpid())], results)
+        _init_offset(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
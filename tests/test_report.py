@@ -1,9 +1,173 @@
 import unittest
-from yauber_backtester._report import Trade, Report
+import os
+import time
+import pickle
+from yauber_backtester._report import Trade, Report, _TransactionsPayload, _trades_init, _build_trades_worker, \
+    _build_trades_arrays, _rolling_stats_kernel, _rolling_benchmark_kernel
 import pandas as pd
 import numpy as np
+import numba
 from unittest import mock
 from yauber_backtester._account import Account
+from yauber_backtester._containers import ExecutionPanel
+from yauber_backtester import Backtester, Strategy, Asset, PositionDelta
+from .test_backtester import make_rnd_asset, MonthlyNotebookStrategy
+
+
+def _trades_arrays_pid(transactions):
+    # Keeps the worker busy, so the pool hands out the accounts to other workers
+    time.sleep(0.2)
+    return dict(_build_trades_arrays(transactions), pid=os.getpid())
+
+
+class RandomPositionStrategy(Strategy):
+    """
+    Opens / adds / reduces / reverses random positions on every bar (to stress test trades pairing)
+    """
+    name = 'RandomPosition'
+
+    def initialize(self):
+        self.rnd = np.random.RandomState(self.params.get('seed', 1))
+
+    def calculate(self, asset):
+        return asset.quotes()[['c']]
+
+    def compose_portfolio(self, date, account, mf):
+        pos = {}
+        for a, qty in zip(mf.assets, self.rnd.randint(-2, 3, size=len(mf.assets))):
+            if qty != 0 or self.rnd.rand() < 0.5:
+                pos[a] = (float(qty), ('ctx', str(date))) if self.rnd.rand() < 0.3 else float(qty)
+        return pos
+
+
+class _TransactionsReader(Strategy):
+    """
+    Reads the account transactions log at every bar, positions are composed by the wrapped strategy
+    """
+    def __init__(self, strategy):
+        super().__init__()
+        self.strategy = strategy
+        self.name = strategy.name
+
+    def initialize(self):
+        self.strategy.initialize()
+
+    def calculate(self, asset):
+        return self.strategy.calculate(asset)
+
+    def compose_portfolio(self, date, account, mf):
+        account.as_transactions()
+        return self.strategy.compose_portfolio(date, account, mf)
+
+
+class _CustomLookupAsset(Asset):
+    """
+    Asset with overridden market data lookup (the engine can't use precomputed quotes rows)
+    """
+    def get_point_value(self, date):
+        return super().get_point_value(date)
+
+
+class RandomDeltaStrategy(RandomPositionStrategy):
+    """
+    The same positions as RandomPositionStrategy, but returns PositionDelta with changes only
+    """
+    def initialize(self):
+        super().initialize()
+        self._prev = {}
+
+    def compose_portfolio(self, date, account, mf):
+        pos = super().compose_portfolio(date, account, mf)
+        delta = PositionDelta()
+        for a, qty in pos.items():
+            if a not in self._prev or self._prev[a] != qty:
+                delta[a] = qty
+        for a in self._prev:
+            if a not in pos:
+                delta.close(a)
+        self._prev = pos
+        return delta
+
+
+class RandomArrayStrategy(RandomPositionStrategy):
+    """
+    The same positions as RandomPositionStrategy, but returns qty array aligned with mf.assets ('mixed' param -
+    alternates array and dict returns)
+    """
+    def compose_portfolio(self, date, account, mf):
+        pos = super().compose_portfolio(date, account, mf)
+        if self.params.get('mixed', False) and date.day % 3 == 0:
+            return pos
+        qty = np.zeros(len(mf.assets))
+        ctx = [None] * len(mf.assets)
+        for k, a in enumerate(mf.assets):
+            q = pos.get(a, 0.0)
+            if isinstance(q, tuple):
+                qty[k], ctx[k] = q
+            else:
+                qty[k] = q
+        return qty, ctx
+
+
+@numba.njit
+def _qty_metric_kernel(i, metrics, qty, equity):
+    return metrics[:, 1].copy()
+
+
+class QtyMetricStrategy(Strategy):
+    """
+    Holds random positions for several bars, position qty is calculated as 'q' metric
+    """
+    name = 'QtyMetric'
+
+    def calculate(self, asset):
+        rnd = np.random.RandomState(sum(map(ord, str(asset))))
+        quotes = asset.quotes()
+        is_changed = rnd.rand(len(quotes)) < 0.3
+        q = pd.Series(np.where(is_changed, rnd.randint(-2, 3, size=len(quotes)), np.nan), index=quotes.index)
+        return pd.DataFrame({'c': quotes['c'], 'q': q.ffill().fillna(0.0)})
+
+    def compose_portfolio(self, date, account, mf):
+        return mf['q'].copy()
+
+
+class QtyMetricKernelStrategy(QtyMetricStrategy):
+    """
+    The same positions as QtyMetricStrategy, but the backtest loop is compiled
+    """
+    compose_kernel = _qty_metric_kernel
+
+
+def make_costs_assets():
+    """
+    Assets with all kinds of costs, margin and point value settings
+    """
+    assets = [make_rnd_asset(f'cst{i}') for i in range(6)]
+    idx = assets[0].quotes().index
+    for a in assets:
+        # Make prices positive
+        a.kwargs['quotes'] = a.quotes() + 100
+    settings = [
+        {'costs': {'type': 'percent', 'value': 0.001}, 'margin': 0.5},
+        {'costs': {'type': 'dollar', 'value': 2}, 'margin': 1500.0, 'point_value': 50.0},
+        {'costs': {'type': 'dynamic', 'value': pd.DataFrame({'c': 0.5, 'exec': 0.7}, index=idx)},
+         'margin': pd.Series(100.0, index=idx), 'point_value': pd.Series(np.linspace(1, 2, len(idx)), index=idx)},
+        {},
+        {'costs': {'type': 'percent', 'value': 0.002}},
+        {'point_value': 10},
+    ]
+    return [Asset(**dict(a.kwargs, **kw)) for a, kw in zip(assets, settings)]
+
+
+def assert_trades_equal(test_case, df_expected, df_trades):
+    test_case.assertEqual(list(df_expected.columns), list(df_trades.columns))
+    test_case.assertEqual(len(df_expected), len(df_trades))
+    for col in df_expected.columns:
+        if df_expected[col].dtype == object:
+            test_case.assertEqual([str(v) for v in df_expected[col]], [str(v) for v in df_trades[col]], col)
+        else:
+            test_case.assertTrue(np.allclose(df_expected[col].values.astype(np.float64),
+                                             df_trades[col].values.astype(np.float64), equal_nan=True), col)
 
 
 class ReportTestCase(unittest.TestCase):
@@ -68,6 +232,494 @@ class ReportTestCase(unittest.TestCase):
         self.assertEqual(2, len(df_trades))
         self.assertEqual(True, isinstance(df_trades, pd.DataFrame))
 
+    def test__produce_trades_list_fast(self):
+        acc = Account(buffer_len=5)
+        acc._transactions = self.transactions
+        assert_trades_equal(self, Report._produce_trades_list(acc), Report._produce_trades_list_fast(acc))
+
+        acc = Backtester.run(RandomPositionStrategy(), [make_rnd_asset(f'rnd{i}') for i in range(5)])
+        df_expected = Report._produce_trades_list(acc)
+        df_trades = Report._produce_trades_list_fast(acc)
+        self.assertGreater(len(df_trades), 100)
+        assert_trades_equal(self, df_expected, df_trades)
+
+        # Trades must start from opening transaction
+        acc = Account(buffer_len=5)
+        acc._transactions = self.transactions[2:]
+        self.assertRaises(AssertionError, Report._produce_trades_list_fast, acc)
+
+        # Empty account
+        self.assertEqual(0, len(Report._produce_trades_list_fast(Account(buffer_len=5))))
+
+    def test_report_parallel_lazy(self):
+        universe = [make_rnd_asset(f'rnd{i}') for i in range(3)]
+        accounts = [Backtester.run(RandomPositionStrategy(params={'seed': i}), universe,
+                                   acc_name=f'acc{i}', acc_initial_capital=1000) for i in range(3)]
+        rpt = Report(accounts)
+        self.assertEqual(3, len(rpt.results))
+
+        for kwargs in [{'lazy': True}, {'n_jobs': 2}, {'n_jobs': 2, 'lazy': True}]:
+            rpt_test = Report(accounts, **kwargs)
+            if kwargs.get('lazy'):
+                self.assertEqual(0, len(rpt_test.results))
+                self.assertEqual((0, 0), (len(rpt_test._stats), len(rpt_test._trades_arrays)))
+
+            self.assertEqual(True, rpt.stats().equals(rpt_test.stats()))
+            assert_trades_equal(self, rpt.trades('acc1'), rpt_test.trades('acc1'))
+            if kwargs.get('lazy'):
+                self.assertEqual(1, len(rpt_test.results))
+            self.assertEqual(True, rpt.series('equity').equals(rpt_test.series('equity')))
+            self.assertEqual(3, len(rpt_test.results))
+
+        self.assertRaises(ValueError, Report, [accounts[0], accounts[0]])
+
+        # Trades are built by more than one worker, the results are the same as of serial build
+        with mock.patch('yauber_backtester._report._build_trades_arrays', _trades_arrays_pid):
+            rpt_test = Report(accounts, n_jobs=2, lazy=True)
+            rpt_test._build_trades(accounts)
+        pids = {rpt_test._trades_arrays[acc].pop('pid') for acc in accounts}
+        self.assertEqual(2, len(pids))
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(True, rpt.stats().equals(rpt_test.stats()))
+        for acc in accounts:
+            assert_trades_equal(self, rpt.trades(acc.name), rpt_test.trades(acc.name))
+
+        # Workers which are not forked get transactions logs pickled with assets by ticker
+        logs = [acc._transactions_log() for acc in accounts]
+        payload = pickle.loads(pickle.dumps(_TransactionsPayload(logs)))
+        self.assertEqual(str(logs[1][0][1]), payload.logs[1][0][1])
+        _trades_init(payload)
+        for k, log in enumerate(logs):
+            trades, trades_worker = _build_trades_arrays(log), _build_trades_worker(k)
+            for key, arr in trades.items():
+                self.assertTrue(np.array_equal(arr, trades_worker[key], equal_nan=True), key)
+
+    def test_rolling(self):
+        universe = [make_rnd_asset(f'rnd{i}') for i in range(3)]
+        accounts = [Backtester.run(RandomPositionStrategy(params={'seed': i}), universe,
+                                   acc_name=f'acc{i}', acc_initial_capital=1000) for i in range(2)]
+        rpt = Report(accounts)
+        window = 20
+
+        for acc in accounts:
+            equity = acc.as_dataframe()['equity']
+            rets = equity.pct_change(fill_method=None)
+
+            def assert_close(expected, stat_name, **kwargs):
+                self.assertTrue(np.allclose(expected.values, rpt.rolling(stat_name, window, **kwargs)[acc].values,
+                                            equal_nan=True), stat_name)
+
+            assert_close(equity.pct_change(window, fill_method=None) * 100, 'return')
+            assert_close(rets.rolling(window).std() * np.sqrt(252) * 100, 'volatility')
+            assert_close(rets.rolling(window).mean() / rets.rolling(window).std() * np.sqrt(252), 'sharpe')
+            assert_close((equity / equity.rolling(window, min_periods=1).max() - 1) * 100, 'current_drawdown')
+            assert_close(equity.rolling(window, min_periods=1).apply(lambda x: (x / x.cummax() - 1).min()) * 100,
+                         'max_drawdown')
+            assert_close(rets.rolling(window).apply(lambda x: (x > 0).sum() / (x != 0).sum(), raw=True) * 100,
+                         'winrate')
+            assert_close(rets.rolling(window, min_periods=5).std() * np.sqrt(12) * 100, 'volatility',
+                         min_periods=5, periods_per_year=12)
+
+        self.assertRaises(ValueError, rpt.rolling, 'unknown', window)
+        self.assertRaises(ValueError, rpt.rolling, 'sharpe', 1)
+
+        # Running variance must stay accurate after huge returns leave the window
+        rnd = np.random.RandomState(0)
+        rets = np.concatenate([rnd.normal(0, 1000, 50).clip(-0.9, None), rnd.normal(0, 1e-6, 500)])
+        equity = 1000 * np.cumprod(1 + rets)
+        vol = _rolling_stats_kernel(equity[None, :], window, window, 1)[1, 0]
+        rets = equity[1:] / equity[:-1] - 1
+        expected = [np.std(rets[i - window:i], ddof=1) for i in range(window, len(equity))]
+        self.assertTrue(np.allclose(expected, vol[window:], rtol=1e-6, atol=0))
+
+        # Window max drawdown of the long window on the long history (with data holes)
+        equity = 1000 * np.cumprod(1 + rnd.normal(0, 0.01, 5000))
+        equity[rnd.randint(0, len(equity), 200)] = np.nan
+        long_window = 1000
+        mdd = _rolling_stats_kernel(equity[None, :], long_window, long_window, 1)[4, 0]
+        for i in range(len(equity)):
+            x = equity[max(i - long_window + 1, 0):i + 1]
+            x = x[~np.isnan(x)]
+            self.assertAlmostEqual((x / np.maximum.accumulate(x) - 1).min(), mdd[i])
+
+    def test_bootstrap(self):
+        universe = [make_rnd_asset(f'rnd{i}') for i in range(3)]
+        accounts = [Backtester.run(RandomPositionStrategy(params={'seed': i}), universe,
+                                   acc_name=f'acc{i}', acc_initial_capital=1000) for i in range(2)]
+        rpt = Report(accounts)
+
+        df_bs = rpt.bootstrap(n=2000, seed=7)
+        self.assertEqual(['CAGR %', 'MaxDD %', 'Return %', 'Trade % Mean', 'WinRate %'], list(df_bs.index))
+        self.assertEqual([('acc0', '5%'), ('acc0', '25%'), ('acc0', '50%'), ('acc0', '75%'), ('acc0', '95%')],
+                         [(str(a), p) for a, p in df_bs.columns[:5]])
+        self.assertEqual(True, df_bs.equals(rpt.bootstrap(n=2000, seed=7)))
+
+        for acc in accounts:
+            tbl = df_bs[acc]
+            self.assertTrue(np.all(np.diff(tbl.values, axis=1) >= 0))
+            self.assertTrue(np.all(tbl.loc['MaxDD %'] <= 0))
+            # Resampled CAGR distribution must cover historical CAGR
+            cagr = rpt.stats()[acc]['CAGR %']
+            self.assertTrue(tbl.loc['CAGR %', '5%'] < cagr < tbl.loc['CAGR %', '95%'])
+
+        df_bs = rpt.bootstrap(n=4000, method='block', block_size=5, percentiles=(50,), n_jobs=2, seed=7)
+        self.assertEqual((5, 2), df_bs.shape)
+        # Random streams don't depend on n_jobs
+        self.assertEqual(True, df_bs.equals(rpt.bootstrap(n=4000, method='block', block_size=5, percentiles=(50,),
+                                                          seed=7)))
+        self.assertRaises(ValueError, rpt.bootstrap, n=10, method='unknown')
+
+    def test_benchmark(self):
+        universe = [make_rnd_asset(f'rnd{i}') for i in range(3)]
+        accounts = [Backtester.run(RandomPositionStrategy(params={'seed': i}), universe,
+                                   acc_name=f'acc{i}', acc_initial_capital=1000) for i in range(2)]
+        dt_index = pd.date_range('2015-12-01', '2018-01-01')
+        px = pd.Series(100 + np.random.normal(size=len(dt_index)).cumsum(), index=dt_index)
+        bench = Asset(ticker='BENCH', quotes=pd.DataFrame({'c': px, 'exec': px}))
+
+        self.assertRaises(ValueError, Report(accounts).benchmark_stats)
+        self.assertRaises(ValueError, Report, accounts, benchmark='BENCH')
+
+        rpt = Report(accounts, benchmark=bench)
+        df_stats = rpt.benchmark_stats()
+        window = 30
+        for acc in accounts:
+            equity = acc.as_dataframe()['equity']
+            x = equity.pct_change(fill_method=None)
+            y = px.reindex(equity.index).pct_change(fill_method=None)
+            valid = x.notnull() & y.notnull()
+            beta = np.cov(x[valid], y[valid])[0, 1] / np.var(y[valid], ddof=1)
+            self.assertAlmostEqual(beta, df_stats.loc['beta', acc])
+            self.assertAlmostEqual((x[valid].mean() - beta * y[valid].mean()) * 252, df_stats.loc['alpha', acc])
+            self.assertAlmostEqual(np.corrcoef(x[valid], y[valid])[0, 1], df_stats.loc['correlation', acc])
+            te = (x - y)[valid].std() * np.sqrt(252)
+            self.assertAlmostEqual(te, df_stats.loc['tracking_error', acc])
+            self.assertAlmostEqual((x - y)[valid].mean() * 252 / te, df_stats.loc['information_ratio', acc])
+
+            self.assertTrue(np.allclose((x.rolling(window).cov(y) / y.rolling(window).var()).values,
+                                        rpt.benchmark_rolling('beta', window)[acc].values, equal_nan=True))
+            self.assertTrue(np.allclose(x.rolling(window).corr(y).values,
+                                        rpt.benchmark_rolling('correlation', window)[acc].values, equal_nan=True))
+            self.assertTrue(np.allclose(((x - y).rolling(window).std() * np.sqrt(252)).values,
+                                        rpt.benchmark_rolling('tracking_error', window)[acc].values, equal_nan=True))
+
+        self.assertRaises(ValueError, rpt.benchmark_rolling, 'unknown', window)
+
+        # Running co-moments must stay accurate after huge returns leave the window
+        rnd = np.random.RandomState(0)
+        y = np.concatenate([rnd.normal(0, 1000, 50), rnd.normal(0, 1e-6, 500)])
+        x = 0.5 * y + np.concatenate([rnd.normal(0, 100, 50), rnd.normal(0, 1e-7, 500)])
+        beta = _rolling_benchmark_kernel(x[None, :], y, window, window, 1)[0, 0]
+        expected = [np.cov(x[i0:i0 + window], y[i0:i0 + window])[0, 1] / np.var(y[i0:i0 + window], ddof=1)
+                    for i0 in range(len(y) - window + 1)]
+        self.assertTrue(np.allclose(expected, beta[window - 1:], rtol=1e-6, atol=0))
+
+    def test_exposure(self):
+        universe = [make_rnd_asset(f'rnd{i}') for i in range(4)]
+        acc = Backtester.run(RandomPositionStrategy(), universe, acc_name='acc', acc_initial_capital=1000)
+        rpt = Report([acc])
+
+        # Position history must be the same as replay of transactions
+        df_qty = acc.positions_history('qty')
+        df_tr = acc.as_transactions()
+        df_tr['ticker'] = df_tr['asset'].map(str)
+        df_replay = df_tr.groupby(['date', 'ticker'])['qty'].sum().unstack().fillna(0).cumsum()
+        df_replay = df_replay.reindex(df_qty.index).ffill().fillna(0)
+        df_qty.columns = [str(a) for a in df_qty.columns]
+        self.assertTrue(np.allclose(df_qty[df_replay.columns].values, df_replay.values))
+
+        df_value = acc.positions_history('value')
+        self.assertTrue(np.allclose(df_value.abs().sum(axis=1), rpt.exposure('gross')['acc']))
+        self.assertTrue(np.allclose(df_value.sum(axis=1), rpt.exposure('net')['acc']))
+        self.assertTrue(np.allclose(df_value.clip(lower=0).sum(axis=1), rpt.exposure('long')['acc']))
+        self.assertTrue(np.allclose(df_value.clip(upper=0).sum(axis=1), rpt.exposure('short')['acc']))
+        self.assertTrue(np.allclose((df_qty != 0).sum(axis=1), rpt.exposure('n_positions')['acc']))
+        weights = df_value.abs().div(df_value.abs().sum(axis=1), axis=0)
+        self.assertTrue(np.allclose((weights ** 2).sum(axis=1, min_count=1), rpt.exposure('concentration')['acc'], equal_nan=True))
+
+        unit_value = (df_value / df_qty).abs().ffill()
+        turnover = (df_qty.diff().abs() * unit_value.where(df_qty != 0, unit_value.shift(1))).sum(axis=1)
+        self.assertTrue(np.allclose(turnover.values[1:], rpt.exposure('turnover')['acc'].values[1:]))
+        self.assertTrue(np.all(rpt.exposure('holding_bars')['acc'].dropna() >= 1))
+
+        self.assertRaises(ValueError, rpt.exposure, 'unknown')
+        self.assertRaises(ValueError, acc.positions_history, 'unknown')
+
+        # Without history the results are the same, but exposure and attribution are not available
+        acc_nh = Backtester.run(RandomPositionStrategy(), universe, acc_name='acc_nh', acc_initial_capital=1000,
+                                acc_history=False)
+        self.assertTrue(np.allclose(acc.as_dataframe()['equity'].values, acc_nh.as_dataframe()['equity'].values,
+                                    equal_nan=True))
+        self.assertRaises(ValueError, acc_nh.positions_history)
+        self.assertRaises(ValueError, Report([acc_nh]).exposure, 'gross')
+        self.assertRaises(ValueError, Report([acc_nh]).attribution, 'acc_nh')
+
+    def test_attribution(self):
+        universe = [make_rnd_asset(f'rnd{i}') for i in range(4)]
+        acc = Backtester.run(RandomPositionStrategy(), universe, acc_name='acc', acc_initial_capital=1000)
+        rpt = Report([acc])
+        df_tr = acc.as_transactions()
+        df_tr['ticker'] = df_tr['asset'].map(str)
+
+        df_attr = rpt.attribution('acc')
+        self.assertEqual(['pnl', 'costs'], list(df_attr.columns))
+        df_expected = df_tr.groupby('ticker')[['pnl_execution', 'costs_exec']].sum()
+        self.assertTrue(np.allclose(df_expected.values, df_attr.loc[df_expected.index].values))
+
+        df_month = rpt.attribution('acc', by='month')
+        self.assertEqual(25, len(df_month))
+        acc_pnl = acc.as_dataframe()['pnl']
+        self.assertTrue(np.allclose(acc_pnl.groupby(acc_pnl.index.to_period('M')).sum().values, df_month['pnl'].values))
+        self.assertAlmostEqual(acc_pnl.sum(), rpt.attribution('acc', by='year')['pnl'].sum())
+
+        sectors = {'RND_rnd0': 'tech', 'RND_rnd1': 'tech', universe[2]: 'energy'}
+        df_sector = rpt.attribution('acc', by=sectors)
+        self.assertEqual(['tech', 'energy', 'N/A'], sorted(df_sector.index, key=['tech', 'energy', 'N/A'].index))
+        self.assertAlmostEqual(df_attr.loc[['RND_rnd0', 'RND_rnd1'], 'pnl'].sum(), df_sector.loc['tech', 'pnl'])
+        self.assertAlmostEqual(df_attr.loc['RND_rnd3', 'costs'], df_sector.loc['N/A', 'costs'])
+
+        df_callable = rpt.attribution('acc', by=lambda a: str(a)[-1] in '01')
+        self.assertAlmostEqual(df_sector.loc['tech', 'pnl'], df_callable.loc[True, 'pnl'])
+
+        self.assertRaises(ValueError, rpt.attribution, 'acc', by='unknown')
+
+    def test_holding_bars_accrual(self):
+        universe = [make_rnd_asset(f'rnd{i}') for i in range(4)]
+        for strategy_cls in [RandomPositionStrategy, MonthlyNotebookStrategy]:
+            acc_v = Backtester.run(strategy_cls(), universe, acc_name='acc', acc_verbose=True)
+            acc = Backtester.run(strategy_cls(), universe, acc_name='acc')
+
+            df_v, df = acc_v.as_dataframe(), acc.as_dataframe()
+            for col in df_v.columns:
+                self.assertTrue(np.allclose(df_v[col], df[col], equal_nan=True), col)
+
+            # Holding bars are not logged
+            tr_v, tr = acc_v.as_transactions(), acc.as_transactions()
+            self.assertLess(len(tr), len(tr_v))
+            self.assertLessEqual((tr['position_action'] == 0).sum(), (tr_v['position_action'] == 0).sum())
+            for col in ['pnl_close', 'pnl_execution']:
+                self.assertAlmostEqual(tr_v[col].sum(), tr[col].sum())
+
+            rpt_v, rpt = Report([acc_v]), Report([acc])
+            attr_v = rpt_v.attribution('acc')
+            self.assertTrue(np.allclose(attr_v.values, rpt.attribution('acc').loc[list(attr_v.index)].values))
+            self.assertTrue(np.allclose(rpt_v.attribution('acc', by='month').values,
+                                        rpt.attribution('acc', by='month').values))
+
+            # Reading the log doesn't change the account
+            acc_read = Backtester.run(_TransactionsReader(strategy_cls()), universe, acc_name='acc')
+            tr_read = acc_read.as_transactions()
+            self.assertEqual(len(tr), len(tr_read))
+            self.assertTrue(np.allclose(tr['pnl_execution'], tr_read['pnl_execution'], equal_nan=True))
+            self.assertEqual(len(tr), len(acc_read.as_transactions()))
+
+            # Closed trades are identical, open trades might differ by the last bar PnL (NaN exec price)
+            # Trades closed at the same bar might be in different order (transactions are not sorted by asset)
+            trades_v, trades = [df.assign(ticker=df['asset'].map(str)).sort_values(['date_exit', 'ticker', 'date_entry'])
+                                .drop(columns='ticker').reset_index(drop=True) for df in [rpt_v.trades('acc'), rpt.trades('acc')]]
+            is_closed = trades_v['qty_entered'] == trades_v['qty_exited']
+            self.assertGreater(is_closed.sum(), 0)
+            assert_trades_equal(self, trades_v[is_closed], trades[is_closed])
+            assert_trades_equal(self, trades_v.drop(columns=['pnl', 'pnl_perc']),
+                                trades.drop(columns=['pnl', 'pnl_perc']))
+
+    def test_holding_bars_lookups(self):
+        # Point value and costs of holding bars are precomputed for the timeline, custom assets use lookup methods
+        universe = make_costs_assets()
+        universe_custom = [_CustomLookupAsset(**a.kwargs) for a in universe]
+        for strategy_cls in [RandomPositionStrategy, MonthlyNotebookStrategy]:
+            kw = dict(acc_name='acc', acc_initial_capital=100000)
+            df = Backtester.run(strategy_cls(), universe, **kw).as_dataframe()
+            df_custom = Backtester.run(strategy_cls(), universe_custom, **kw).as_dataframe()
+            for col in df.columns:
+                self.assertTrue(np.allclose(df[col], df_custom[col], equal_nan=True), col)
+
+        # Holding bars don't create bar dates unless some asset uses date lookups
+        for assets, is_called in [(universe, False), (universe_custom, True)]:
+            with mock.patch.object(Account, '_bar_date', autospec=True, side_effect=Account._bar_date) as bar_date:
+                Backtester.run(QtyMetricStrategy(rebalance_calendar='M'), assets, acc_name='acc',
+                               acc_initial_capital=100000)
+                self.assertEqual(is_called, bar_date.called)
+
+    def test_position_delta(self):
+        universe = [make_rnd_asset(f'rnd{i}') for i in range(4)]
+        for verbose in [True, False]:
+            acc = Backtester.run(RandomPositionStrategy(), universe, acc_name='acc', acc_verbose=verbose)
+            acc_delta = Backtester.run(RandomDeltaStrategy(), universe, acc_name='acc', acc_verbose=verbose)
+
+            df, df_delta = acc.as_dataframe(), acc_delta.as_dataframe()
+            for col in df.columns:
+                self.assertTrue(np.allclose(df[col], df_delta[col], equal_nan=True), col)
+            self.assertEqual({str(k): (v.qty, v.ctx) for k, v in acc.position().items()},
+                             {str(k): (v.qty, v.ctx) for k, v in acc_delta.position().items()})
+            self.assertEqual(len(Report([acc]).trades('acc')), len(Report([acc_delta]).trades('acc')))
+
+        acc = Account(buffer_len=5)
+        self.assertRaises(ValueError, acc._process_delta, universe[0].quotes().index[0], PositionDelta({'A': 1.0}))
+        self.assertRaises(ValueError, acc._process_delta, universe[0].quotes().index[0],
+                          PositionDelta().close('A'))
+
+    def test_position_array(self):
+        universe = make_costs_assets()
+        for verbose in [True, False]:
+            for params in [{}, {'mixed': True}]:
+                acc = Backtester.run(RandomPositionStrategy(), universe, acc_name='acc', acc_verbose=verbose,
+                                     acc_initial_capital=100000)
+                acc_arr = Backtester.run(RandomArrayStrategy(params=params), universe, acc_name='acc',
+                                         acc_verbose=verbose, acc_initial_capital=100000)
+
+                df, df_arr = acc.as_dataframe(), acc_arr.as_dataframe()
+                for col in df.columns:
+                    self.assertTrue(np.allclose(df[col], df_arr[col], equal_nan=True), (verbose, params, col))
+                self.assertEqual({str(k): v.qty for k, v in acc.position().items() if v.qty != 0},
+                                 {str(k): v.qty for k, v in acc_arr.position().items()})
+
+                self.assertTrue(np.allclose(acc.positions_history('value').values,
+                                            acc_arr.positions_history('value')[acc.positions_history().columns].values))
+
+                rpt, rpt_arr = Report([acc]), Report([acc_arr])
+                attr = rpt.attribution('acc')
+                self.assertTrue(np.allclose(attr.values, rpt_arr.attribution('acc').loc[list(attr.index)].values))
+
+                tr, tr_arr = acc.as_transactions(), acc_arr.as_transactions()
+                for col in ['pnl_close', 'pnl_execution', 'costs_close', 'costs_exec']:
+                    self.assertAlmostEqual(tr[col].sum(), tr_arr[col].sum())
+                self.assertEqual(len(rpt.trades('acc')), len(rpt_arr.trades('acc')))
+
+        acc = Account(buffer_len=5)
+        panel = ExecutionPanel(universe, universe[0].quotes().index)
+        dt = universe[0].quotes().index[0]
+        self.assertRaises(ValueError, acc._process_array, dt, 0, np.ones(2), None, panel)
+        self.assertRaises(ValueError, acc._process_array, dt, 0, np.full(len(universe), np.nan), None, panel)
+        self.assertRaises(ValueError, acc._process_array, dt, 0, np.ones(len(universe)), [None], panel)
+
+        # Late starting asset has no market data before its first quote, opening position there fails
+        index = universe[0].quotes().index
+        late = Asset(ticker='LATE', quotes=universe[0].quotes().iloc[10:])
+        panel = ExecutionPanel([universe[0], late], index)
+        self.assertEqual([0, 10], list(panel.first_bar))
+        self.assertTrue(np.all(np.isnan(panel.close[:10, 1])))
+        self.assertTrue(np.allclose(late.quotes()['c'].values, panel.close[10:, 1]))
+        acc = Account(buffer_len=len(index))
+        acc._process_array(index[0], 0, np.array([1.0, 0.0]), None, panel)
+        self.assertRaises(KeyError, acc._process_array, index[1], 1, np.array([1.0, 1.0]), None, panel)
+
+    def test_compose_kernel(self):
+        universe = make_costs_assets()
+        for verbose in [True, False]:
+            for calendar in [None, 'M']:
+                kw = dict(acc_name='acc', acc_verbose=verbose, acc_initial_capital=100000)
+                acc = Backtester.run(QtyMetricStrategy(rebalance_calendar=calendar), universe, **kw)
+                acc_k = Backtester.run(QtyMetricKernelStrategy(rebalance_calendar=calendar), universe, **kw)
+
+                df, df_k = acc.as_dataframe(), acc_k.as_dataframe()
+                self.assertEqual(list(df.columns), list(df_k.columns))
+                for col in df.columns:
+                    self.assertTrue(np.allclose(df[col], df_k[col], equal_nan=True), (verbose, calendar, col))
+                self.assertEqual({str(k): v.qty for k, v in acc.position().items()},
+                                 {str(k): v.qty for k, v in acc_k.position().items()})
+
+                self.assertTrue(np.allclose(acc.positions_history('value').values,
+                                            acc_k.positions_history('value').values))
+                attr = Report([acc]).attribution('acc')
+                self.assertTrue(np.allclose(attr.values, Report([acc_k]).attribution('acc').loc[list(attr.index)].values))
+
+                # Holding transactions of the bar might be logged in different assets order
+                tr, tr_k = [t.reset_index().assign(ticker=t['asset'].map(str).values)
+                            .sort_values(['date', 'ticker'], kind='mergesort')
+                            for t in (acc.as_transactions(), acc_k.as_transactions())]
+                self.assertEqual(len(tr), len(tr_k))
+                for col in ['qty', 'price_close', 'price_exec', 'pnl_close', 'pnl_execution', 'costs_close', 'costs_exec']:
+                    self.assertTrue(np.allclose(tr[col].values, tr_k[col].values, equal_nan=True), (verbose, col))
+                self.assertEqual(len(Report([acc]).trades('acc')), len(Report([acc_k]).trades('acc')))
+
+        # Dates range of the run
+        kw = dict(acc_initial_capital=100000, start='2016-06-01', end='2017-06-01')
+        df = Backtester.run(QtyMetricStrategy(rebalance_calendar='W'), universe, **kw).as_dataframe()
+        df_k = Backtester.run(QtyMetricKernelStrategy(rebalance_calendar='W'), universe, **kw).as_dataframe()
+        self.assertEqual(pd.Timestamp('2016-06-01'), df_k.index[0])
+        self.assertNotEqual(0, df_k['margin'][0])
+        self.assertTrue(np.allclose(df['equity'], df_k['equity'], equal_nan=True))
+
+        # Early stopping rules
+        for stop in [{'stop_max_drawdown': 50}, {'stop_max_drawdown_pct': 0.1}, {'stop_equity_floor': 99990}]:
+            kw = dict(acc_name='acc', acc_initial_capital=100000, **stop)
+            acc = Backtester.run(QtyMetricStrategy(), universe, **kw)
+            acc_k = Backtester.run(QtyMetricKernelStrategy(), universe, **kw)
+            self.assertIsNotNone(acc.stopped_at)
+            self.assertEqual(acc.stopped_at, acc_k.stopped_at)
+            self.assertEqual({str(k): v.qty for k, v in acc.position().items()},
+                             {str(k): v.qty for k, v in acc_k.position().items()})
+            df, df_k = acc.as_dataframe(), acc_k.as_dataframe()
+            self.assertEqual(acc.stopped_at, df_k.index[-1])
+            for col in df.columns:
+                self.assertTrue(np.allclose(df[col], df_k[col], equal_nan=True), (stop, col))
+
+        self.assertRaises(ValueError, Backtester.run, QtyMetricKernelStrategy(), universe, stop_callback=lambda a: False)
+        self.assertRaises(ValueError, Backtester.run, QtyMetricKernelStrategy(), universe, metrics_typed=True)
+        # Not compiled kernel
+        strategy = QtyMetricKernelStrategy()
+        strategy.compose_kernel = _qty_metric_kernel.py_func
+        self.assertRaises(ValueError, Backtester.run, strategy, universe)
+
+    def test_calc_stats_batch(self):
+        universe = [make_rnd_asset(f'rnd{i}') for i in range(3)]
+        accounts = [Backtester.run(RandomPositionStrategy(params={'seed': i}), universe,
+                                   acc_name=f'acc{i}', acc_initial_capital=1000) for i in range(2)]
+        rpt = Report(accounts)
+
+        # Reference: pandas implementation of stats
+        for acc in accounts:
+            acc_df = acc.as_dataframe()
+            equity = acc_df['equity'].ffill()
+            df_trades = rpt.trades(acc)
+            stats = rpt.stats()[acc]
+            self.assertAlmostEqual((equity - equity.expanding().max()).min(), stats['MaxDD $'])
+            self.assertAlmostEqual((equity / equity.expanding().max() - 1).min() * 100, stats['MaxDD %'])
+            # Drawdown series has the same drawdown as the stats
+            mdd = rpt.series('mdd')[acc]
+            self.assertTrue(np.allclose((equity / equity.expanding().max() - 1) * 100, mdd, equal_nan=True))
+            self.assertAlmostEqual(mdd.min(), stats['MaxDD %'])
+            self.assertAlmostEqual(equity[-1] - acc_df['capital_invested'].mean(), stats['NetProfit $'])
+            years = (equity.index[-1] - equity.index[0]).days / 365.2425
+            self.assertAlmostEqual(((equity[-1] / equity[0]) ** (1 / years) - 1) * 100, stats['CAGR %'])
+            self.assertAlmostEqual(df_trades['pnl_perc'].fillna(0).std() * 100, stats['Trade % StDev'])
+            self.assertEqual(f"{(df_trades['pnl'] > 0).mean() * 100:0.2f}%", stats['WinRate'])
+
+        # Batched (n_accounts, time) input
+        trades = [rpt.trades(acc) for acc in accounts]
+        df_stats = Report.calc_stats(
+            accounts[0].as_dataframe().index.values,
+            np.vstack([acc.as_dataframe()['equity'].values for acc in accounts]),
+            np.vstack([acc.as_dataframe()['capital_invested'].values for acc in accounts]),
+            np.concatenate([t['pnl'].values for t in trades]),
+            np.concatenate([t['pnl_perc'].values for t in trades]),
+            np.cumsum([0] + [len(t) for t in trades]),
+            names=[str(acc) for acc in accounts],
+        )
+        self.assertEqual(list(rpt.stats().index), list(df_stats.index))
+        self.assertEqual(list(rpt.stats().loc['WinRate']), list(df_stats.loc['WinRate']))
+        self.assertTrue(np.allclose(rpt.stats().drop('WinRate').values.astype(np.float64),
+                                    df_stats.drop('WinRate').values.astype(np.float64)))
+
+        # Accounts of different length padded to the same time axis
+        equity = accounts[1].as_dataframe()['equity'].values
+        n = len(equity) // 2
+        padded = np.vstack([equity, np.concatenate([equity[:n], np.full(len(equity) - n, np.nan)])])
+        df_padded = Report.calc_stats(np.vstack([accounts[0].as_dataframe().index.values] * 2), padded, padded,
+                                      [1.0, 1.0], [0.01, 0.01], [0, 1, 2], n_bars=[len(equity), n])
+        df_short = Report.calc_stats(accounts[0].as_dataframe().index.values[:n], equity[None, :n], equity[None, :n],
+                                     [1.0], [0.01], [0, 1])
+        for key in ['CAGR %', 'NetProfit $', 'MaxDD $']:
+            self.assertAlmostEqual(df_short.loc[key, 0], df_padded.loc[key, 1])
+        self.assertEqual(Report.calc_stats(np.arange(3), np.ones((0, 3)), np.ones((0, 3)), [], [], [0]).shape,
+                         (len(rpt.stats()), 0))
+
+        # No trades, no stats
+        df_stats = Report.calc_stats(np.arange(3), np.ones((1, 3)), np.ones((1, 3)), [], [], [0, 0])
+        self.assertEqual(0, df_stats.loc['NumberOfTrades', 0])
+        self.assertTrue(np.isnan(df_stats.loc['MaxDD $', 0]))
+
 
 
 if __name__ == '__main__':
@@ -1,5 +1,6 @@
 import unittest
 from yauber_backtester._strategy import Strategy
+from yauber_backtester._cache import IndicatorCache, default_cache
 
 
 class StrategyTestCase(unittest.TestCase):
@@ -17,6 +18,10 @@ class StrategyTestCase(unittest.TestCase):
         self.assertEqual(str(s), 'BaseStrategy')
         self.assertEqual(repr(s), "Strategy<BaseStrategy>")
         self.assertEqual(s.initialize(), None)
+        self.assertIs(s.cache, default_cache())
+
+        cache = IndicatorCache()
+        self.assertIs(Strategy(cache=cache).cache, cache)
 
 
 if __name__ == '__main__':
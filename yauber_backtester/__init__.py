@@ -3,4 +3,5 @@ from ._account import Account
 from ._strategy import Strategy
 from ._backtester import Backtester
 from ._report import Report
-from ._containers import MFrame
\ No newline at end of file
+from ._containers import MFrame, UniversePanel, PositionDelta
+from ._cache import IndicatorCache
@@ -3,10 +3,332 @@ from ._asset import Asset
 from datetime import datetime
 import pandas as pd
 import numpy as np
-from ._containers import PositionInfo
+from ._containers import PositionInfo, PositionDelta
 from math import isfinite
+import numba
 
 
+TRANSACTION_KEYS = ('date', 'asset', 'position_action', 'qty', 'price_close', 'price_exec',
+                    'costs_close', 'costs_exec', 'pnl_close', 'pnl_execution', 'context')
+"""Transaction records keys"""
+
+
+TX_BAR, TX_ASSET, TX_ACTION, TX_QTY, TX_CPX, TX_EPX, TX_COSTS_C, TX_COSTS_E, TX_PNL_C, TX_PNL_E = range(10)
+"""Columns of transactions records of the compiled engine (see. _kernel_run_loop)"""
+
+# Asset lookups kwargs of the assets without bar lookups support (see. Account._calc_transactions())
+_NO_ROW = {}
+
+
+@numba.jit(nopython=True)
+def _grow(buf):  # pragma: no cover
+    result = np.empty((buf.shape[0] * 2, buf.shape[1]))
+    result[:buf.shape[0]] = buf
+    return result
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def _kernel_run_loop(compose_kernel, metrics, rebalance, close, exec_px, point_value, costs_c, costs_e, margin_unit,
+                     initial_equity, initial_equity_exec, verbose, stop_dd, stop_dd_pct, stop_floor):  # pragma: no cover
+    """
+    Compiled run loop: calls compose_kernel(i, metrics[i], positions, equity) -> qty_array at every rebalancing bar and
+    processes transactions, costs, margin and PnL (the same logic as Account._process_array())
+    The loop stops after the bar where equity (at execution) breaches stop_dd / stop_dd_pct / stop_floor (NaN - no rule),
+    see. Account._is_stop()
+    :return: tuple (per bar arrays (bars x 7): pnl close, pnl exec, costs close, costs exec, potential costs close,
+             potential costs exec, margin; transactions records; positions records (asset, qty, value) and counts
+             per bar; attribution records (asset, pnl, costs) and counts per bar; final qty, accrued PnL close / exec)
+             arrays of bars are truncated at the stop bar
+    """
+    n_bars, n_assets = close.shape
+    qty = np.zeros(n_assets)
+    prev_c = np.full(n_assets, np.nan)
+    prev_e = np.full(n_assets, np.nan)
+    accr_c = np.zeros(n_assets)
+    accr_e = np.zeros(n_assets)
+
+    bars = np.empty((n_bars, 7))
+    tx = np.empty((max(16, n_assets), 10))
+    n_tx = 0
+    pos = np.empty((max(16, n_assets), 3))
+    n_pos = 0
+    pos_cnt = np.zeros(n_bars, dtype=np.int64)
+    attr = np.empty((max(16, n_assets), 3))
+    n_attr = 0
+    attr_cnt = np.zeros(n_bars, dtype=np.int64)
+    hold_k = np.empty(n_assets, dtype=np.int64)
+    hold_pnl = np.empty((n_assets, 2))
+
+    equity = initial_equity
+    equity_exec = initial_equity_exec
+    equity_peak = initial_equity_exec
+    n_done = n_bars
+    for i in range(n_bars):
+        if rebalance[i]:
+            new_qty = compose_kernel(i, metrics[i], qty.copy(), equity)
+            if len(new_qty) != n_assets:
+                raise ValueError('compose_kernel() must return qty array aligned with assets')
+        else:
+            new_qty = qty
+
+        pnl_c = 0.0
+        pnl_e = 0.0
+        t_costs_c = 0.0
+        t_costs_e = 0.0
+        pot_c = 0.0
+        pot_e = 0.0
+        margin = 0.0
+        n_hold = 0
+
+        for k in range(n_assets):
+            pq = qty[k]
+            q = new_qty[k]
+            if pq == 0 and q == 0:
+                continue
+            if not np.isfinite(q):
+                raise ValueError('compose_kernel() qty array must contain only finite numbers')
+
+            cpx = close[i, k]
+            epx = exec_px[i, k]
+            pvk = point_value[i, k]
+
+            mc = 0.0
+            me = 0.0
+            if pq != 0:
+                mc = (cpx - prev_c[k]) * pq * pvk
+                me = (epx - prev_e[k]) * pq * pvk
+
+            dq = q - pq
+            cc = 0.0
+            ce = 0.0
+            if dq != 0:
+                cc = -abs(dq) * costs_c[i, k]
+                ce = -abs(dq) * costs_e[i, k]
+
+            if q != 0:
+                pot_c += -abs(q) * costs_c[i, k]
+                pot_e += -abs(q) * costs_e[i, k]
+                m = abs(q) * margin_unit[i, k]
+                if not np.isfinite(m):
+                    raise ValueError('Invalid margin requirements (NaN or Inf), check asset prices and margin settings')
+                margin += m
+
+                if n_pos == pos.shape[0]:
+                    pos = _grow(pos)
+                pos[n_pos, 0] = k
+                pos[n_pos, 1] = q
+                pos[n_pos, 2] = (epx if np.isfinite(epx) else cpx) * pvk * q
+                n_pos += 1
+                pos_cnt[i] += 1
+
+            pnl_c += mc + cc
+            pnl_e += me + ce
+            t_costs_c += cc
+            t_costs_e += ce
+
+            if n_attr == attr.shape[0]:
+                attr = _grow(attr)
+            attr[n_attr, 0] = k
+            attr[n_attr, 1] = me + ce
+            attr[n_attr, 2] = ce
+            n_attr += 1
+            attr_cnt[i] += 1
+
+            # Transactions
+            if n_tx + 3 > tx.shape[0]:
+                tx = _grow(tx)
+
+            if dq == 0:
+                if verbose:
+                    # Holding transactions are logged after transactions of changed positions
+                    hold_k[n_hold] = k
+                    hold_pnl[n_hold, 0] = mc
+                    hold_pnl[n_hold, 1] = me
+                    n_hold += 1
+                else:
+                    if np.isfinite(mc):
+                        accr_c[k] += mc
+                    if np.isfinite(me):
+                        accr_e[k] += me
+            else:
+                first_tx = n_tx
+                if pq == 0:
+                    tx[n_tx, TX_ACTION] = 1
+                    tx[n_tx, TX_QTY] = q
+                    tx[n_tx, TX_COSTS_C] = cc
+                    tx[n_tx, TX_COSTS_E] = ce
+                    tx[n_tx, TX_PNL_C] = cc
+                    tx[n_tx, TX_PNL_E] = ce
+                    n_tx += 1
+                elif q == 0:
+                    tx[n_tx, TX_ACTION] = -1
+                    tx[n_tx, TX_QTY] = -pq
+                    tx[n_tx, TX_COSTS_C] = cc
+                    tx[n_tx, TX_COSTS_E] = ce
+                    tx[n_tx, TX_PNL_C] = mc + cc
+                    tx[n_tx, TX_PNL_E] = me + ce
+                    n_tx += 1
+                elif (q > 0) != (pq > 0):
+                    # Reversal: close previous position and open new one in 2 transactions
+                    cc1 = -abs(pq) * costs_c[i, k]
+                    ce1 = -abs(pq) * costs_e[i, k]
+                    if abs(q) > abs(pq):
+                        tx[n_tx, TX_ACTION] = 1
+                    elif abs(q) < abs(pq):
+                        tx[n_tx, TX_ACTION] = -1
+                    else:
+                        tx[n_tx, TX_ACTION] = 0
+                    tx[n_tx, TX_QTY] = -pq
+                    tx[n_tx, TX_COSTS_C] = cc1
+                    tx[n_tx, TX_COSTS_E] = ce1
+                    tx[n_tx, TX_PNL_C] = mc + cc1
+                    tx[n_tx, TX_PNL_E] = me + ce1
+                    n_tx += 1
+                    cc2 = -abs(q) * costs_c[i, k]
+                    ce2 = -abs(q) * costs_e[i, k]
+                    tx[n_tx, TX_ACTION] = 1
+                    tx[n_tx, TX_QTY] = q
+                    tx[n_tx, TX_COSTS_C] = cc2
+                    tx[n_tx, TX_COSTS_E] = ce2
+                    tx[n_tx, TX_PNL_C] = cc2
+                    tx[n_tx, TX_PNL_E] = ce2
+                    n_tx += 1
+                else:
+                    tx[n_tx, TX_ACTION] = 1 if abs(q) > abs(pq) else -1
+                    tx[n_tx, TX_QTY] = dq
+                    tx[n_tx, TX_COSTS_C] = cc
+                    tx[n_tx, TX_COSTS_E] = ce
+                    tx[n_tx, TX_PNL_C] = mc + cc
+                    tx[n_tx, TX_PNL_E] = me + ce
+                    n_tx += 1
+
+                for t in range(first_tx, n_tx):
+                    tx[t, TX_BAR] = i
+                    tx[t, TX_ASSET] = k
+                    tx[t, TX_CPX] = cpx
+                    tx[t, TX_EPX] = epx
+
+                # Fold accrued PnL of holding bars into the first transaction (or log it separately if PnL is NaN)
+                if accr_c[k] != 0 or accr_e[k] != 0:
+                    if np.isfinite(tx[first_tx, TX_PNL_C]) and np.isfinite(tx[first_tx, TX_PNL_E]):
+                        tx[first_tx, TX_PNL_C] += accr_c[k]
+                        tx[first_tx, TX_PNL_E] += accr_e[k]
+                    else:
+                        tx[n_tx] = tx[first_tx]
+                        tx[first_tx, TX_ACTION] = 0
+                        tx[first_tx, TX_QTY] = 0.0
+                        tx[first_tx, TX_COSTS_C] = 0.0
+                        tx[first_tx, TX_COSTS_E] = 0.0
+                        tx[first_tx, TX_PNL_C] = accr_c[k]
+                        tx[first_tx, TX_PNL_E] = accr_e[k]
+                        if n_tx - first_tx == 2:
+                            # Keep the order of reversal transactions
+                            tmp = tx[first_tx + 1].copy()
+                            tx[first_tx + 1] = tx[n_tx]
+                            tx[n_tx] = tmp
+                        n_tx += 1
+                    accr_c[k] = 0.0
+                    accr_e[k] = 0.0
+
+            prev_c[k] = cpx
+            prev_e[k] = epx
+            qty[k] = q
+
+        for h in range(n_hold):
+            k = hold_k[h]
+            if n_tx == tx.shape[0]:
+                tx = _grow(tx)
+            tx[n_tx, TX_BAR] = i
+            tx[n_tx, TX_ASSET] = k
+            tx[n_tx, TX_ACTION] = 0
+            tx[n_tx, TX_QTY] = 0.0
+            tx[n_tx, TX_CPX] = close[i, k]
+            tx[n_tx, TX_EPX] = exec_px[i, k]
+            tx[n_tx, TX_COSTS_C] = 0.0
+            tx[n_tx, TX_COSTS_E] = 0.0
+            tx[n_tx, TX_PNL_C] = hold_pnl[h, 0]
+            tx[n_tx, TX_PNL_E] = hold_pnl[h, 1]
+            n_tx += 1
+
+        equity += pnl_c
+        equity_exec += pnl_e
+        bars[i, 0] = pnl_c
+        bars[i, 1] = pnl_e
+        bars[i, 2] = t_costs_c
+        bars[i, 3] = t_costs_e
+        bars[i, 4] = pot_c
+        bars[i, 5] = pot_e
+        bars[i, 6] = margin
+
+        # Early stopping rules
+        if equity_exec > equity_peak:
+            equity_peak = equity_exec
+        if (equity_peak - equity_exec >= stop_dd or
+                (equity_peak > 0 and (1.0 - equity_exec / equity_peak) * 100.0 >= stop_dd_pct) or
+                equity_exec < stop_floor):
+            n_done = i + 1
+            break
+
+    return (bars[:n_done], tx[:n_tx], pos[:n_pos], pos_cnt[:n_done], attr[:n_attr], attr_cnt[:n_done], qty,
+            accr_c, accr_e)
+
+
+class _CsrHistory:
+    """
+    Growable per asset history in CSR format: records of bar i are ids / values[:, indptr[i]:indptr[i+1]]
+    """
+    def __init__(self, n_bars):
+        self.indptr = np.zeros(n_bars + 1, dtype=np.int64)
+        self.ids = np.zeros(max(n_bars, 16), dtype=np.int64)
+        self.values = np.zeros((2, max(n_bars, 16)))
+        self.n = 0
+
+    def _reserve(self, n_new):
+        capacity = len(self.ids)
+        if self.n + n_new > capacity:
+            capacity = max(self.n + n_new, 2 * capacity)
+            self.ids = np.concatenate([self.ids[:self.n], np.zeros(capacity - self.n, dtype=np.int64)])
+            self.values = np.concatenate([self.values[:, :self.n], np.zeros((2, capacity - self.n))], axis=1)
+
+    def append(self, i, ids, values1, values2):
+        """
+        Records of bar i
+        :param ids: asset ids array
+        :param values1: values array (aligned with ids)
+        :param values2: values array (aligned with ids)
+        """
+        n_new = len(ids)
+        if n_new > 0:
+            self._reserve(n_new)
+            self.ids[self.n:self.n + n_new] = ids
+            self.values[0, self.n:self.n + n_new] = values1
+            self.values[1, self.n:self.n + n_new] = values2
+            self.n += n_new
+        self.indptr[i + 1] = self.n
+
+    def fill(self, i0, i1, data=None):
+        """
+        Records of bars [i0, i1) at once
+        :param data: tuple (records count per bar, asset ids, values1, values2), None - no records
+        """
+        if data is None:
+            self.indptr[i0 + 1:i1 + 1] = self.n
+            return
+        counts, ids, values1, values2 = data
+        self.indptr[i0 + 1:i1 + 1] = self.n + np.cumsum(counts)
+        n_new = len(ids)
+        self._reserve(n_new)
+        self.ids[self.n:self.n + n_new] = ids
+        self.values[0, self.n:self.n + n_new] = values1
+        self.values[1, self.n:self.n + n_new] = values2
+        self.n += n_new
+
+    def csr(self, n_bars):
+        """
+        :return: tuple (indptr, ids, values1, values2) of the first n_bars
+        """
+        n = self.indptr[n_bars]
+        return self.indptr[:n_bars + 1], self.ids[:n], self.values[0, :n], self.values[1, :n]
 
 
 class Account:
@@ -18,16 +340,26 @@ class Account:
         Initialize backtester account
         :param buffer_len: set the buffer length according to underlying quotes length
         :param kwargs:
+            - 'name' - account name
+            - 'initial_capital' - initial capital (default: 0)
+            - 'verbose' - log holding bars into transactions (default: False)
+            - 'history' - record position history and per asset PnL attribution (default: True), without history
+                          Account.positions_history(), Report.exposure() and Report.attribution() are not available
         """
         self.kwargs = kwargs
 
         self.name = kwargs.get('name', 'GenericAccount')
 
+        # Datetime of the last bar if the run was stopped early by stopping rules (see. Backtester.run()), or None
+        self.stopped_at = None
+
         self._position = {}
         self._transactions = []
 
         self._equity_close = 0.0
         self._equity_exec = 0.0
+        # Equity peak of the stopping rules (see. Account._is_stop())
+        self._equity_peak = 0.0
         self._capital_invested = 0.0
         self._margin = 0.0
         self._has_synthetic_assets = False
@@ -46,6 +378,34 @@ class Account:
         self._capital_invested_array = np.full(self._buffer_len, np.nan)
         self._margin_array = np.full(self._buffer_len, np.nan)
 
+        # Asset ids of position history, attribution and accruals
+        self._assets = []
+        self._asset_ids = {}
+        self._history = kwargs.get('history', True)
+        # Position history in CSR format: asset ids, qty and signed dollar value of the opened positions
+        self._pos_history = _CsrHistory(self._buffer_len) if self._history else None
+        # PnL attribution in CSR format: asset ids, PnL and costs (at exec time)
+        self._attr_history = _CsrHistory(self._buffer_len) if self._history else None
+
+        # Holding bars (unchanged position qty) are not logged into transactions unless verbose, their PnL is accrued
+        # per asset id and added to the next logged transaction of the asset
+        self._verbose = kwargs.get('verbose', False)
+        self._accr_close = np.zeros(0)
+        self._accr_exec = np.zeros(0)
+
+        # Dense position state of the vectorized engine (see. Account._process_array()), None if the position was
+        # changed by the dict-based engine
+        self._arr_state = None
+
+        # Bars timeline of the backtest (see. Account._bind_timeline()), bar i of the account is timeline[i]
+        self._timeline = None
+        self._timeline_offset = 0
+        self._timeline_rows = {}
+        # Point value and costs per 1 unit of qty of account assets on the timeline (3 x bars x asset ids), and state
+        # of asset ids columns: 0 - not filled, 1 - filled, -1 - not supported (see. Account._timeline_unit_values())
+        self._timeline_unit = None
+        self._timeline_unit_state = np.zeros(0, dtype=np.int8)
+
         self.capital_transaction(None, kwargs.get('initial_capital', 0))
 
 
@@ -109,14 +469,17 @@ class Account:
     def as_transactions(self) -> pd.DataFrame:
         """
         Returns list of account transactions as Pandas.DataFrame, with datetime index and columns:
-        'asset', 'position_action', 'qty', 'price_close', 'price_exec', 'costs_close', 'costs_exec', 'pnl_close', 'pnl_execution'
+        'asset', 'position_action', 'qty', 'price_close', 'price_exec', 'costs_close', 'costs_exec', 'pnl_close', 'pnl_execution',
+        'context'
         :return:
         """
-        df = pd.DataFrame(self._transactions,
-                            columns=[
-                                'date', 'asset', 'position_action', 'qty', 'price_close', 'price_exec',
-                                'costs_close', 'costs_exec', 'pnl_close', 'pnl_execution',
-                            ]).set_index('date')
+        transactions = self._transactions_log()
+        columns = TRANSACTION_KEYS
+        if len(transactions) > 0 and len(transactions[0]) < len(TRANSACTION_KEYS):
+            # Transactions without context
+            columns = TRANSACTION_KEYS[:-1]
+
+        df = pd.DataFrame(transactions, columns=columns).set_index('date')
 
         assert df.index.is_monotonic_increasing
         return df
@@ -142,6 +505,101 @@ class Account:
                 index=self._date_array[:self._buf_cnt],
             )
 
+    def positions_history(self, kind='qty') -> pd.DataFrame:
+        """
+        Dense history of account positions. Warning: the dataframe might be very large for big asset universes!
+        :param kind: 'qty' - position quantity, 'value' - signed dollar position value (at exec price)
+        :return: pd.DataFrame (dates x assets), zeros if no position
+        """
+        if kind not in ('qty', 'value'):
+            raise ValueError(f"Unknown positions history kind '{kind}', supported: 'qty', 'value'")
+
+        indptr, ids, qty, value = self._positions_csr()
+        n = self._buf_cnt
+        result = np.zeros((n, len(self._assets)))
+        result[np.repeat(np.arange(n), np.diff(indptr)), ids] = qty if kind == 'qty' else value
+        return pd.DataFrame(result, index=self._date_array[:n], columns=list(self._assets))
+
+    def _positions_csr(self):
+        """
+        Position history in CSR format, positions of bar i are in ids/qty/value[indptr[i]:indptr[i+1]]
+        :return: tuple (indptr, asset ids (see. Account._assets), qty, signed dollar value)
+        """
+        if self._pos_history is None:
+            raise ValueError(f"Position history of account '{self}' is disabled (see. Account 'history' option)")
+        return self._pos_history.csr(self._buf_cnt)
+
+    def _attribution_csr(self):
+        """
+        Per asset PnL attribution in CSR format, values of bar i are in ids/pnl/costs[indptr[i]:indptr[i+1]]
+        :return: tuple (indptr, asset ids (see. Account._assets), pnl (at exec time), costs (at exec time))
+        """
+        if self._attr_history is None:
+            raise ValueError(f"PnL attribution of account '{self}' is disabled (see. Account 'history' option)")
+        return self._attr_history.csr(self._buf_cnt)
+
+    def _record_attribution(self, i, transactions, hold_ids=None, hold_pnl=None):
+        """
+        Records per asset PnL and costs of bar i transactions (and unchanged positions PnL)
+        """
+        if self._attr_history is None:
+            return
+        if len(transactions) == 0:
+            if hold_ids is None:
+                self._attr_history.append(i, (), (), ())
+            else:
+                self._attr_history.append(i, hold_ids, hold_pnl, 0.0)
+            return
+
+        attr = {}
+        if hold_ids is not None:
+            for asset_id, pnl in zip(hold_ids.tolist(), hold_pnl.tolist()):
+                attr[asset_id] = [pnl, 0.0]
+        for trans in transactions:
+            asset_id = self._get_asset_id(trans[1])
+            pnl_costs = attr.get(asset_id, None)
+            if pnl_costs is None:
+                attr[asset_id] = [trans[9], trans[7]]
+            else:
+                # Reversal transactions
+                pnl_costs[0] += trans[9]
+                pnl_costs[1] += trans[7]
+
+        values = np.array(list(attr.values())).reshape(len(attr), 2)
+        self._attr_history.append(i, list(attr.keys()), values[:, 0], values[:, 1])
+
+    def _get_asset_id(self, asset):
+        """
+        Returns asset integer id for position history and attribution arrays
+        """
+        asset_id = self._asset_ids.get(asset, None)
+        if asset_id is None:
+            asset_id = len(self._assets)
+            self._asset_ids[asset] = asset_id
+            self._assets.append(asset)
+        return asset_id
+
+    def _record_positions(self, dt, i):
+        """
+        Records opened positions at bar i into position history
+        """
+        if self._pos_history is None:
+            return
+        held = [(asset, pos[0], pos[2] if isfinite(pos[2]) else pos[1]) for asset, pos in self._position.items()
+                if pos[0] != 0]
+        n = len(held)
+        ids = np.fromiter((self._get_asset_id(asset) for asset, _, _ in held), dtype=np.int64, count=n)
+        qty = np.fromiter((q for _, q, _ in held), dtype=np.float64, count=n)
+        px = np.fromiter((p for _, _, p in held), dtype=np.float64, count=n)
+
+        unit = self._timeline_unit_values(ids) if n > 0 else None
+        if unit is not None:
+            point_value = unit[0]
+        else:
+            point_value = np.fromiter((self._asset_point_value(dt, asset) for asset, _, _ in held), dtype=np.float64,
+                                      count=n)
+        self._pos_history.append(i, ids, qty, px * point_value * qty)
+
     def as_asset(self, name=None) -> Asset:
         """
         Creates synthetic asset based on account's equity and costs
@@ -157,33 +615,20 @@ class Account:
         # Replace negative equity margin by zeros
         _margin = np.where(self._margin_array[:self._buf_cnt] < 0, 0, self._margin_array[:self._buf_cnt])
 
-        synt_asset = {
-            'ticker': name,
-            'quotes': pd.DataFrame(
-                {
-                    'o': self._equity_array_close[:self._buf_cnt],
-                    'h': self._equity_array_close[:self._buf_cnt],
-                    'l': self._equity_array_close[:self._buf_cnt],
-                    'c': self._equity_array_close[:self._buf_cnt],
-                    'v': np.zeros(self._buf_cnt),
-                    'exec': self._equity_array_exec[:self._buf_cnt],
-                },
-                index=self._date_array[:self._buf_cnt],
-            ),
-            'is_synthetic': True,  # To forbid creating multiple asset derivatives from accounts
-            'point_value': 1.0,    # Equity prices are in dollars, so point value should be always 1.0
-            'margin': pd.Series(_margin, index=self._date_array[:self._buf_cnt]),
-            'legs': {k.ticker: v[0] for k, v in self._position.items()},  # 'legs' must be a dictionary of {<ticker_string>: <qty_float>}
-            'costs': {
-                'type': 'dynamic',
-                'value': pd.DataFrame({
-                    # IMPORTANT: we use only potential costs because the transaction costs are included in equity prices
-                    'c': self._costs_array_potential_close[:self._buf_cnt],
-                    'exec': self._costs_array_potential_exec[:self._buf_cnt],
-                }, index=self._date_array[:self._buf_cnt]),
-            }
-        }
-        return Asset(**synt_asset)
+        n = self._buf_cnt
+        # The data is consistent by design, so the asset is built directly from arrays without validation
+        return Asset._synthetic(
+            name,
+            self._date_array[:n],
+            self._equity_array_close[:n],
+            self._equity_array_exec[:n],
+            _margin,
+            # IMPORTANT: we use only potential costs because the transaction costs are included in equity prices
+            self._costs_array_potential_close[:n],
+            self._costs_array_potential_exec[:n],
+            # 'legs' must be a dictionary of {<ticker_string>: <qty_float>}
+            {k.ticker: v[0] for k, v in self._position.items()},
+        )
 
     #
     #
@@ -191,6 +636,148 @@ class Account:
     #       (!!!) DO NOT USE in strategy analysis
     #
     #
+    def _bind_timeline(self, timeline: pd.DatetimeIndex):
+        """
+        Binds the bars timeline to the account, the next bars of the account must be processed at timeline[0],
+        timeline[1], ... The assets prices are looked up by precomputed quotes rows of the timeline instead of
+        searching dates in the quotes index
+        :param timeline: datetime index (int64 nanoseconds)
+        :return:
+        """
+        if self._buf_cnt + len(timeline) > self._buffer_len:
+            raise ValueError("Timeline is longer than the account values buffer")
+        if self._buf_cnt > 0 and len(timeline) > 0 and timeline[0] <= self._date_array[self._buf_cnt - 1]:
+            raise ValueError("Timeline must start after the last processed bar of the account")
+        self._timeline = timeline
+        self._timeline_offset = self._buf_cnt
+        self._timeline_rows = {}
+        self._timeline_unit = None
+        self._timeline_unit_state = np.zeros(0, dtype=np.int8)
+        # Dates are filled straight from int64 timeline
+        self._date_array[self._buf_cnt:self._buf_cnt + len(timeline)] = timeline.values
+
+    def _is_stop(self, stop):
+        """
+        Checks early stopping rules after the bar, and updates the equity peak
+        :param stop: tuple (max drawdown, max drawdown %, equity floor, callback), None - no rule
+                     max drawdown - stop if equity peak - equity >= value
+                     max drawdown % - stop if (1 - equity / equity peak) * 100 >= value (if equity peak > 0)
+                     equity floor - stop if equity < value
+                     callback - function (account) -> bool, stop if True
+                     equity is at execution price (see. Account.as_dataframe()['equity']), the peak is tracked
+                     from the start of the run (see. Backtester._run_bars())
+        :return: True if the run must be stopped
+        """
+        stop_dd, stop_dd_pct, stop_floor, stop_callback = stop
+        equity = self._equity_exec
+        if equity > self._equity_peak:
+            self._equity_peak = equity
+        equity_peak = self._equity_peak
+
+        if stop_dd is not None and equity_peak - equity >= stop_dd:
+            return True
+        if stop_dd_pct is not None and equity_peak > 0 and (1.0 - equity / equity_peak) * 100.0 >= stop_dd_pct:
+            return True
+        if stop_floor is not None and equity < stop_floor:
+            return True
+        if stop_callback is not None and stop_callback(self):
+            return True
+        return False
+
+    def _skip_bars(self, n):
+        """
+        Fills n bars of the bound timeline without positions (i.e. strategy warm-up), see. Account._bind_timeline()
+        :param n: number of bars
+        :return:
+        """
+        if self._timeline is None:
+            raise ValueError("Timeline must be bound to skip bars")
+        if len(self._position) > 0:
+            raise ValueError("Bars can be skipped only without opened positions")
+        j = self._buf_cnt - self._timeline_offset
+        zeros = np.zeros(n)
+        self._bulk_fill(self._timeline.values[j:j + n], zeros, zeros, zeros, zeros, zeros, zeros, zeros)
+
+    def _asset_timeline_rows(self, asset):
+        """
+        Quotes rows of the asset for the bound timeline bars (see. Asset._timeline_rows())
+        :return: list of int or None
+        """
+        entry = self._timeline_rows.get(id(asset), None)
+        if entry is None:
+            # Keep the asset reference to make its id() stable
+            entry = self._timeline_rows[id(asset)] = (asset, asset._timeline_rows(self._timeline))
+        return entry[1]
+
+    def _timeline_unit_values(self, ids):
+        """
+        Point value, close and execution costs per 1 unit of qty at the current bar of the bound timeline
+        :param ids: np.ndarray of account asset ids
+        :return: np.ndarray (3 x len(ids)), or None if timeline is not bound or some asset doesn't support bar lookups
+        """
+        if self._timeline is None:
+            return None
+        j = self._buf_cnt - self._timeline_offset
+        n_bars = len(self._timeline)
+        if j >= n_bars:
+            return None
+
+        state = self._timeline_unit_state
+        if len(state) < len(self._assets):
+            capacity = max(len(self._assets), 2 * len(state), 16)
+            unit = np.full((3, n_bars, capacity), np.nan)
+            if self._timeline_unit is not None:
+                unit[:, :, :len(state)] = self._timeline_unit
+            self._timeline_unit = unit
+            self._timeline_unit_state = state = np.concatenate([state, np.zeros(capacity - len(state), dtype=np.int8)])
+
+        for asset_id in np.unique(ids[state[ids] == 0]).tolist():
+            asset = self._assets[asset_id]
+            if self._asset_timeline_rows(asset) is None:
+                state[asset_id] = -1
+                continue
+            # Positions can't be opened before the asset data start (get_prices() raises), so NaNs are left there
+            first = self._timeline.searchsorted(asset._data_start())
+            arrays = asset._aligned_arrays(self._timeline[first:])
+            self._timeline_unit[0, first:, asset_id] = arrays['point_value']
+            self._timeline_unit[1, first:, asset_id] = arrays['costs_c']
+            self._timeline_unit[2, first:, asset_id] = arrays['costs_exec']
+            state[asset_id] = 1
+
+        if np.any(state[ids] < 0):
+            return None
+        return self._timeline_unit[:, j, ids]
+
+    def _asset_row(self, asset):
+        """
+        Quotes row of the asset at the current bar of the bound timeline, see. Account._bind_timeline()
+        :return: int, or None if the asset doesn't support bar lookups (the date lookup must be used)
+        """
+        if self._timeline is not None:
+            rows = self._asset_timeline_rows(asset)
+            j = self._buf_cnt - self._timeline_offset
+            if rows is not None and j < len(rows):
+                row = rows[j]
+                if row >= 0:
+                    return row
+        return None
+
+    def _bar_date(self):
+        """
+        Date of the current bar of the bound timeline (pd.Timestamp is created on demand only)
+        """
+        return self._timeline[self._buf_cnt - self._timeline_offset]
+
+    def _get_prices(self, dt, asset):
+        """
+        Asset close and execution prices at the bar, see. Account._bind_timeline()
+        :return: tuple (close px, exec px)
+        """
+        row = self._asset_row(asset)
+        if row is not None:
+            return asset.get_prices(dt, row)
+        return asset.get_prices(dt)
+
     def _process_position(self, dt: datetime, new_pos: Dict[Asset, float]):
         """
         Processed new position calculates transactions and PnLs
@@ -204,18 +791,481 @@ class Account:
 
         new_pos_dict = {}
         for asset, qty in new_pos.items():
-            if not isinstance(asset, Asset) or not isinstance(qty, (float, np.float, int, np.int32, np.int64, tuple)):
-                raise ValueError(f'strategy.compose_portfolio() must return dict of <asset_AssetClassInstance: qty_FloatNumber or tuple(qty, contxt)>,'
-                                 f' got <{type(asset)}: {type(qty)}>')
+            new_pos_dict[asset] = self._position_record(dt, asset, qty)
 
-            self._has_synthetic_assets = self._has_synthetic_assets or asset.is_synthetic
-            close_price, exec_price = asset.get_prices(dt)
-            if isinstance(qty, (float, np.float, int, np.int32, np.int64)):
-                new_pos_dict[asset] = (qty, close_price, exec_price, None)
-            elif isinstance(qty, tuple):
-                assert len(qty) == 2
-                # Apply additional context to the position record
+        self._apply_position(dt, new_pos_dict)
+
+    def _process_position_trusted(self, dt: datetime, new_pos: Dict[Asset, float]):
+        """
+        The same as Account._process_position() but without validation of new_pos items (trusted strategy results)
+        :param dt:
+        :param new_pos:
+        :return:
+        """
+        new_pos_dict = {}
+        for asset, qty in new_pos.items():
+            close_price, exec_price = self._get_prices(dt, asset)
+            if qty.__class__ is tuple:
                 new_pos_dict[asset] = (qty[0], close_price, exec_price, qty[1])
+            else:
+                new_pos_dict[asset] = (qty, close_price, exec_price, None)
+            if asset.is_synthetic:
+                self._has_synthetic_assets = True
+
+        self._apply_position(dt, new_pos_dict)
+
+    def _position_record(self, dt, asset, qty):
+        """
+        Validates compose_portfolio() position item and makes position record
+        :return: tuple (qty, close_price, exec_price, context)
+        """
+        if not isinstance(asset, Asset) or not isinstance(qty, (float, np.float, np.float32, int, np.int32, np.int64, tuple)):
+            raise ValueError(f'strategy.compose_portfolio() must return dict of <asset_AssetClassInstance: qty_FloatNumber or tuple(qty, contxt)>,'
+                             f' got <{type(asset)}: {type(qty)}>')
+
+        self._has_synthetic_assets = self._has_synthetic_assets or asset.is_synthetic
+        close_price, exec_price = self._get_prices(dt, asset)
+        if isinstance(qty, tuple):
+            assert len(qty) == 2
+            # Apply additional context to the position record
+            return qty[0], close_price, exec_price, qty[1]
+        return qty, close_price, exec_price, None
+
+    def _process_delta(self, dt: datetime, delta: PositionDelta):
+        """
+        Applies portfolio changes, only changed assets are validated and go through transactions logic
+        :param dt:
+        :param delta: PositionDelta
+        :return:
+        """
+        changes = delta.changes
+        new_pos_dict = {}
+        changed = {}
+        prev_changed = {}
+        hold = []
+
+        for asset, prev_pos in self._position.items():
+            if asset in changes:
+                continue
+            close_price, exec_price = self._get_prices(dt, asset)
+            new_pos_dict[asset] = curr_pos = (prev_pos[0], close_price, exec_price, prev_pos[3])
+            if prev_pos[0] != 0:
+                hold.append((asset, prev_pos, curr_pos))
+            else:
+                changed[asset] = curr_pos
+                prev_changed[asset] = prev_pos
+
+        for asset, qty in changes.items():
+            prev_pos = self._position.get(asset, None)
+            if qty is None:
+                if not isinstance(asset, Asset):
+                    raise ValueError(f'PositionDelta keys must be assets, got <{type(asset)}>')
+                if prev_pos is not None:
+                    # Closed position is removed from the portfolio
+                    prev_changed[asset] = prev_pos
+                continue
+
+            curr_pos = new_pos_dict[asset] = self._position_record(dt, asset, qty)
+            if prev_pos is not None and prev_pos[0] == curr_pos[0] and curr_pos[0] != 0:
+                hold.append((asset, prev_pos, curr_pos))
+            else:
+                changed[asset] = curr_pos
+                if prev_pos is not None:
+                    prev_changed[asset] = prev_pos
+
+        if self._verbose:
+            self._apply_position(dt, new_pos_dict)
+        else:
+            self._apply_position(dt, new_pos_dict, (changed, prev_changed, hold))
+
+    def _hold_position(self, dt: datetime = None):
+        """
+        Carries forward the current position at non-rebalancing bar, only prices and PnLs are updated
+        :param dt: bar date, None - the current bar of the bound timeline, the date is created only if some asset
+                   doesn't support bar lookups or holding bars are logged
+        :return:
+        """
+        new_pos_dict = {}
+        hold = []
+        for asset, prev_pos in self._position.items():
+            row = self._asset_row(asset)
+            if row is not None:
+                close_price, exec_price = asset.get_prices(dt, row)
+            else:
+                if dt is None:
+                    dt = self._bar_date()
+                close_price, exec_price = asset.get_prices(dt)
+            new_pos_dict[asset] = curr_pos = (prev_pos[0], close_price, exec_price, prev_pos[3])
+            if prev_pos[0] != 0:
+                hold.append((asset, prev_pos, curr_pos))
+
+        if self._verbose or len(hold) < len(new_pos_dict):
+            # Zero qty records are rare, let them go through the generic path
+            if dt is None:
+                dt = self._bar_date()
+            self._apply_position(dt, new_pos_dict)
+        else:
+            self._apply_position(dt, new_pos_dict, ({}, {}, hold))
+
+    def _array_state(self, panel):
+        """
+        Dense position state aligned with panel.assets, built from the position dict if it was changed by the
+        dict-based engine
+        :return: dict
+        """
+        state = self._arr_state
+        if state is not None and state['panel'] is panel:
+            return state
+
+        n = len(panel.assets)
+        state = {
+            'panel': panel,
+            'qty': np.zeros(n),
+            'c': np.full(n, np.nan),
+            'exec': np.full(n, np.nan),
+            'ctx': np.full(n, None, dtype=object),
+            # Account asset ids (see. Account._assets), assigned when the asset is traded at the first time
+            'ids': np.full(n, -1, dtype=np.int64),
+        }
+        for asset, (qty, cpx, epx, ctx) in self._position.items():
+            k = panel.asset_index.get(asset, None)
+            if k is None:
+                if qty != 0:
+                    raise ValueError(f"Position of {asset} is not in the assets universe, array positions are "
+                                     f"supported only for mf.assets")
+                continue
+            state['qty'][k], state['c'][k], state['exec'][k], state['ctx'][k] = qty, cpx, epx, ctx
+
+        for asset, asset_id in self._asset_ids.items():
+            k = panel.asset_index.get(asset, None)
+            if k is not None:
+                state['ids'][k] = asset_id
+
+        self._arr_state = state
+        return state
+
+    def _process_array(self, dt: datetime, i_bar, new_qty, new_ctx, panel):
+        """
+        Processes new position as qty array aligned with panel.assets (vectorized engine, the same logic as
+        Account._calc_transactions())
+        :param dt:
+        :param i_bar: bar index of the panel
+        :param new_qty: np.ndarray of quantities aligned with panel.assets (zero - no position)
+        :param new_ctx: (optional) sequence of positions contexts aligned with panel.assets
+        :param panel: ExecutionPanel
+        :return:
+        """
+        n = len(panel.assets)
+        qty = np.asarray(new_qty, dtype=np.float64)
+        if qty.shape != (n,):
+            raise ValueError(f'strategy.compose_portfolio() qty array must be aligned with mf.assets, '
+                             f'expected shape {(n,)}, got {qty.shape}')
+        if not np.all(np.isfinite(qty)):
+            raise ValueError(f'strategy.compose_portfolio() qty array must contain only finite numbers')
+        if new_ctx is not None:
+            if len(new_ctx) != n:
+                raise ValueError(f'strategy.compose_portfolio() context array must be aligned with mf.assets, '
+                                 f'expected length {n}, got {len(new_ctx)}')
+            ctx = np.empty(n, dtype=object)
+            ctx[:] = list(new_ctx)
+        else:
+            ctx = np.full(n, None, dtype=object)
+
+        i = self._buf_cnt
+        if i >= self._buffer_len:
+            raise ValueError("Incorrectly initialized account values buffer length or _process_position() called more times than expected")
+
+        state = self._array_state(panel)
+        prev_qty, prev_cpx, prev_epx, prev_ctx, ids = state['qty'], state['c'], state['exec'], state['ctx'], state['ids']
+        cpx, epx, pv = panel.close[i_bar], panel.exec[i_bar], panel.point_value[i_bar]
+        unit_costs_c, unit_costs_e = panel.costs_close[i_bar], panel.costs_exec[i_bar]
+
+        is_held = prev_qty != 0
+        is_open = qty != 0
+        trans_qty = qty - prev_qty
+        is_changed = trans_qty != 0
+        is_active = is_held | is_open
+
+        before_start = np.flatnonzero(is_changed & (panel.first_bar > i_bar))
+        if len(before_start) > 0:
+            # Raises the same error as the asset market data lookups
+            panel.assets[before_start[0]]._aligned_arrays(panel.index[i_bar:i_bar + 1])
+
+        with np.errstate(invalid='ignore'):
+            mtm_c = np.where(is_held, (cpx - prev_cpx) * prev_qty * pv, 0.0)
+            mtm_e = np.where(is_held, (epx - prev_epx) * prev_qty * pv, 0.0)
+            # Reversal costs (close previous and open new) are equal to costs of the net transaction qty
+            costs_c = np.where(is_changed, -np.abs(trans_qty) * unit_costs_c, 0.0)
+            costs_e = np.where(is_changed, -np.abs(trans_qty) * unit_costs_e, 0.0)
+            costs_potential_c = np.where(is_open, -np.abs(qty) * unit_costs_c, 0.0)
+            costs_potential_e = np.where(is_open, -np.abs(qty) * unit_costs_e, 0.0)
+
+        if np.any(is_open & panel.is_synthetic):
+            self._has_synthetic_assets = True
+
+        # Account asset ids
+        new_ids = np.flatnonzero(is_active & (ids < 0))
+        for k in new_ids.tolist():
+            ids[k] = self._get_asset_id(panel.assets[k])
+        if len(self._accr_close) < len(self._assets):
+            self._accr_close = np.concatenate([self._accr_close, np.zeros(len(self._assets) - len(self._accr_close))])
+            self._accr_exec = np.concatenate([self._accr_exec, np.zeros(len(self._assets) - len(self._accr_exec))])
+
+        # Transactions of changed positions
+        transactions = []
+        for k in np.flatnonzero(is_changed).tolist():
+            asset = panel.assets[k]
+            q, pq = qty[k], prev_qty[k]
+            if pq == 0:
+                transactions.append((dt, asset, 1, q, cpx[k], epx[k], costs_c[k], costs_e[k],
+                                     costs_c[k], costs_e[k], ctx[k]))
+            elif q == 0:
+                transactions.append((dt, asset, -1, -pq, cpx[k], epx[k], costs_c[k], costs_e[k],
+                                     mtm_c[k] + costs_c[k], mtm_e[k] + costs_e[k], prev_ctx[k]))
+            elif (q > 0) != (pq > 0):
+                # Reversal: close previous position and open new one in 2 transactions
+                cc1, ce1 = -abs(pq) * unit_costs_c[k], -abs(pq) * unit_costs_e[k]
+                cc2, ce2 = -abs(q) * unit_costs_c[k], -abs(q) * unit_costs_e[k]
+                action = 1 if abs(q) > abs(pq) else (-1 if abs(q) < abs(pq) else 0)
+                transactions.append((dt, asset, action, -pq, cpx[k], epx[k], cc1, ce1,
+                                     mtm_c[k] + cc1, mtm_e[k] + ce1, ctx[k]))
+                transactions.append((dt, asset, 1, q, cpx[k], epx[k], cc2, ce2, cc2, ce2, ctx[k]))
+            else:
+                action = 1 if abs(q) > abs(pq) else -1
+                transactions.append((dt, asset, action, q - pq, cpx[k], epx[k], costs_c[k], costs_e[k],
+                                     mtm_c[k] + costs_c[k], mtm_e[k] + costs_e[k], ctx[k]))
+
+        is_hold = is_held & ~is_changed
+        if self._verbose:
+            for k in np.flatnonzero(is_hold).tolist():
+                transactions.append((dt, panel.assets[k], 0, 0.0, cpx[k], epx[k], 0.0, 0.0, mtm_c[k], mtm_e[k], ctx[k]))
+        else:
+            hold_ids = ids[is_hold]
+            self._accr_close[hold_ids] += np.where(np.isnan(mtm_c[is_hold]), 0.0, mtm_c[is_hold])
+            self._accr_exec[hold_ids] += np.where(np.isnan(mtm_e[is_hold]), 0.0, mtm_e[is_hold])
+
+        # Attribution is recorded at the bar of PnL, so do it before folding accrued PnL into transactions
+        if self._attr_history is not None:
+            self._attr_history.append(i, ids[is_active], (mtm_e + costs_e)[is_active], costs_e[is_active])
+
+        if len(transactions) > 0:
+            transactions = self._fold_accrued(transactions)
+        self._transactions += transactions
+
+        # New position state
+        pos_idx = np.flatnonzero(is_open)
+        unit_margin = np.abs(qty[pos_idx]) * panel.margin[i_bar][pos_idx]
+        margin = unit_margin.sum()
+        if not isfinite(margin):
+            k = pos_idx[np.flatnonzero(~np.isfinite(unit_margin))[0]]
+            raise ValueError(f'Invalid margin requirements returned by {panel.assets[k]} at {dt} for qty: {qty[k]}')
+        self._margin = margin
+
+        self._position = {panel.assets[k]: (q, c, e, cx) for k, q, c, e, cx in
+                          zip(pos_idx.tolist(), qty[pos_idx].tolist(), cpx[pos_idx].tolist(),
+                              epx[pos_idx].tolist(), ctx[pos_idx].tolist())}
+        state['qty'], state['c'], state['exec'], state['ctx'] = qty.copy(), cpx.copy(), epx.copy(), ctx
+
+        self._store_bar(dt, i,
+                        mtm_c.sum() + costs_c.sum(), mtm_e.sum() + costs_e.sum(),
+                        costs_c.sum(), costs_e.sum(),
+                        costs_potential_c.sum(), costs_potential_e.sum())
+
+        # Position history
+        if self._pos_history is not None:
+            px = np.where(np.isfinite(epx[pos_idx]), epx[pos_idx], cpx[pos_idx])
+            self._pos_history.append(i, ids[pos_idx], qty[pos_idx], px * pv[pos_idx] * qty[pos_idx])
+        self._buf_cnt += 1
+
+    def _process_kernel(self, dt_idx, panel, compose_kernel, metrics, rebalance, stop=None):
+        """
+        Runs the whole backtest in the compiled loop (see. Strategy.compose_kernel), and fills account state
+        :param dt_idx: datetime index of bars
+        :param panel: ExecutionPanel
+        :param compose_kernel: numba compiled function (i_bar, metrics, qty, equity) -> qty array
+        :param metrics: np.ndarray (bars x assets x columns)
+        :param rebalance: np.ndarray of bool (rebalancing bars)
+        :param stop: (optional) early stopping rules tuple (max drawdown, max drawdown %, equity floor, callback), see.
+                     Account._is_stop(), callback is not supported by compiled loop
+        :return:
+        """
+        if self._buf_cnt != 0 or len(self._position) > 0:
+            raise ValueError("compose_kernel() engine requires an empty account")
+
+        stop_dd, stop_dd_pct, stop_floor, stop_callback = (None, None, None, None) if stop is None else stop
+        if stop_callback is not None:
+            raise ValueError("'stop_callback' is not supported by compose_kernel() engine")
+
+        (bars, tx, pos, pos_cnt, attr, attr_cnt,
+         qty, accr_c, accr_e) = _kernel_run_loop(compose_kernel, metrics, rebalance, panel.close, panel.exec,
+                                                 panel.point_value, panel.costs_close, panel.costs_exec,
+                                                 panel.margin, self._equity_close, self._equity_exec, self._verbose,
+                                                 np.inf if stop_dd is None else float(stop_dd),
+                                                 np.inf if stop_dd_pct is None else float(stop_dd_pct),
+                                                 -np.inf if stop_floor is None else float(stop_floor))
+        n_done = len(bars)
+        if n_done < len(dt_idx):
+            self.stopped_at = dt_idx[n_done - 1]
+
+        # Account asset ids in order of the first trade (as the python engine does)
+        traded = np.unique(pos[:, 0].astype(np.int64), return_index=True)
+        ids = np.full(len(panel.assets), -1, dtype=np.int64)
+        for k in traded[0][np.argsort(traded[1])].tolist():
+            ids[k] = self._get_asset_id(panel.assets[k])
+
+        if np.any(panel.is_synthetic[traded[0]]):
+            self._has_synthetic_assets = True
+
+        dates = dt_idx.values[:n_done]
+        self._bulk_fill(dates, bars[:, 0], bars[:, 1], bars[:, 2], bars[:, 3], bars[:, 4], bars[:, 5], bars[:, 6],
+                        positions=(pos_cnt, ids[pos[:, 0].astype(np.int64)], pos[:, 1], pos[:, 2]),
+                        attribution=(attr_cnt, ids[attr[:, 0].astype(np.int64)], attr[:, 1], attr[:, 2]))
+
+        self._transactions += [(dt_idx[int(t[TX_BAR])], panel.assets[int(t[TX_ASSET])], int(t[TX_ACTION]), t[TX_QTY],
+                                t[TX_CPX], t[TX_EPX], t[TX_COSTS_C], t[TX_COSTS_E], t[TX_PNL_C], t[TX_PNL_E], None)
+                               for t in tx.tolist()]
+
+        # Final state
+        last = n_done - 1
+        self._position = {panel.assets[k]: (qty[k], panel.close[last, k], panel.exec[last, k], None)
+                          for k in np.flatnonzero(qty != 0).tolist()}
+        self._arr_state = None
+        if len(self._accr_close) < len(self._assets):
+            self._accr_close = np.concatenate([self._accr_close, np.zeros(len(self._assets) - len(self._accr_close))])
+            self._accr_exec = np.concatenate([self._accr_exec, np.zeros(len(self._assets) - len(self._accr_exec))])
+        is_accr = (accr_c != 0) | (accr_e != 0)
+        self._accr_close[ids[is_accr]] += accr_c[is_accr]
+        self._accr_exec[ids[is_accr]] += accr_e[is_accr]
+
+    @staticmethod
+    def _split_unchanged(new_pos_dict, prev_position_dict):
+        """
+        Splits positions into changed and unchanged (the same non-zero qty as at the previous bar)
+        :return: tuple (changed new positions dict, changed previous positions dict, list of unchanged positions
+                 [(asset, prev_pos, curr_pos), ...])
+        """
+        hold = []
+        changed = {}
+        for asset, curr_pos in new_pos_dict.items():
+            prev_pos = prev_position_dict.get(asset, None)
+            if prev_pos is not None and prev_pos[0] == curr_pos[0] and curr_pos[0] != 0:
+                hold.append((asset, prev_pos, curr_pos))
+            else:
+                changed[asset] = curr_pos
+
+        if len(hold) == 0:
+            return new_pos_dict, prev_position_dict, hold
+
+        prev_changed = {asset: prev_pos for asset, prev_pos in prev_position_dict.items()
+                        if asset in changed or asset not in new_pos_dict}
+        return changed, prev_changed, hold
+
+    def _mark_to_market(self, dt, hold):
+        """
+        Calculates PnL of unchanged positions (vectorized), PnL is accrued per asset until the next logged transaction
+        :param dt:
+        :param hold: list of unchanged positions [(asset, prev_pos, curr_pos), ...]
+        :return: tuple (pnl_close_total, pnl_exec_total, costs_potential_close_total, costs_potential_exec_total,
+                 asset ids, pnl at execution per asset)
+        """
+        n = len(hold)
+        ids = np.fromiter((self._get_asset_id(asset) for asset, _, _ in hold), dtype=np.int64, count=n)
+        # Columns: qty, close px delta, exec px delta, point value, potential costs close, potential costs exec
+        data = np.empty((6, n))
+        data[0] = [curr_pos[0] for _, _, curr_pos in hold]
+        data[1] = [curr_pos[1] - prev_pos[1] for _, prev_pos, curr_pos in hold]
+        data[2] = [curr_pos[2] - prev_pos[2] for _, prev_pos, curr_pos in hold]
+
+        unit = self._timeline_unit_values(ids)
+        if unit is not None:
+            # Point value and costs are precomputed for the timeline bars
+            data[3] = unit[0]
+            abs_qty = np.abs(data[0])
+            data[4] = -(unit[1] * abs_qty)
+            data[5] = -(unit[2] * abs_qty)
+        else:
+            for k, (asset, _, curr_pos) in enumerate(hold):
+                row = self._asset_row(asset)
+                if row is not None:
+                    data[3, k] = asset.get_point_value(dt, row)
+                    data[4, k], data[5, k] = asset.get_costs(dt, curr_pos[0], row)
+                else:
+                    data[3, k] = asset.get_point_value(dt)
+                    data[4, k], data[5, k] = asset.get_costs(dt, curr_pos[0])
+
+        dollar_qty = data[0] * data[3]
+        pnl_close = data[1] * dollar_qty
+        pnl_exec = data[2] * dollar_qty
+
+        if len(self._accr_close) < len(self._assets):
+            self._accr_close = np.concatenate([self._accr_close, np.zeros(len(self._assets) - len(self._accr_close))])
+            self._accr_exec = np.concatenate([self._accr_exec, np.zeros(len(self._assets) - len(self._accr_exec))])
+        # NaN PnL (i.e. missing exec price at the last bar) must not poison the accrued PnL of other bars
+        self._accr_close[ids] += np.where(np.isnan(pnl_close), 0.0, pnl_close)
+        self._accr_exec[ids] += np.where(np.isnan(pnl_exec), 0.0, pnl_exec)
+
+        return pnl_close.sum(), pnl_exec.sum(), data[4].sum(), data[5].sum(), ids, pnl_exec
+
+    def _fold_accrued(self, transactions):
+        """
+        Adds accrued PnL of holding bars to the first transaction of the asset, if transaction PnL is NaN the
+        accrued PnL is logged as a separate holding transaction
+        :return: list of transactions
+        """
+        n_accr = len(self._accr_close)
+        result = []
+        for trans in transactions:
+            asset_id = self._asset_ids.get(trans[1], n_accr)
+            if asset_id < n_accr and (self._accr_close[asset_id] != 0 or self._accr_exec[asset_id] != 0):
+                if isfinite(trans[8]) and isfinite(trans[9]):
+                    trans = trans[:8] + (trans[8] + self._accr_close[asset_id],
+                                         trans[9] + self._accr_exec[asset_id]) + trans[10:]
+                else:
+                    result.append((trans[0], trans[1], 0, 0.0, trans[4], trans[5], 0.0, 0.0,
+                                   self._accr_close[asset_id], self._accr_exec[asset_id], trans[10]))
+                self._accr_close[asset_id] = 0.0
+                self._accr_exec[asset_id] = 0.0
+            result.append(trans)
+        return result
+
+    def _transactions_log(self):
+        """
+        Transactions log with holding transactions of accrued PnL of opened positions at the last bar, the account
+        state is not changed (accrued PnL is still added to the next transaction of the asset)
+        :return: list of transactions
+        """
+        if len(self._accr_close) == 0 or self._buf_cnt == 0:
+            return self._transactions
+        accrued = np.flatnonzero((self._accr_close != 0) | (self._accr_exec != 0))
+        if len(accrued) == 0:
+            return self._transactions
+
+        dt = pd.Timestamp(self._date_array[self._buf_cnt - 1])
+        holding = []
+        for asset_id in accrued.tolist():
+            asset = self._assets[asset_id]
+            qty, cpx, epx, ctx = self._position[asset]
+            holding.append((dt, asset, 0, 0.0, cpx, epx, 0.0, 0.0,
+                            self._accr_close[asset_id], self._accr_exec[asset_id], ctx))
+        if len(self._transactions) > 0 and len(self._transactions[0]) < len(TRANSACTION_KEYS):
+            # Transactions without context
+            holding = [t[:-1] for t in holding]
+        return self._transactions + holding
+
+    def _apply_position(self, dt: datetime, new_pos_dict, split=None):
+        """
+        Calculates transactions, PnLs and updates account state
+        :param dt:
+        :param new_pos_dict: dict of {asset: (qty, close_price, exec_price, context)}
+        :param split: (optional) precalculated result of Account._split_unchanged()
+        :return:
+        """
+        if self._verbose:
+            changed, prev_changed, hold = new_pos_dict, self._position, None
+        elif split is not None:
+            changed, prev_changed, hold = split
+        else:
+            changed, prev_changed, hold = self._split_unchanged(new_pos_dict, self._position)
 
         # Calculate transactions logic for positions
         (
@@ -223,21 +1273,89 @@ class Account:
             pnl_close_total, pnl_exec_total,
             costs_close_total, costs_exec_total,
             costs_potential_close_total, costs_potential_exec_total,
-        ) = self._calc_transactions(dt, new_pos_dict, self._position)
+        ) = self._calc_transactions(dt, changed, prev_changed, asset_row=self._asset_row)
+
+        hold_ids = hold_pnl = None
+        if hold:
+            # Fast mark-to-market path for unchanged positions
+            hold_close, hold_exec, hold_cp_close, hold_cp_exec, hold_ids, hold_pnl = self._mark_to_market(dt, hold)
+            pnl_close_total += hold_close
+            pnl_exec_total += hold_exec
+            costs_potential_close_total += hold_cp_close
+            costs_potential_exec_total += hold_cp_exec
+
+        # Attribution is recorded at the bar of PnL, so do it before folding accrued PnL into transactions
+        i = self._buf_cnt
+        if i >= self._buffer_len:
+            raise ValueError("Incorrectly initialized account values buffer length or _process_position() called more times than expected")
+        self._record_attribution(i, transactions, hold_ids, hold_pnl)
+
+        if len(self._accr_close) > 0 and len(transactions) > 0:
+            transactions = self._fold_accrued(transactions)
 
         # Update position PnL values
         self._transactions += transactions
-        self._equity_close += pnl_close_total
-        self._equity_exec += pnl_exec_total
         self._position = new_pos_dict
+        self._arr_state = None
         self._margin = self._calc_account_margin(dt)
+        self._store_bar(dt, i, pnl_close_total, pnl_exec_total, costs_close_total, costs_exec_total,
+                        costs_potential_close_total, costs_potential_exec_total)
+        self._record_positions(dt, i)
+        self._buf_cnt += 1
 
-        # Build historical arrays
-        i = self._buf_cnt
-        if i >= self._buffer_len:
+    def _bulk_fill(self, dates, pnl_close, pnl_exec, costs_close, costs_exec, costs_potential_close,
+                   costs_potential_exec, margin, positions=None, attribution=None):
+        """
+        Fills historical arrays of multiple bars at once (compiled engine results, or bars without positions)
+        :param dates: datetime array of bars
+        :param positions: (optional) tuple (records count per bar, asset ids, qty, value), see. Account._positions_csr()
+        :param attribution: (optional) tuple (records count per bar, asset ids, pnl, costs)
+        :return:
+        """
+        n = len(dates)
+        i0 = self._buf_cnt
+        i1 = i0 + n
+        if i1 > self._buffer_len:
             raise ValueError("Incorrectly initialized account values buffer length or _process_position() called more times than expected")
+        if n == 0:
+            return
+
+        # The same order of summation as bar-by-bar processing
+        equity_close = np.cumsum(np.concatenate([[self._equity_close], pnl_close]))[1:]
+        equity_exec = np.cumsum(np.concatenate([[self._equity_exec], pnl_exec]))[1:]
 
-        self._date_array[i] = dt
+        self._date_array[i0:i1] = dates
+        self._pnl_array_close[i0:i1] = pnl_close
+        self._pnl_array_exec[i0:i1] = pnl_exec
+        self._equity_array_close[i0:i1] = equity_close
+        self._equity_array_exec[i0:i1] = equity_exec
+        self._capital_invested_array[i0:i1] = self._capital_invested
+        self._costs_array_close[i0:i1] = costs_close
+        self._costs_array_exec[i0:i1] = costs_exec
+        self._costs_array_potential_close[i0:i1] = costs_potential_close
+        self._costs_array_potential_exec[i0:i1] = costs_potential_exec
+        self._margin_array[i0:i1] = margin
+
+        self._equity_close = equity_close[-1]
+        self._equity_exec = equity_exec[-1]
+        self._margin = self._margin_array[i1 - 1]
+
+        for history, data in [(self._pos_history, positions), (self._attr_history, attribution)]:
+            if history is not None:
+                history.fill(i0, i1, data)
+
+        self._buf_cnt = i1
+
+    def _store_bar(self, dt, i, pnl_close_total, pnl_exec_total, costs_close_total, costs_exec_total,
+                   costs_potential_close_total, costs_potential_exec_total):
+        """
+        Updates equity and builds historical arrays of bar i
+        """
+        self._equity_close += pnl_close_total
+        self._equity_exec += pnl_exec_total
+
+        if self._timeline is None:
+            self._date_array[i] = dt
         self._pnl_array_close[i] = pnl_close_total
         self._pnl_array_exec[i] = pnl_exec_total
         self._equity_array_close[i] = self._equity_close
@@ -249,7 +1367,20 @@ class Account:
         self._costs_array_potential_close[i] = costs_potential_close_total
         self._costs_array_potential_exec[i] = costs_potential_exec_total
         self._margin_array[i] = self._margin
-        self._buf_cnt += 1
+
+    def _asset_point_value(self, dt, asset):
+        """
+        Asset point value at the bar (by quotes row if the asset supports bar lookups)
+        """
+        row = self._asset_row(asset)
+        return asset.get_point_value(dt) if row is None else asset.get_point_value(dt, row)
+
+    def _asset_margin(self, dt, asset, qty):
+        """
+        Asset margin requirements at the bar (by quotes row if the asset supports bar lookups)
+        """
+        row = self._asset_row(asset)
+        return asset.get_margin_requirements(dt, qty) if row is None else asset.get_margin_requirements(dt, qty, row)
 
     def _calc_account_margin(self, dt):
         """
@@ -259,20 +1390,22 @@ class Account:
         margin = 0.0
 
         for asset, (qty, cpx, epx, _) in self._position.items():
-            margin += asset.get_margin_requirements(dt, qty)
+            margin += self._asset_margin(dt, asset, qty)
 
         if not isfinite(margin):
             # Some asset returns invalid margin, find out which one!
             for asset, (qty, cpx, epx, _) in self._position.items():
-                margin = asset.get_margin_requirements(dt, qty)
+                margin = self._asset_margin(dt, asset, qty)
                 if not isfinite(margin):
                     break
+            if dt is None:
+                dt = self._bar_date()
             raise ValueError(f'Invalid margin requirements returned by {asset} at {dt} for qty: {qty}')
 
         return margin
 
     @staticmethod
-    def _calc_transactions(dt, current_position_dict, prev_position_dict):
+    def _calc_transactions(dt, current_position_dict, prev_position_dict, asset_row=None):
         """
         Should return
         - daily pnl (at close and exec price)
@@ -282,6 +1415,7 @@ class Account:
         :param dt:
         :param current_position_dict: dict of {<asset>: (<qty>, <close px>, <exec px>)}
         :param prev_position_dict: dict of {<asset>: (<qty>, <close px>, <exec px>)}
+        :param asset_row: (optional) function (asset) -> quotes row of the bar or None, see. Account._asset_row()
         :return:
         """
         pnl_close_total = 0.0
@@ -304,10 +1438,13 @@ class Account:
             prev_pos = prev_position_dict.get(asset, None) if prev_position_dict is not None else None
             # curr_pos = Tuple (PosQuantity, ClosePrice, ExecPrice)
             curr_pos = current_position_dict.get(asset, None)
+            # Quotes row of the bar is passed to the asset lookups only if the asset supports it
+            row = asset_row(asset) if asset_row is not None else None
+            bar = _NO_ROW if row is None else {'row': row}
 
             if curr_pos is not None:
                 curr_qty, close_price, exec_price, _ctx = curr_pos
-                costs_close, costs_exec = asset.get_costs(dt, curr_qty)
+                costs_close, costs_exec = asset.get_costs(dt, curr_qty, **bar)
                 costs_potential_close_total += costs_close
                 costs_potential_exec_total += costs_exec
 
@@ -347,11 +1484,11 @@ class Account:
                     prev_qty, prev_cpx, prev_epx, _ctx = prev_pos
 
                     # Costs and prices
-                    costs_close, costs_exec = asset.get_costs(dt, -prev_qty)
-                    close_price, exec_price = asset.get_prices(dt)
+                    costs_close, costs_exec = asset.get_costs(dt, -prev_qty, **bar)
+                    close_price, exec_price = asset.get_prices(dt, **bar)
 
-                    pnl_close = asset.calc_dollar_pnl(dt, prev_cpx, close_price, prev_qty) + costs_close
-                    pnl_execution = asset.calc_dollar_pnl(dt, prev_epx, exec_price, prev_qty) + costs_exec
+                    pnl_close = asset.calc_dollar_pnl(dt, prev_cpx, close_price, prev_qty, **bar) + costs_close
+                    pnl_execution = asset.calc_dollar_pnl(dt, prev_epx, exec_price, prev_qty, **bar) + costs_exec
                     position_action = -1  # 1 - open new position, -1 - close old position, 0 - hold position
 
                     # Store stats
@@ -388,9 +1525,9 @@ class Account:
                     if curr_qty == 0 and prev_qty == 0:
                         continue
 
-                costs_close, costs_exec = asset.get_costs(dt, trans_qty)
-                pnl_close = asset.calc_dollar_pnl(dt, prev_cpx, curr_cpx, prev_qty) + costs_close
-                pnl_execution = asset.calc_dollar_pnl(dt, prev_epx, curr_epx, prev_qty) + costs_exec
+                costs_close, costs_exec = asset.get_costs(dt, trans_qty, **bar)
+                pnl_close = asset.calc_dollar_pnl(dt, prev_cpx, curr_cpx, prev_qty, **bar) + costs_close
+                pnl_execution = asset.calc_dollar_pnl(dt, prev_epx, curr_epx, prev_qty, **bar) + costs_exec
 
                 position_action = 0  # 1 - open new position, -1 - close old position, 0 - hold position
                 abs_pos_chg = abs(curr_qty) - abs(prev_qty)
@@ -425,7 +1562,7 @@ class Account:
                     # If previous size is 2 (long) and current size is -1 (short), we will have to sell -3 but in 2 transactions
                     # sell -2 - to close previous long
                     # sell -1 - to open new short
-                    costs_close, costs_exec = asset.get_costs(dt, new_trans_qty)
+                    costs_close, costs_exec = asset.get_costs(dt, new_trans_qty, **bar)
                     pnl_close = costs_close
                     pnl_execution = costs_exec
 
@@ -4,6 +4,11 @@ import numpy as np
 from math import isfinite
 
 
+# Methods of market data lookups, the engine uses quotes rows of the timeline bars only if they are not overridden
+_BAR_DATA_METHODS = ('get_prices', 'get_point_value', 'get_costs', 'get_margin_requirements', 'calc_position_value',
+                     'calc_dollar_pnl')
+
+
 class Asset:
     """
     Generic asset class
@@ -11,32 +16,24 @@ class Asset:
 
     def __init__(self, **kwargs):
         self.ticker = kwargs['ticker']
-        self._quotes = kwargs['quotes']
+        quotes = kwargs['quotes']
 
-        if not isinstance(self._quotes, pd.DataFrame):
-            raise ValueError(f'Asset "{self}" quotes type must be Pandas.DataFrame, got type <{type(self._quotes)}>')
+        if not isinstance(quotes, pd.DataFrame):
+            raise ValueError(f'Asset "{self}" quotes type must be Pandas.DataFrame, got type <{type(quotes)}>')
         else:
-            if len(self._quotes) == 0:
+            if len(quotes) == 0:
                 raise ValueError(f"Empty quotes series for {self}")
-            if 'c' not in self._quotes or 'exec' not in self._quotes:
-                raise ValueError(f'Asset "{self}" quotes dataframe must contain at least "c" and "exec" columns and , got {self._quotes.columns}')
-        #
-        # Setting quotes cache for fast access
-        #
-        self._quotes_values = self._quotes.values
-        self._quotes_col_close = self._quotes.columns.get_loc('c')
-        self._quotes_col_exec = self._quotes.columns.get_loc('exec')
-
-        self.kwargs = kwargs
+            if 'c' not in quotes or 'exec' not in quotes:
+                raise ValueError(f'Asset "{self}" quotes dataframe must contain at least "c" and "exec" columns and , got {quotes.columns}')
 
         #
         #   Setting costs functions (to speed up code at execution time)
         #
-        self._costs_func = self._costs_func_zero
-        self._costs_value = None
+        costs_type = 'zero'
+        costs_value = None
 
-        if 'costs' in self.kwargs:
-            costs_dict = self.kwargs['costs']
+        if 'costs' in kwargs:
+            costs_dict = kwargs['costs']
             if not isinstance(costs_dict, dict) or 'type' not in costs_dict or 'value' not in costs_dict:
                 raise ValueError("'costs' in asset's kwargs must be a dict with {'type': ... and 'value': ... } keys")
 
@@ -45,38 +42,34 @@ class Asset:
                     raise ValueError("'costs' value of 'percent' type must be a single float number")
                 if costs_dict['value'] < 0:
                     raise ValueError("'costs' value of 'percent' type must be positive")
-                self._costs_value = costs_dict['value']
-                self._costs_func = self._costs_func_percent
 
             elif costs_dict['type'] == 'dollar':
                 if not isinstance(costs_dict['value'], (float, np.float, int, np.int32, np.int64)):
                     raise ValueError("'costs' value of 'dollar' type must be a single float number")
                 if costs_dict['value'] < 0:
                     raise ValueError("'costs' value of 'dollar' type must be positive")
-                self._costs_value = costs_dict['value']
-                self._costs_func = self._costs_func_dollar
 
             elif costs_dict['type'] == 'dynamic':
                 if not isinstance(costs_dict['value'], pd.DataFrame) or 'c' not in costs_dict['value'] or 'exec' not in costs_dict['value']:
                     raise ValueError("'costs' value of 'dynamic' type must be a Pandas.DataFrame with columns ['c', 'exec']")
-                if not self._quotes.index.equals(costs_dict['value'].index):
+                if not quotes.index.equals(costs_dict['value'].index):
                     raise ValueError("'costs' value of 'dynamic' dataframe must have the same length and index as quotes")
-                self._costs_value = costs_dict['value']
-                self._costs_func = self._costs_func_dynamic
             else:
                 raise ValueError(f"Unknown costs type {costs_dict['type']}, only 'percent', 'dollar', 'dynamic' are supported")
+            costs_type = costs_dict['type']
+            costs_value = costs_dict['value']
 
         #
         # Asset margin requirements
         #
-        self.margin = self.kwargs.get('margin', None)
-        if self.margin is not None:
-            if isinstance(self.margin, pd.Series):
+        margin = kwargs.get('margin', None)
+        if margin is not None:
+            if isinstance(margin, pd.Series):
                 # We have dynamic margin requirements for the asset
-                if not self._quotes.index.equals(self.margin.index):
+                if not quotes.index.equals(margin.index):
                     raise ValueError("'margin' pd.Series must have the same length and index as quotes")
-            elif isinstance(self.margin,  (float, np.float, int, np.int32, np.int64)):
-                if self.margin < 0:
+            elif isinstance(margin,  (float, np.float, int, np.int32, np.int64)):
+                if margin < 0:
                     raise ValueError("'margin' must be >= 0")
             else:
                 raise ValueError("'margin' unsupported type of asset margin, it must be pd.Series or float")
@@ -84,15 +77,13 @@ class Asset:
         #
         # Support of multileg assets
         #
-        self.legs = self.kwargs.get('legs', None)
-        """Most recent composition of multileg asset. This method might be used to get live position composition."""
-
-        if self.legs is None:
-            self.legs = {self.ticker: 1.0}
+        legs = kwargs.get('legs', None)
+        if legs is None:
+            legs = {self.ticker: 1.0}
         else:
-            if not isinstance(self.legs, dict):
+            if not isinstance(legs, dict):
                 raise ValueError("Asset 'legs' must be a dictionary of {<ticker_string>: <qty_float>}")
-            for k, v in self.legs.items():
+            for k, v in legs.items():
                 if not isinstance(k, str):
                     raise ValueError(f"Asset 'legs' keys must be strings, got {type(k)}")
                 if not isinstance(v, (float, np.float, int, np.int32, np.int64)):
@@ -101,16 +92,44 @@ class Asset:
         #
         # Asset point value
         #
-        self._point_value = self.kwargs.get('point_value', 1.0)
-        if isinstance(self._point_value, pd.Series):
+        point_value = kwargs.get('point_value', 1.0)
+        if isinstance(point_value, pd.Series):
             # We have dynamic point value for the asset
-            if not self._quotes.index.equals(self._point_value.index):
+            if not quotes.index.equals(point_value.index):
                 raise ValueError("'point_value' pd.Series must have the same length and index as quotes")
-        elif isinstance(self._point_value, (float, np.float, int, np.int32, np.int64)):
-            if self._point_value <= 0:
+        elif isinstance(point_value, (float, np.float, int, np.int32, np.int64)):
+            if point_value <= 0:
                 raise ValueError("'pointvalue' must be > 0")
         else:
-            raise ValueError(f"'point_value' unsupported type, it must be pd.Series or float, got {type(self._point_value)}")
+            raise ValueError(f"'point_value' unsupported type, it must be pd.Series or float, got {type(point_value)}")
+
+        self._init_state(self.ticker, quotes, kwargs, costs_type, costs_value, margin, legs, point_value)
+
+    def _init_state(self, ticker, quotes, kwargs, costs_type, costs_value, margin, legs, point_value):
+        """
+        Sets the asset state from validated data, shared by Asset.__init__() and Asset._synthetic()
+        :param costs_type: 'zero', 'percent', 'dollar' or 'dynamic'
+        """
+        self.ticker = ticker
+        self._quotes = quotes
+        self.kwargs = kwargs
+
+        #
+        # Setting quotes cache for fast access
+        #
+        self._quotes_values = quotes.values
+        self._quotes_col_close = quotes.columns.get_loc('c')
+        self._quotes_col_exec = quotes.columns.get_loc('exec')
+
+        self._costs_func = getattr(self, f'_costs_func_{costs_type}')
+        self._costs_value = costs_value
+        if costs_type == 'dynamic':
+            self._costs_bar_values = costs_value[['c', 'exec']].values
+
+        self.margin = margin
+        self.legs = legs
+        """Most recent composition of multileg asset. This method might be used to get live position composition."""
+        self._point_value = point_value
 
         #
         # Caching
@@ -120,6 +139,131 @@ class Asset:
         self._cache_pointvalue_date = None
         self._cache_pointvalue_result = None
 
+    @classmethod
+    def _synthetic(cls, ticker, index, px_close, px_exec, margin, costs_close, costs_exec, legs):
+        """
+        Fast constructor of the synthetic asset from the account arrays, the data is trusted, so no validation is made
+        :param ticker: asset ticker
+        :param index: datetime index
+        :param px_close: equity at close
+        :param px_exec: equity at execution
+        :param margin: margin requirements array (must be >= 0)
+        :param costs_close: potential costs at close
+        :param costs_exec: potential costs at execution
+        :param legs: dict of {<ticker_string>: <qty_float>}
+        :return: Asset
+        """
+        self = cls.__new__(cls)
+        index = pd.DatetimeIndex(index)
+        n = len(index)
+        quotes = pd.DataFrame(np.column_stack([px_close, px_close, px_close, px_close, np.zeros(n), px_exec]),
+                              index=index, columns=['o', 'h', 'l', 'c', 'v', 'exec'])
+        costs = pd.DataFrame(np.column_stack([costs_close, costs_exec]), index=index, columns=['c', 'exec'])
+        margin = pd.Series(margin, index=index)
+
+        kwargs = {
+            'ticker': ticker,
+            'quotes': quotes,
+            'is_synthetic': True,
+            'point_value': 1.0,
+            'margin': margin,
+            'legs': legs,
+            'costs': {'type': 'dynamic', 'value': costs},
+        }
+        self._init_state(ticker, quotes, kwargs, 'dynamic', costs, margin, legs, 1.0)
+        return self
+
+    def _timeline_rows(self, timeline):
+        """
+        Quotes rows of the timeline bars for the engine bar lookups (the last row at or before the bar, -1 if no quotes)
+        :param timeline: datetime index
+        :return: list of int, or None if bar lookups are not supported (custom prices, point value, costs or margin
+                 methods, or unsorted quotes)
+        """
+        cls = type(self)
+        if any(getattr(cls, m) is not getattr(Asset, m) for m in _BAR_DATA_METHODS):
+            return None
+        if not self._quotes.index.is_monotonic_increasing:
+            return None
+        return self._quotes.index.get_indexer(timeline, method='pad').tolist()
+
+    def _data_start(self):
+        """
+        The first date when quotes, point value and margin requirements are all available
+        """
+        start = self._quotes.index[0]
+        if isinstance(self._point_value, pd.Series):
+            start = max(start, self._point_value.index[0])
+        if isinstance(self.margin, pd.Series):
+            start = max(start, self.margin.index[0])
+        return start
+
+    def _aligned_arrays(self, index) -> Dict[str, np.ndarray]:
+        """
+        Prices, point value, costs and margin per 1 unit of qty aligned to the index, used by vectorized engine.
+        Values at missing dates are taken from the previous available date (the same as get_prices() logic), and
+        the same errors are raised as by get_prices(), get_point_value() and get_margin_requirements()
+        :param index: datetime index, must start at or after Asset._data_start()
+        :return: dict of np.ndarray {'c', 'exec', 'point_value', 'costs_c', 'costs_exec', 'margin'}
+        """
+        def _align(obj):
+            return obj if obj.index.equals(index) else obj.reindex(index, method='ffill')
+
+        if len(index) > 0:
+            if index[0] < self._quotes.index[0]:
+                raise KeyError(f'No quotes found at {index[0]}, quotes range {self._quotes.index[0]} - {self._quotes.index[-1]}')
+            if isinstance(self._point_value, pd.Series) and index[0] < self._point_value.index[0]:
+                raise KeyError(f'No point value found at {index[0]}, range {self._point_value.index[0]} - {self._point_value.index[-1]}')
+            if isinstance(self.margin, pd.Series) and index[0] < self.margin.index[0]:
+                raise KeyError(f'No margin found at {index[0]}, margin range {self.margin.index[0]} - {self.margin.index[-1]}')
+
+        quotes = _align(self._quotes[['c', 'exec']])
+        cpx = quotes['c'].values.astype(np.float64)
+        epx = quotes['exec'].values.astype(np.float64)
+        n = len(index)
+
+        if isinstance(self._point_value, pd.Series):
+            point_value = _align(self._point_value).values.astype(np.float64)
+            invalid = np.flatnonzero(point_value <= 0)
+            if len(invalid) > 0:
+                raise ValueError(f'Point value for the asset {self} is <= 0 at {index[invalid[0]]} '
+                                 f'value: {point_value[invalid[0]]}')
+        else:
+            point_value = np.full(n, float(self._point_value))
+
+        if self._costs_func == self._costs_func_percent:
+            costs_c, costs_exec = np.abs(cpx * self._costs_value), np.abs(epx * self._costs_value)
+        elif self._costs_func == self._costs_func_dollar:
+            costs_c = costs_exec = np.full(n, abs(float(self._costs_value)))
+        elif self._costs_func == self._costs_func_dynamic:
+            costs = _align(self._costs_value[['c', 'exec']])
+            costs_c, costs_exec = np.abs(costs['c'].values), np.abs(costs['exec'].values)
+        else:
+            costs_c = costs_exec = np.zeros(n)
+
+        unit_value = np.where(np.isfinite(epx), epx, cpx) * point_value
+        if self.margin is None:
+            margin = unit_value
+        elif isinstance(self.margin, pd.Series):
+            margin = _align(self.margin).values.astype(np.float64)
+            invalid = np.flatnonzero(margin < 0)
+            if len(invalid) > 0:
+                raise ValueError(f'Margin requirements for the asset {self} is negative at {index[invalid[0]]} '
+                                 f'value: {margin[invalid[0]]}')
+        elif self.margin <= 1.0:
+            margin = unit_value * self.margin
+        else:
+            margin = np.full(n, float(self.margin))
+
+        return {
+            'c': cpx,
+            'exec': epx,
+            'point_value': point_value,
+            'costs_c': costs_c,
+            'costs_exec': costs_exec,
+            'margin': margin,
+        }
+
     def __hash__(self):
         return hash(self.ticker)
 
@@ -148,12 +292,16 @@ class Asset:
         """
         return self._quotes
 
-    def get_prices(self, date) -> Tuple[float, float]:
+    def get_prices(self, date, row=None) -> Tuple[float, float]:
         """
         Get Close and Execution price at 'date'
         :param date:
+        :param row: (optional) quotes row of the date (see. Asset._timeline_rows()), skips the date lookup
         :return: tuple (close px, exec px)
         """
+        if row is not None:
+            values = self._quotes_values[row]
+            return values[self._quotes_col_close], values[self._quotes_col_exec]
         if self._cache_px_date == date:
             # Use cached prices if we had previous request at the same date
             return self._cache_px_result
@@ -172,12 +320,19 @@ class Asset:
         self._cache_px_result = result
         return result
 
-    def get_point_value(self, date) -> float:
+    def get_point_value(self, date, row=None) -> float:
         """
         Return dollar value per 1 point (execution time)
         :param date:
+        :param row: (optional) quotes row of the date (see. Asset._timeline_rows()), skips the date lookup
         :return:
         """
+        if row is not None and isinstance(self._point_value, pd.Series):
+            result = self._point_value.values[row]
+            if result <= 0:
+                raise ValueError(f'Point value for the asset {self} is <= 0 at {date} value: {result}')
+            return result
+
         if self._cache_pointvalue_date == date:
             return self._cache_pointvalue_result
 
@@ -203,31 +358,36 @@ class Asset:
             self._cache_pointvalue_result = self._point_value
             return self._point_value
 
-    def get_costs(self, date, qty) -> Tuple[float, float]:
+    def get_costs(self, date, qty, row=None) -> Tuple[float, float]:
         """
         Calculate asset's transaction costs in dollars at specific date
 
         :param date: calculation date
         :param qty: Transaction quantity
+        :param row: (optional) quotes row of the date (see. Asset._timeline_rows()), skips the date lookup
         :return: tuple (close time costs, exec time costs px)
         """
         # self._costs_func is dynamically defined based on costs settings see. __init__()
-        return self._costs_func(date, qty)
+        return self._costs_func(date, qty, row)
 
-    def _costs_func_zero(self, date, qty):
+    def _costs_func_zero(self, date, qty, row=None):
         return 0.0, 0.0
 
-    def _costs_func_percent(self, date, qty):
-        cpx, epx = self.get_prices(date)
+    def _costs_func_percent(self, date, qty, row=None):
+        # Subclasses may override lookups without 'row' argument
+        cpx, epx = self.get_prices(date) if row is None else self.get_prices(date, row)
         return -abs(cpx * self._costs_value * qty), -abs(epx * self._costs_value * qty)
 
-    def _costs_func_dollar(self, date, qty):
+    def _costs_func_dollar(self, date, qty, row=None):
         return -abs(self._costs_value * qty), -abs(self._costs_value * qty)
 
-    def _costs_func_dynamic(self, date, qty):
+    def _costs_func_dynamic(self, date, qty, row=None):
         try:
             # Try fast way
-            ccosts, ecosts = self._costs_value.at[date, 'c'], self._costs_value.at[date, 'exec']
+            if row is not None:
+                ccosts, ecosts = self._costs_bar_values[row]
+            else:
+                ccosts, ecosts = self._costs_value.at[date, 'c'], self._costs_value.at[date, 'exec']
         except KeyError:
             ser = self._costs_value.loc[:date]
             if len(ser) == 0:
@@ -236,21 +396,25 @@ class Asset:
 
         return -abs(ccosts * qty), -abs(ecosts * qty)
 
-    def get_margin_requirements(self, date, qty) -> float:
+    def get_margin_requirements(self, date, qty, row=None) -> float:
         """
         Get margin requirements for the asset (at execution time)
         :param date: calculation date
         :param qty: quantity of opened position
+        :param row: (optional) quotes row of the date (see. Asset._timeline_rows()), skips the date lookup
         :return:
         """
         if self.margin is None:
             # if no margin settings, use cash-like margin (100% margin requirements)
-            return self.calc_position_value(date, qty)
+            return self.calc_position_value(date, qty) if row is None else self.calc_position_value(date, qty, row)
         else:
             if isinstance(self.margin, pd.Series):
                 try:
                     # Try fast way
-                    result = self.margin.at[date]
+                    if row is not None:
+                        result = self.margin.values[row]
+                    else:
+                        result = self.margin.at[date]
                 except KeyError:
                     ser = self.margin.loc[:date]
                     if len(ser) == 0:
@@ -264,20 +428,21 @@ class Asset:
                 if self.margin <= 1.0:
                     # Margin is floating number < 1.0
                     # Use percent margin in this case
-                    pval = self.calc_position_value(date, qty)
+                    pval = self.calc_position_value(date, qty) if row is None else self.calc_position_value(date, qty, row)
                     return pval * self.margin
                 else:
                     # Margin is floating number > 1.0
                     # Use absolute dollar margin in this case
                     return self.margin * abs(qty)
 
-    def calc_position_value(self, date, qty) -> float:
+    def calc_position_value(self, date, qty, row=None) -> float:
         """
         Calculate dollar position value at the specific 'date' (execution time)
         :param date:
+        :param row: (optional) quotes row of the date (see. Asset._timeline_rows()), skips the date lookup
         :return:
         """
-        cpx, epx = self.get_prices(date)
+        cpx, epx = self.get_prices(date) if row is None else self.get_prices(date, row)
         if isfinite(epx):
             _valid_price = epx
         elif isfinite(cpx):
@@ -285,9 +450,10 @@ class Asset:
         else:
             raise ValueError(f"Invalid asset price for {self} at {date}")
 
-        return _valid_price * self.get_point_value(date) * abs(qty)
+        point_value = self.get_point_value(date) if row is None else self.get_point_value(date, row)
+        return _valid_price * point_value * abs(qty)
 
-    def calc_dollar_pnl(self, date, prev_price, current_price, qty) -> float:
+    def calc_dollar_pnl(self, date, prev_price, current_price, qty, row=None) -> float:
         """
         Calculate dollar PnL for asset
 
@@ -295,6 +461,8 @@ class Asset:
         :param prev_price: previous price
         :param current_price: current price
         :param qty:
+        :param row: (optional) quotes row of the date (see. Asset._timeline_rows()), skips the date lookup
         :return: PnL in dollars
         """
-        return (current_price - prev_price) * qty * self.get_point_value(date)
+        point_value = self.get_point_value(date) if row is None else self.get_point_value(date, row)
+        return (current_price - prev_price) * qty * point_value
@@ -1,10 +1,88 @@
 from typing import List
+from collections import OrderedDict
+import copy
+import inspect
 import pandas as pd
 import numpy as np
+import numba
 from ._asset import Asset
 from ._strategy import Strategy
 from ._account import Account
-from ._containers import MFrame
+from ._report import Report
+from ._containers import MFrame, MetricStore, UniversePanel, PositionDelta, ExecutionPanel
+from ._parallel import pool_map, dumps_by_ticker, loads_by_ticker
+
+
+def _dumps_account(acc: Account) -> bytes:
+    return dumps_by_ticker(acc)
+
+
+def _loads_account(data: bytes, assets_map: dict) -> Account:
+    return loads_by_ticker(data, assets_map)
+
+
+# Asset universe of the worker process (set by pool initializer, to avoid pickling the universe for every task)
+_worker_universe = None
+
+
+def _composite_init(asset_universe):
+    global _worker_universe
+    _worker_universe = asset_universe
+
+
+# Prepared metrics of the worker process {params group: metrics}, see. Backtester._prepare_metrics()
+_worker_metrics = None
+
+
+def _metrics_init(metrics_groups):
+    global _worker_metrics
+    _worker_metrics = metrics_groups
+
+
+def _slices_worker(args):
+    strategy, group, i0, i1, run_kwargs = args
+    return _dumps_account(Backtester._run_bars(strategy, _worker_metrics[group], i0, i1, **run_kwargs))
+
+
+def _cv_worker(args):
+    strategy, fit, train_dates, i0, i1, run_kwargs = args
+    return _dumps_account(Backtester._run_fold(strategy, fit, train_dates, _worker_metrics[None], i0, i1, **run_kwargs))
+
+
+def _score_worker(args):
+    strategy, group, i0, i1, objective, run_kwargs = args
+    strategy.initialize()
+    acc = Backtester._run_bars(strategy, _worker_metrics[group], i0, i1, **run_kwargs)
+    # Runs stopped by stopping rules are the worst
+    return -np.inf if acc.stopped_at is not None else float(objective(acc))
+
+
+def _sweep_worker(args):
+    strategy, group, state, i0, i1, n_bars, objective, run_kwargs = args
+    ctx = _worker_metrics[group]
+    if state is None:
+        strategy.initialize()
+        acc = Backtester._new_account(strategy, n_bars, **run_kwargs)
+    else:
+        # Promoted candidate continues its run from the end of the previous prefix
+        strategy, acc = loads_by_ticker(state, {a.ticker: a for a in ctx['assets']})
+    if acc.stopped_at is None:
+        Backtester._run_bars(strategy, ctx, i0, i1, acc=acc, resume=state is not None, **run_kwargs)
+    # Runs stopped by stopping rules are the worst
+    score = -np.inf if acc.stopped_at is not None else float(objective(acc))
+    return score, (dumps_by_ticker((strategy, acc)) if i1 < n_bars else None)
+
+
+def _objective_net_profit(acc: Account) -> float:
+    """
+    Default objective of the optimization: net profit of the account
+    """
+    return acc.capital_equity - acc.capital_invested
+
+
+def _composite_worker(args):
+    strategy, run_kwargs = args
+    return _dumps_account(Backtester.run(strategy, _worker_universe, **run_kwargs))
 
 
 class Backtester:
@@ -12,21 +90,33 @@ class Backtester:
     Generic portfolio backtester
     """
     @staticmethod
-    def _process_metrics(strategy, asset_universe):
+    def _calc_asset_metrics(strategy, asset_universe, dtype=np.float64, validate_n=None):
         """
-        Collects metrics for all assets in universe and prepares dataset for portfolio composition stage
-        :return:
+        Launches strategy.calculate() for every asset in the universe and validates results
+        :param dtype: metrics dtype, if None - native dtypes are preserved (but must be numeric)
+        :param validate_n: validate results of the first N assets only (None - validate all)
+        :return: tuple (OrderedDict of {asset: pd.DataFrame}, columns)
         """
-        # Step 1: launch self.strategy.calculate() for every asset in the universe and produce asset metrics
-        asset_metrics_all = {}
+        asset_metrics_all = OrderedDict()
         col_names = None
 
-        for asset in asset_universe:
+        for k, asset in enumerate(asset_universe):
             _res = strategy.calculate(asset)
-            try:
-                _res = _res.astype(np.float, copy=False)
-            except:
-                raise ValueError(f"Couldn't convert {strategy}.calculate({asset}) result to float dtype, "
+            if validate_n is not None and k >= validate_n:
+                # Trusted results
+                asset_metrics_all[asset] = _res = _res if dtype is None else _res.astype(dtype, copy=False)
+                if col_names is None:
+                    col_names = _res.columns
+                continue
+
+            if dtype is not None:
+                try:
+                    _res = _res.astype(dtype, copy=False)
+                except:
+                    raise ValueError(f"Couldn't convert {strategy}.calculate({asset}) result to float dtype, "
+                                     f"calculate() method must return a pd.DataFrame with numbers (int, float, bool), no objects or strings are allowed!")
+            elif not all(dt.kind in 'biuf' for dt in _res.dtypes):
+                raise ValueError(f"{strategy}.calculate({asset}) result has non-numeric dtypes, "
                                  f"calculate() method must return a pd.DataFrame with numbers (int, float, bool), no objects or strings are allowed!")
 
             if col_names is None:
@@ -37,6 +127,79 @@ class Backtester:
 
             asset_metrics_all[asset] = _res
 
+        return asset_metrics_all, col_names
+
+    @staticmethod
+    def _has_universe_calc(strategy) -> bool:
+        """
+        Checks if strategy overrides vectorized Strategy.calculate_universe() method
+        """
+        return getattr(type(strategy), 'calculate_universe', Strategy.calculate_universe) is not Strategy.calculate_universe
+
+    @staticmethod
+    def _calc_universe_metrics(strategy, asset_universe):
+        """
+        Launches strategy.calculate_universe() for the whole universe and validates results
+        :return: tuple (index, assets, OrderedDict of {column: np.ndarray (time x assets)})
+        """
+        panel = UniversePanel(asset_universe)
+        _res = strategy.calculate_universe(panel)
+        if not isinstance(_res, dict) or len(_res) == 0:
+            raise ValueError(f"{strategy}.calculate_universe() must return a non-empty dict of "
+                             f"{{metric_name: np.ndarray (time x assets)}}")
+
+        cube = OrderedDict()
+        for col, arr in _res.items():
+            arr = np.asarray(arr)
+            if arr.shape != panel.shape:
+                raise ValueError(f"{strategy}.calculate_universe() metric '{col}' has shape {arr.shape}, "
+                                 f"expected {panel.shape} (time x assets)")
+            if arr.dtype.kind not in 'biuf':
+                raise ValueError(f"{strategy}.calculate_universe() metric '{col}' has non-numeric dtype, "
+                                 f"calculate_universe() method must return arrays of numbers (int, float, bool)")
+            cube[col] = arr
+
+        return panel.index, panel.assets, cube
+
+    @staticmethod
+    def _process_metrics_typed(strategy, asset_universe, bitpack=True, float_dtype=None, validate_n=None):
+        """
+        Collects metrics for all assets in universe into column-oriented storage with native dtypes
+        :param validate_n: validate strategy.calculate() results of the first N assets only (None - validate all)
+        :return: MetricStore
+        """
+        if Backtester._has_universe_calc(strategy):
+            index, assets, cube = Backtester._calc_universe_metrics(strategy, asset_universe)
+            return MetricStore.from_arrays(index, assets, cube, bitpack=bitpack, float_dtype=float_dtype)
+
+        asset_metrics_all, col_names = Backtester._calc_asset_metrics(strategy, asset_universe, dtype=None,
+                                                                      validate_n=validate_n)
+        return MetricStore.from_frames(asset_metrics_all, col_names, bitpack=bitpack, float_dtype=float_dtype)
+
+    @staticmethod
+    def _process_metrics(strategy, asset_universe, dtype=np.float64, validate_n=None):
+        """
+        Collects metrics for all assets in universe and prepares dataset for portfolio composition stage
+        :param dtype: metrics dtype (np.float64 or np.float32)
+        :param validate_n: validate strategy.calculate() results of the first N assets only (None - validate all)
+        :return:
+        """
+        if Backtester._has_universe_calc(strategy):
+            # Vectorized path: the metric cube goes directly to the (asset, column) layout, no per-asset concat
+            index, assets, cube = Backtester._calc_universe_metrics(strategy, asset_universe)
+            n_assets, n_cols = len(assets), len(cube)
+            values = np.empty((len(index), n_assets, n_cols), dtype=dtype)
+            for j, arr in enumerate(cube.values()):
+                values[:, :, j] = arr
+
+            columns = pd.MultiIndex(levels=[pd.Index(assets, dtype=object), list(cube.keys())],
+                                    codes=[np.repeat(np.arange(n_assets), n_cols), np.tile(np.arange(n_cols), n_assets)])
+            return pd.DataFrame(values.reshape(len(index), n_assets * n_cols), index=index, columns=columns, copy=False)
+
+        # Step 1: launch self.strategy.calculate() for every asset in the universe and produce asset metrics
+        asset_metrics_all, col_names = Backtester._calc_asset_metrics(strategy, asset_universe, dtype=dtype,
+                                                                      validate_n=validate_n)
+
         # Step 2: Join and align all asset metrics into the single dataset
         df_all_metrics = pd.concat(asset_metrics_all.values(), keys=asset_metrics_all.keys(), axis=1, copy=False)
 
@@ -46,6 +209,82 @@ class Backtester:
 
         return df_all_metrics
 
+    @staticmethod
+    def _rebalance_mask(strategy, dt_idx, columns, get_metric):
+        """
+        Calculates bars where strategy.compose_portfolio() must be called (see. Strategy.rebalance_trigger and
+        Strategy.rebalance_calendar)
+        :param dt_idx: metrics datetime index
+        :param columns: list of metrics columns
+        :param get_metric: function (column_index) -> np.ndarray (time x assets) of metric values (packed bits allowed)
+        :return: boolean np.ndarray or None (if rebalancing at every bar)
+        """
+        # The hooks are enabled only by values of their types (metric name, period alias or dates list), so
+        # strategies and their mocks without the hooks rebalance at every bar
+        trigger = getattr(strategy, 'rebalance_trigger', None)
+        if not isinstance(trigger, str):
+            trigger = None
+        calendar = getattr(strategy, 'rebalance_calendar', None)
+        if not isinstance(calendar, (str, list, tuple, np.ndarray, pd.Index)):
+            calendar = None
+        if trigger is None and calendar is None:
+            return None
+
+        mask = np.zeros(len(dt_idx), dtype=bool)
+        if trigger is not None:
+            if trigger not in columns:
+                raise ValueError(f"{strategy}.rebalance_trigger metric '{trigger}' is not found in metrics {columns}")
+            values = get_metric(columns.index(trigger))
+            with np.errstate(invalid='ignore'):
+                mask |= np.any((values != 0) & (values == values), axis=1)
+
+        if calendar is not None:
+            if isinstance(calendar, str):
+                try:
+                    periods = pd.DatetimeIndex(dt_idx).to_period(calendar).asi8
+                except ValueError:
+                    raise ValueError(f"{strategy}.rebalance_calendar must be pandas period alias (i.e. 'W', 'M') "
+                                     f"or list of dates, got '{calendar}'")
+                if len(periods) > 0:
+                    mask[0] = True
+                    mask[1:] |= periods[1:] != periods[:-1]
+            else:
+                pos = pd.DatetimeIndex(dt_idx).searchsorted(pd.DatetimeIndex(calendar))
+                mask[pos[pos < len(mask)]] = True
+
+        return mask
+
+    @staticmethod
+    def _warmup_bars(strategy, n_bars, columns, get_metric, auto=False):
+        """
+        Number of warm-up bars at the beginning of the history (see. Strategy.warmup), compose_portfolio() is not
+        called at these bars
+        :param n_bars: number of bars
+        :param columns: list of metrics columns
+        :param get_metric: function (column_index) -> np.ndarray (time x assets) of metric values (packed bits allowed)
+        :param auto: if Strategy.warmup is not set, detect the first bar with any finite metric across the universe
+        :return: int
+        """
+        warmup = getattr(strategy, 'warmup', None)
+        if isinstance(warmup, (float, np.floating)) or isinstance(warmup, (int, np.integer)) and warmup < 0:
+            raise ValueError(f"{strategy}.warmup must be non-negative integer number of bars, got {warmup}")
+        if isinstance(warmup, (int, np.integer)):
+            return min(int(warmup), n_bars)
+
+        if not auto:
+            return 0
+
+        is_finite = np.zeros(n_bars, dtype=bool)
+        for j in range(len(columns)):
+            values = get_metric(j)
+            if values.dtype.kind != 'f':
+                # Integer and boolean metrics are always finite
+                return 0
+            is_finite |= np.any(np.isfinite(values), axis=1)
+
+        first = np.flatnonzero(is_finite)
+        return int(first[0]) if len(first) > 0 else n_bars
+
     @staticmethod
     def run(strategy: Strategy, asset_universe: List[Asset], **kwargs) -> Account:
         """
@@ -55,46 +294,614 @@ class Backtester:
         :param kwargs:
             - 'acc_name' - resulting account name (by default: uses strategy name)
             - 'acc_initial_capital' - initial capital (default: 0)
+            - 'acc_verbose' - log holding bars (unchanged position qty) into account transactions (default: False),
+                              otherwise PnL of holding bars is added to the next transaction of the asset
+            - 'acc_history' - record position history and per asset PnL attribution (default: True), set False to
+                              skip it when only equity and transactions are needed (e.g. parameter sweeps)
+            - 'validate' - validation of strategy results (default: 'full'):
+                           'full' - validate calculate() results of every asset and compose_portfolio() at every bar
+                           'first_n' - validate the first 'validate_n' assets and bars, then switch to unchecked path
+                           'off' - no validation (use it only for debugged strategies)
+            - 'validate_n' - number of assets and bars to validate in 'first_n' mode (default: 100)
+            - 'start' / 'end' - dates range of the portfolio composition loop (inclusive, default: whole history),
+                                metrics are calculated for the whole history, so indicators are warmed up at 'start'.
+                                The account starts without positions, compose_portfolio() is called at the first bar.
+            - 'skip_warmup' - skip leading bars without any finite metric across the universe, compose_portfolio() is
+                              called from the first bar with data (default: False). If Strategy.warmup is set,
+                              its number of bars is skipped in any case.
+            - 'metrics_typed' - keep metrics in their native dtypes (bool, int8, float32...) instead of float64,
+                                reduces memory footprint of large universes (default: False)
+            - 'metrics_bitpack' - pack boolean metrics into bits, used with 'metrics_typed' (default: True)
+            - 'metrics_dtype' - float dtype of metrics np.float64 or np.float32 (default: np.float64),
+                                float32 halves memory of metrics, but values have only ~7 significant digits
+                                (relative error up to ~6e-8), strategy decisions near thresholds (i.e. a == b) might
+                                differ from float64 run. Account and PnL calculations are always in float64.
+            - 'stop_max_drawdown' - stop the run after the bar where drawdown of equity from its peak >= value (in $)
+            - 'stop_max_drawdown_pct' - stop the run after the bar where drawdown of equity >= value (in % of equity
+                                        peak, applied if the peak is positive)
+            - 'stop_equity_floor' - stop the run after the bar where equity < value
+            - 'stop_callback' - function (Account) -> bool, called after every bar, stops the run if True
+                                (not supported by Strategy.compose_kernel)
+                                Stopping rules use equity at execution price (see. Account.as_dataframe()['equity']),
+                                the account of stopped run ends at the stop bar (positions remain opened),
+                                Account.stopped_at is the date of the stop bar (default: no stopping rules)
         :return: Account class
         """
+        ctx = Backtester._prepare_metrics(strategy, asset_universe, **kwargs)
+        i0, i1 = Backtester._slice_bars(ctx['dt_idx'], kwargs.get('start', None), kwargs.get('end', None))
+        return Backtester._run_bars(strategy, ctx, i0, i1, **kwargs)
+
+    @staticmethod
+    def _slice_bars(dt_idx, start=None, end=None):
+        """
+        Bars range of the run
+        :param dt_idx: metrics datetime index
+        :param start: first date of the range (inclusive), None - from the beginning of the history
+        :param end: last date of the range (inclusive), None - till the end of the history
+        :return: tuple (first bar index, last bar index + 1)
+        """
+        i0 = 0 if start is None else int(dt_idx.searchsorted(pd.Timestamp(start), side='left'))
+        i1 = len(dt_idx) if end is None else int(dt_idx.searchsorted(pd.Timestamp(end), side='right'))
+        if start is not None or end is not None:
+            if not (dt_idx.is_monotonic_increasing and dt_idx.is_unique):
+                raise ValueError("Inconsistent datetime index order, quotes must be sorted in ascending order")
+            if i0 >= i1:
+                raise ValueError(f"No bars found in range {start} - {end}")
+        return i0, i1
+
+    @staticmethod
+    def _stop_rules(kwargs):
+        """
+        Early stopping rules of the run (see. Account._is_stop())
+        :param kwargs: Backtester.run() kwargs
+        :return: tuple (max drawdown, max drawdown %, equity floor, callback) or None if no rules are set
+        """
+        stop = (kwargs.get('stop_max_drawdown', None), kwargs.get('stop_max_drawdown_pct', None),
+                kwargs.get('stop_equity_floor', None), kwargs.get('stop_callback', None))
+        for name, value in zip(('stop_max_drawdown', 'stop_max_drawdown_pct'), stop[:2]):
+            if value is not None and value <= 0:
+                raise ValueError(f"'{name}' must be positive, got {value}")
+        if stop[3] is not None and not callable(stop[3]):
+            raise ValueError("'stop_callback' must be a function (Account) -> bool")
+        return None if all(v is None for v in stop) else stop
+
+    @staticmethod
+    def _is_stopped(acc, stop, dt):
+        """
+        Checks early stopping rules after the bar (see. Account._is_stop()), and marks the account as stopped
+        :param dt: bar datetime
+        :return: True if the run must be stopped
+        """
+        if not acc._is_stop(stop):
+            return False
+        acc.stopped_at = dt
+        return True
+
+    @staticmethod
+    def _new_account(strategy, buffer_len, **kwargs) -> Account:
+        """
+        Creates the account of the run
+        :param buffer_len: number of bars
+        :param kwargs: Backtester.run() kwargs
+        :return: Account class
+        """
+        return Account(buffer_len=buffer_len,
+                       name=kwargs.get('acc_name', str(strategy)),
+                       initial_capital=kwargs.get('acc_initial_capital', 0),
+                       verbose=kwargs.get('acc_verbose', False),
+                       history=kwargs.get('acc_history', True),
+                       )
+
+    @staticmethod
+    def _prepare_metrics(strategy, asset_universe, **kwargs) -> dict:
+        """
+        Calculates metrics of the strategy for the whole history of the universe, the result is shared by runs of
+        different bars ranges (see. Backtester._run_bars())
+        :param kwargs: Backtester.run() kwargs
+        :return: dict of metrics and run settings
+        """
+        metrics_dtype = np.dtype(kwargs.get('metrics_dtype', np.float64))
+        if metrics_dtype not in (np.float64, np.float32):
+            raise ValueError(f"'metrics_dtype' must be np.float64 or np.float32, got {metrics_dtype}")
+
+        validate = kwargs.get('validate', 'full')
+        if validate == 'full':
+            validate_n = None
+        elif validate == 'first_n':
+            validate_n = kwargs.get('validate_n', 100)
+        elif validate == 'off':
+            validate_n = 0
+        else:
+            raise ValueError(f"'validate' must be 'full', 'first_n' or 'off', got '{validate}'")
+
         # Initialize and reset strategy cache (if any)
         strategy.initialize()
 
         # Get asset universe combined metrics
-        df_all_metrics = Backtester._process_metrics(strategy, asset_universe)
+        if kwargs.get('metrics_typed', False):
+            mstore = Backtester._process_metrics_typed(strategy, asset_universe,
+                                                       bitpack=kwargs.get('metrics_bitpack', True),
+                                                       float_dtype=kwargs.get('metrics_dtype', None),
+                                                       validate_n=validate_n)
+            vals = None
+            dt_idx = mstore.index
+            assets, columns = mstore.assets, mstore.columns
+            get_metric = lambda j: mstore._arrays[j]
+        else:
+            df_all_metrics = Backtester._process_metrics(strategy, asset_universe, dtype=metrics_dtype,
+                                                         validate_n=validate_n)
+            # Setting vals / dt_idx in sake of performance
+            mstore = None
+            vals = df_all_metrics.values
+            dt_idx = df_all_metrics.index
+            assets, columns = df_all_metrics.columns.levels[0], df_all_metrics.columns.levels[1]
+            n_cols = len(columns)
+            get_metric = lambda j: vals[:, j::n_cols]
 
-        acc = Account(buffer_len=len(df_all_metrics),
-                      name=kwargs.get('acc_name', str(strategy)),
-                      initial_capital=kwargs.get('acc_initial_capital', 0),
-                      )
+        if validate == 'first_n' and not (dt_idx.is_monotonic_increasing and dt_idx.is_unique):
+            raise ValueError("Inconsistent datetime index order, quotes must be sorted in ascending order")
 
-        last_dt = None
+        return {
+            'dt_idx': dt_idx,
+            'vals': vals,
+            'mstore': mstore,
+            'assets': assets,
+            'columns': columns,
+            'rebalance': Backtester._rebalance_mask(strategy, dt_idx, list(columns), get_metric),
+            'warmup': Backtester._warmup_bars(strategy, len(dt_idx), list(columns), get_metric,
+                                              auto=kwargs.get('skip_warmup', False)),
+            'validate': validate,
+            # Number of bars with per-bar validation
+            'n_checked': len(dt_idx) if validate_n is None else validate_n,
+        }
 
-        # Setting vals / dt_idx in sake of performance
-        vals = df_all_metrics.values
-        dt_idx = df_all_metrics.index
-        mframe = MFrame(assets=df_all_metrics.columns.levels[0],
-                        columns=df_all_metrics.columns.levels[1])
+    @staticmethod
+    def _run_bars(strategy, ctx, i0, i1, acc=None, resume=False, **kwargs) -> Account:
+        """
+        Runs portfolio composition loop on bars [i0, i1) of the prepared metrics (see. Backtester._prepare_metrics())
+        :param acc: (optional) account to continue (i.e. stitching of walk-forward segments), the account buffer must
+                    have room for the bars, by default new account is created
+        :param resume: the account is continued by the same strategy instance which has run it up to bar i0, the run
+                       is the same as uninterrupted one (no forced rebalance at i0, the stopping rules keep the equity
+                       peak)
+        :param kwargs: Backtester.run() kwargs
+        :return: Account class, the account starts at bar i0
+        """
+        dt_idx, vals, mstore, rebalance = ctx['dt_idx'], ctx['vals'], ctx['mstore'], ctx['rebalance']
+        validate, n_checked = ctx['validate'], ctx['n_checked']
+        mframe = MFrame(assets=ctx['assets'], columns=ctx['columns'])
+        timeline = dt_idx[i0:i1]
+        stop = Backtester._stop_rules(kwargs)
 
-        for i in range(df_all_metrics.values.shape[0]):
-            row = vals[i]
-            dt = dt_idx[i]
+        is_continued = acc is not None and acc._buf_cnt > 0
+        if acc is None:
+            acc = Backtester._new_account(strategy, len(timeline), **kwargs)
 
+        # Warm-up bars of the history in the range (opened positions of continued account are never skipped)
+        i_live = i0 if len(acc._position) > 0 else min(max(i0, ctx['warmup']), i1)
+        # The range starts without positions (or with positions of another strategy), the first live bar always
+        # rebalances
+        force_rebalance = i_live if (i0 > 0 or is_continued) and not resume else -1
+
+        compose_kernel = getattr(strategy, 'compose_kernel', None)
+        compose_kernel = getattr(compose_kernel, '__func__', compose_kernel)
+        if inspect.isfunction(compose_kernel):
+            raise ValueError(f"{strategy}.compose_kernel must be numba compiled function (numba.njit)")
+        if isinstance(compose_kernel, numba.core.dispatcher.Dispatcher):
+            # The whole loop runs in compiled code
+            if vals is None:
+                raise ValueError("'compose_kernel' is not supported with 'metrics_typed' option")
+            if not (dt_idx.is_monotonic_increasing and dt_idx.is_unique):
+                raise ValueError("Inconsistent datetime index order, quotes must be sorted in ascending order")
+            metrics = np.ascontiguousarray(vals[i0:i1]).reshape(len(timeline), len(mframe.assets), len(mframe.columns))
+            if rebalance is None:
+                kernel_rebalance = np.ones(len(timeline), dtype=np.bool_)
+            else:
+                kernel_rebalance = np.array(rebalance[i0:i1], dtype=np.bool_)
+            # No positions are opened during warm-up
+            kernel_rebalance[:i_live - i0] = False
+            if force_rebalance >= 0 and force_rebalance < i1:
+                kernel_rebalance[force_rebalance - i0] = True
+            acc._process_kernel(timeline, ExecutionPanel(mframe.assets, timeline), compose_kernel, metrics,
+                                kernel_rebalance, stop=stop)
+            return acc
+
+        # Market data arrays for array positions (built at the first request)
+        exec_panel = None
+
+        # The engine works with bar indices, assets prices are looked up by precomputed quotes rows
+        acc._bind_timeline(timeline)
+        dt_ns = dt_idx.asi8
+
+        if i_live > i0:
+            if validate != 'off' and np.any(np.diff(dt_ns[i0:i_live + 1]) <= 0):
+                raise ValueError("Inconsistent datetime index order, quotes must be sorted in ascending order")
+            # Warm-up bars have no positions, fill account values in bulk
+            acc._skip_bars(i_live - i0)
+
+        if not resume:
+            acc._equity_peak = acc._equity_exec
+        for i in range(i_live, i1):
             # Perform some sanity checks
-            if last_dt is not None:
-                if dt <= last_dt:
+            if i0 < i < i0 + n_checked:
+                if dt_ns[i] <= dt_ns[i - 1]:
                     raise ValueError("Inconsistent datetime index order, quotes must be sorted in ascending order")
 
+            if rebalance is not None and not rebalance[i] and i != force_rebalance:
+                # Not a rebalancing bar, carry forward the position (the bar date is created by account on demand)
+                acc._hold_position()
+                if stop is not None and Backtester._is_stopped(acc, stop, dt_idx[i]):
+                    break
+                continue
+
+            # Bar datetime for the strategy and account transactions log
+            dt = dt_idx[i]
+
             # Get metrics for specific date and unstack them to the dataframe
             # Fast unstacking to dataframe of metrics
-            mframe._fill(row)
+            if vals is not None:
+                mframe._fill(vals[i])
+            else:
+                mframe._fill_store(mstore, i)
 
             # Call strategy.compose_portfolio()
             new_pos = strategy.compose_portfolio(dt, acc, mframe)
 
             # Process new position
-            acc._process_position(dt, new_pos)
+            if isinstance(new_pos, dict):
+                if i - i0 < n_checked:
+                    acc._process_position(dt, new_pos)
+                else:
+                    acc._process_position_trusted(dt, new_pos)
+            elif isinstance(new_pos, PositionDelta):
+                acc._process_delta(dt, new_pos)
+            elif isinstance(new_pos, np.ndarray) or (isinstance(new_pos, tuple) and len(new_pos) == 2
+                                                     and isinstance(new_pos[0], np.ndarray)):
+                if exec_panel is None:
+                    exec_panel = ExecutionPanel(mframe.assets, timeline)
+                if isinstance(new_pos, tuple):
+                    acc._process_array(dt, i - i0, new_pos[0], new_pos[1], exec_panel)
+                else:
+                    acc._process_array(dt, i - i0, new_pos, None, exec_panel)
+            else:
+                # Raises ValueError
+                acc._process_position(dt, new_pos)
 
-            last_dt = dt
+            if stop is not None and Backtester._is_stopped(acc, stop, dt):
+                break
 
         return acc
+
+    @staticmethod
+    def run_slices(strategy: Strategy, asset_universe: List[Asset], slices: list, n_jobs=1, **kwargs) -> List[Account]:
+        """
+        Runs the strategy on multiple dates ranges (i.e. in-sample, out-of-sample, crisis periods), metrics are
+        calculated only once for the whole history and shared by all ranges
+        :param strategy: Strategy class instance
+        :param asset_universe: list of assets
+        :param slices: list of tuples (start, end) of dates ranges (inclusive, None - the beginning / end of the history)
+        :param n_jobs: number of processes
+        :param kwargs: Backtester.run() kwargs ('start' / 'end' are not allowed), account names are
+                       '<acc_name> <first date>..<last date>'
+        :return: list of Account classes in order of slices
+        """
+        if 'start' in kwargs or 'end' in kwargs:
+            raise ValueError("'start' / 'end' kwargs are not allowed, use 'slices' argument")
+
+        ctx = Backtester._prepare_metrics(strategy, asset_universe, **kwargs)
+        dt_idx = ctx['dt_idx']
+        name = kwargs.get('acc_name', str(strategy))
+
+        tasks = []
+        for start, end in slices:
+            i0, i1 = Backtester._slice_bars(dt_idx, start, end)
+            run_kwargs = dict(kwargs, acc_name=f'{name} {dt_idx[i0].date()}..{dt_idx[i1 - 1].date()}')
+            tasks.append((strategy, None, i0, i1, run_kwargs))
+
+        if n_jobs <= 1 or len(tasks) <= 1:
+            # Every range starts with a clean strategy state, as in separate processes
+            return [Backtester._run_bars(copy.deepcopy(strategy), ctx, i0, i1, **run_kwargs)
+                    for strategy, _, i0, i1, run_kwargs in tasks]
+
+        assets_map = {a.ticker: a for a in ctx['assets']}
+        return [_loads_account(data, assets_map)
+                for data in pool_map(_slices_worker, tasks, n_jobs, initializer=_metrics_init, initargs=({None: ctx},))]
+
+    @staticmethod
+    def _params_groups(strategy, asset_universe, param_grid, metric_params=None, **kwargs):
+        """
+        Builds candidate strategies of the params grid and calculates metrics once per group of candidates with
+        the same metric params
+        :return: tuple (list of candidates [(params, group), ...], dict of {group: prepared metrics})
+        """
+        if len(param_grid) == 0:
+            raise ValueError("'param_grid' must contain at least one params dict")
+        if 'start' in kwargs or 'end' in kwargs:
+            raise ValueError("'start' / 'end' kwargs are not supported by optimization runners")
+
+        candidates = []
+        groups = OrderedDict()
+        for params in param_grid:
+            params = dict(strategy.params, **params)
+            keys = sorted(params) if metric_params is None else metric_params
+            group = repr([(k, params.get(k, None)) for k in keys])
+            if group not in groups:
+                groups[group] = Backtester._prepare_metrics(Backtester._make_candidate(strategy, params),
+                                                            asset_universe, **kwargs)
+            candidates.append((params, group))
+
+        dt_idx = next(iter(groups.values()))['dt_idx']
+        for ctx in groups.values():
+            if not ctx['dt_idx'].equals(dt_idx):
+                raise ValueError("Metrics of all params groups must have the same datetime index")
+        return candidates, groups
+
+    @staticmethod
+    def _make_candidate(strategy, params):
+        """
+        New instance of the strategy class with the params
+        """
+        return type(strategy)(**dict(strategy.kwargs, params=params))
+
+    @staticmethod
+    def run_walk_forward(strategy: Strategy, asset_universe: List[Asset], param_grid: list, train: int, test: int,
+                         anchored=False, objective=None, metric_params=None, n_jobs=1, **kwargs):
+        """
+        Walk-forward optimization: params are optimized on in-sample window k and the best params are applied on the
+        next out-of-sample window, out-of-sample segments are stitched into the single continuous account
+        :param strategy: Strategy class instance (the template, candidates are new instances of its class with
+                         params of the grid over the strategy params)
+        :param asset_universe: list of assets
+        :param param_grid: list of params dicts (candidates)
+        :param train: in-sample window length (bars)
+        :param test: out-of-sample window length (bars)
+        :param anchored: in-sample windows start at the beginning of the history (expanding windows)
+        :param objective: function (Account) -> float, higher is better (default: net profit), with n_jobs > 1 it must
+                          be picklable (module level function)
+        :param metric_params: list of params names used by strategy.calculate(), candidates with the same values
+                              share metrics (default: None - all params)
+        :param n_jobs: number of processes for in-sample evaluation of candidates
+        :param kwargs: Backtester.run() kwargs, stopping rules ('stop_*') prune in-sample runs only (stopped candidates
+                       get -inf score), out-of-sample segments always run till the end
+        :return: tuple (out-of-sample Account, pd.DataFrame of windows with the best params and its score)
+        """
+        if train <= 0 or test <= 0:
+            raise ValueError(f"'train' and 'test' must be positive number of bars, got {train} / {test}")
+        if objective is None:
+            objective = _objective_net_profit
+
+        candidates, groups = Backtester._params_groups(strategy, asset_universe, param_grid, metric_params, **kwargs)
+        dt_idx = next(iter(groups.values()))['dt_idx']
+        n_bars = len(dt_idx)
+
+        windows = []
+        for oos0 in range(train, n_bars, test):
+            windows.append((0 if anchored else oos0 - train, oos0, oos0, min(oos0 + test, n_bars)))
+        if len(windows) == 0:
+            raise ValueError(f"History is too short for walk-forward: {n_bars} bars, train window {train} bars")
+
+        run_kwargs = {k: v for k, v in kwargs.items() if k != 'acc_name'}
+        tasks = [(Backtester._make_candidate(strategy, params), group, is0, is1, objective, run_kwargs)
+                 for is0, is1, _, _ in windows for params, group in candidates]
+        scores = np.array(pool_map(_score_worker, tasks, n_jobs, initializer=_metrics_init, initargs=(groups,)),
+                          dtype=np.float64).reshape(len(windows), len(candidates))
+
+        oos_kwargs = {k: v for k, v in kwargs.items() if not k.startswith('stop_')}
+        acc = Backtester._new_account(strategy, sum(oos1 - oos0 for _, _, oos0, oos1 in windows), **kwargs)
+        result = []
+        for (is0, is1, oos0, oos1), window_scores in zip(windows, scores):
+            # NaN scores are the worst
+            best = int(np.argmax(np.where(np.isnan(window_scores), -np.inf, window_scores)))
+            params, group = candidates[best]
+            best_strategy = Backtester._make_candidate(strategy, params)
+            best_strategy.initialize()
+            Backtester._run_bars(best_strategy, groups[group], oos0, oos1, acc=acc, **oos_kwargs)
+            result.append({
+                'is_start': dt_idx[is0],
+                'is_end': dt_idx[is1 - 1],
+                'oos_start': dt_idx[oos0],
+                'oos_end': dt_idx[oos1 - 1],
+                'params': params,
+                'score': window_scores[best],
+            })
+
+        return acc, pd.DataFrame(result)
+
+    @staticmethod
+    def run_sweep(strategy: Strategy, asset_universe: List[Asset], param_grid: list, mode='full', eta=2,
+                  min_bars=None, objective=None, metric_params=None, n_jobs=1, **kwargs) -> pd.DataFrame:
+        """
+        Parameters sweep of the strategy over the whole history
+        :param strategy: Strategy class instance (the template, see. Backtester.run_walk_forward())
+        :param asset_universe: list of assets
+        :param param_grid: list of params dicts (candidates)
+        :param mode: 'full' - every candidate runs on the whole history
+                     'halving' - successive halving: all candidates run on the short prefix of the history, only
+                     the best 1/eta of them are promoted to eta times longer prefix (their runs continue from the
+                     end of the previous prefix), and so on, the last survivors run on the whole history
+        :param eta: reduction factor of 'halving' mode (integer >= 2)
+        :param min_bars: prefix length (bars) of the first 'halving' round (default: the whole history / eta^k, where
+                         k is number of rounds to get a single survivor)
+        :param objective: function (Account) -> float, higher is better (default: net profit), with n_jobs > 1 it must
+                          be picklable (module level function)
+        :param metric_params: list of params names used by strategy.calculate() (see. Backtester.run_walk_forward())
+        :param n_jobs: number of processes
+        :param kwargs: Backtester.run() kwargs, stopping rules ('stop_*') prune losing runs early (stopped candidates
+                       get -inf score)
+        :return: pd.DataFrame of candidates (index - position in param_grid) with params, the last round, its number
+                 of bars and score, sorted from the best (candidates promoted further go first)
+        """
+        if mode not in ('full', 'halving'):
+            raise ValueError(f"'mode' must be 'full' or 'halving', got '{mode}'")
+        if int(eta) != eta or eta < 2:
+            raise ValueError(f"'eta' must be integer >= 2, got {eta}")
+        eta = int(eta)
+        if objective is None:
+            objective = _objective_net_profit
+
+        candidates, groups = Backtester._params_groups(strategy, asset_universe, param_grid, metric_params, **kwargs)
+        n_bars = len(next(iter(groups.values()))['dt_idx'])
+
+        if mode == 'full':
+            n_prefix = n_bars
+        elif min_bars is None:
+            n_rounds = int(np.ceil(np.log(len(candidates)) / np.log(eta) - 1e-9))
+            n_prefix = max(n_bars // eta ** n_rounds, 1)
+        elif min_bars <= 0:
+            raise ValueError(f"'min_bars' must be positive number of bars, got {min_bars}")
+        else:
+            n_prefix = min(int(min_bars), n_bars)
+
+        run_kwargs = {k: v for k, v in kwargs.items() if k != 'acc_name'}
+        result = [None] * len(candidates)
+        # Pickled (strategy, account) of the candidates to continue in the next round
+        states = [None] * len(candidates)
+        alive = list(range(len(candidates)))
+        rnd = 0
+        i_done = 0
+        while True:
+            tasks = [(Backtester._make_candidate(strategy, candidates[k][0]) if states[k] is None else None,
+                      candidates[k][1], states[k], i_done, n_prefix, n_bars, objective, run_kwargs) for k in alive]
+            runs = pool_map(_sweep_worker, tasks, n_jobs, initializer=_metrics_init, initargs=(groups,))
+            scores = np.array([score for score, _ in runs], dtype=np.float64)
+            for k, (score, state) in zip(alive, runs):
+                result[k] = {'params': candidates[k][0], 'round': rnd, 'bars': n_prefix, 'score': score}
+                states[k] = state
+
+            if n_prefix >= n_bars:
+                break
+            # Promote the best candidates (NaN scores are the worst), the last survivor runs on the whole history
+            order = np.argsort(-np.where(np.isnan(scores), -np.inf, scores), kind='mergesort')
+            promoted = [alive[j] for j in order[:max(len(alive) // eta, 1)].tolist()]
+            for k in set(alive) - set(promoted):
+                states[k] = None
+            alive = promoted
+            # Survivors continue their runs from the end of the prefix
+            i_done = n_prefix
+            n_prefix = n_bars if len(alive) == 1 else min(n_prefix * eta, n_bars)
+            rnd += 1
+
+        df = pd.DataFrame(result)
+        df['_score'] = df['score'].fillna(-np.inf)
+        return df.sort_values(['round', '_score'], ascending=False, kind='mergesort').drop(columns='_score')
+
+    @staticmethod
+    def purged_folds(dt_idx, n_folds=5, purge=0, embargo=0) -> list:
+        """
+        Splits the datetime index into k contiguous test blocks, training bars of the fold are all bars except
+        the test block, 'purge' bars before it (their labels overlap the test block) and 'embargo' bars after it
+        (serial correlation leakage)
+        :param dt_idx: datetime index (i.e. Account.as_dataframe().index or metrics index)
+        :param n_folds: number of folds
+        :param purge: number of training bars removed before the test block
+        :param embargo: number of training bars removed after the test block
+        :return: list of tuples (train bars indices np.ndarray, (test block first bar, test block last bar + 1))
+        """
+        n_bars = len(dt_idx)
+        if n_folds < 2 or n_folds > n_bars:
+            raise ValueError(f"'n_folds' must be in range [2, {n_bars}], got {n_folds}")
+        if purge < 0 or embargo < 0:
+            raise ValueError(f"'purge' and 'embargo' must be non-negative number of bars, got {purge} / {embargo}")
+
+        bounds = np.linspace(0, n_bars, n_folds + 1).astype(np.int64)
+        bars = np.arange(n_bars)
+        folds = []
+        for i0, i1 in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            is_train = (bars < i0 - purge) | (bars >= i1 + embargo)
+            folds.append((bars[is_train], (i0, i1)))
+        return folds
+
+    @staticmethod
+    def run_cv(strategy: Strategy, asset_universe: List[Asset], n_folds=5, purge=0, embargo=0, fit=None, n_jobs=1,
+               **kwargs) -> pd.DataFrame:
+        """
+        Purged k-fold cross-validation over time: the portfolio composition loop runs on every test block of
+        Backtester.purged_folds() (metrics are calculated only once and shared by all folds)
+        :param strategy: Strategy class instance
+        :param asset_universe: list of assets
+        :param n_folds: number of folds
+        :param purge: number of training bars removed before the test block
+        :param embargo: number of training bars removed after the test block
+        :param fit: (optional) function (strategy, train_dates: pd.DatetimeIndex) -> Strategy, returns the strategy
+                    fitted on training bars of the fold (i.e. ML model used by compose_portfolio()), the fitted
+                    strategy must use the same metrics as 'strategy'. Folds are fitted in the worker processes,
+                    so 'fit' must be picklable (module level function) if n_jobs > 1
+        :param n_jobs: number of processes
+        :param kwargs: Backtester.run() kwargs
+        :return: pd.DataFrame of folds (rows) with test range, number of training bars and Report.stats() columns
+        """
+        if 'start' in kwargs or 'end' in kwargs:
+            raise ValueError("'start' / 'end' kwargs are not supported by optimization runners")
+
+        ctx = Backtester._prepare_metrics(strategy, asset_universe, **kwargs)
+        dt_idx = ctx['dt_idx']
+        if not (dt_idx.is_monotonic_increasing and dt_idx.is_unique):
+            raise ValueError("Inconsistent datetime index order, quotes must be sorted in ascending order")
+        name = kwargs.get('acc_name', str(strategy))
+
+        folds = Backtester.purged_folds(dt_idx, n_folds, purge, embargo)
+        tasks = [(strategy, fit, dt_idx[train], i0, i1, dict(kwargs, acc_name=f'{name} fold {k}'))
+                 for k, (train, (i0, i1)) in enumerate(folds)]
+
+        if n_jobs <= 1:
+            accounts = [Backtester._run_fold(strategy, fit, train_dates, ctx, i0, i1, **run_kwargs)
+                        for strategy, fit, train_dates, i0, i1, run_kwargs in tasks]
+        else:
+            assets_map = {a.ticker: a for a in ctx['assets']}
+            accounts = [_loads_account(data, assets_map)
+                        for data in pool_map(_cv_worker, tasks, n_jobs, initializer=_metrics_init,
+                                             initargs=({None: ctx},))]
+
+        stats = Report(accounts, n_jobs=n_jobs, lazy=True).stats().T
+        df_folds = pd.DataFrame({
+            'fold': np.arange(len(folds)),
+            'test_start': [dt_idx[i0] for _, (i0, _) in folds],
+            'test_end': [dt_idx[i1 - 1] for _, (_, i1) in folds],
+            'train_bars': [len(train) for train, _ in folds],
+        }, index=stats.index)
+        return pd.concat([df_folds, stats], axis=1).set_index('fold')
+
+    @staticmethod
+    def _run_fold(strategy, fit, train_dates, ctx, i0, i1, **kwargs) -> Account:
+        """
+        Fits the strategy on training dates of the fold (see. Backtester.run_cv()) and runs it on the test bars [i0, i1)
+        """
+        fold_strategy = copy.deepcopy(strategy) if fit is None else fit(strategy, train_dates)
+        return Backtester._run_bars(fold_strategy, ctx, i0, i1, **kwargs)
+
+    @staticmethod
+    def run_composite(parent: Strategy, children: list, asset_universe: List[Asset], n_jobs=1, **kwargs) -> Account:
+        """
+        Runs children strategies (in parallel if n_jobs > 1) and then runs parent strategy on the universe of
+        synthetic assets built from the children accounts
+        :param parent: meta-strategy class instance
+        :param children: list of children strategies, or tuples (strategy, dict of Backtester.run() kwargs),
+                         synthetic asset ticker is the child account name (must be unique)
+        :param asset_universe: list of assets of the children strategies
+        :param n_jobs: number of processes
+        :param kwargs: Backtester.run() kwargs of the parent strategy
+        :return: Account class of the parent strategy
+        """
+        tasks = []
+        for child in children:
+            if isinstance(child, tuple):
+                strategy, run_kwargs = child
+            else:
+                strategy, run_kwargs = child, {}
+            if not isinstance(strategy, Strategy):
+                raise ValueError(f"'children' items must be Strategy or tuple (Strategy, dict), got {type(strategy)}")
+            tasks.append((strategy, dict(run_kwargs)))
+
+        names = [run_kwargs.get('acc_name', str(strategy)) for strategy, run_kwargs in tasks]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Children account names must be unique (use 'acc_name' run kwarg), got {names}")
+
+        if n_jobs <= 1 or len(tasks) <= 1:
+            accounts = [Backtester.run(strategy, asset_universe, **run_kwargs) for strategy, run_kwargs in tasks]
+        else:
+            assets_map = {a.ticker: a for a in asset_universe}
+            accounts = [_loads_account(data, assets_map)
+                        for data in pool_map(_composite_worker, tasks, n_jobs,
+                                             initializer=_composite_init, initargs=(asset_universe,))]
+
+        return Backtester.run(parent, [acc.as_asset() for acc in accounts], **kwargs)
@@ -0,0 +1,204 @@
+from collections import OrderedDict
+from threading import RLock
+import functools
+import hashlib
+import sys
+import weakref
+import numpy as np
+import pandas as pd
+
+
+_SCALAR_TYPES = (int, float, str, bool, bytes, type(None), np.number, np.bool_)
+
+
+def _value_fingerprint(value, objects):
+    """
+    Hashable fingerprint of the function argument, scalars are compared by value, everything else by identity
+    :param objects: list of objects compared by identity (appended), id() might be reused by new object after garbage
+                    collection, the cache checks these instances are alive and the same (see. IndicatorCache)
+    """
+    if isinstance(value, _SCALAR_TYPES):
+        return value
+    if isinstance(value, (tuple, list)):
+        return type(value).__name__, tuple(_value_fingerprint(v, objects) for v in value)
+    if isinstance(value, dict):
+        return 'dict', tuple((k, _value_fingerprint(v, objects))
+                             for k, v in sorted(value.items(), key=lambda kv: str(kv[0])))
+    objects.append(value)
+    return type(value).__name__, id(value)
+
+
+def _code_hash(code) -> str:
+    """
+    Hash of the function code: bytecode, names and constants (nested code objects of lambdas and comprehensions are
+    hashed recursively, their repr() contains memory addresses)
+    """
+    h = hashlib.sha1(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for c in code.co_consts:
+        h.update(_code_hash(c).encode() if hasattr(c, 'co_code') else repr(c).encode())
+    return h.hexdigest()
+
+
+def _fn_fingerprint(fn, objects):
+    """
+    Hashable fingerprint of the function: qualified name, code hash and values of the closure variables
+    :param objects: list of objects compared by identity (appended), see. _value_fingerprint()
+    """
+    if isinstance(fn, functools.partial):
+        return ('partial', _fn_fingerprint(fn.func, objects), _value_fingerprint(fn.args, objects),
+                _value_fingerprint(fn.keywords, objects))
+
+    bound_self = getattr(fn, '__self__', None)
+    func = getattr(fn, '__func__', fn)
+    code = getattr(func, '__code__', None)
+    if code is None:
+        # Builtins and callable objects
+        return 'callable', _value_fingerprint(fn, objects)
+
+    closure = tuple(_value_fingerprint(c.cell_contents, objects) for c in (func.__closure__ or ()))
+    return (func.__module__, func.__qualname__, _code_hash(code), closure,
+            _value_fingerprint(func.__defaults__, objects),
+            None if bound_self is None else _value_fingerprint(bound_self, objects))
+
+
+def _ref(obj):
+    """
+    Weak reference to the object, or strong reference if the object doesn't support weak references
+    """
+    try:
+        return weakref.ref(obj)
+    except TypeError:
+        return lambda: obj
+
+
+def _nbytes(value) -> int:
+    """
+    Approximate memory size of the cached value
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(index=True))
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class IndicatorCache:
+    """
+    Memoization of the indicators calculated by Strategy.calculate(), shared across strategies and runs in the process
+
+    Cached values are keyed by asset data identity (ticker and quotes dataframe instance) and fingerprint of the
+    function and its arguments. The cache is bounded by memory, least recently used values are evicted first.
+    Non-scalar arguments and closure variables (i.e. strategy instance 'self') are compared by identity.
+
+    IMPORTANT: cached values are shared between callers, never modify them inplace!
+    """
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        """
+        :param max_bytes: memory limit of the cached values (default: 512Mb)
+        """
+        if max_bytes <= 0:
+            raise ValueError(f"'max_bytes' must be positive, got {max_bytes}")
+
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._nbytes = 0
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'IndicatorCache<{len(self)} items, {self._nbytes} of {self.max_bytes} bytes>'
+
+    def __reduce__(self):
+        # Cached values are not transferred to worker processes, the default cache maps to the worker's default cache
+        if self is _default_cache:
+            return default_cache, ()
+        return IndicatorCache, (self.max_bytes,)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Total memory size of the cached values
+        """
+        return self._nbytes
+
+    @staticmethod
+    def _asset_key(asset):
+        quotes = asset.quotes()
+        if len(quotes) == 0:
+            return (str(asset), id(quotes), 0, None, None), quotes
+        return (str(asset), id(quotes), len(quotes), quotes.index[0], quotes.index[-1]), quotes
+
+    def get_or_compute(self, asset, name, fn, *args, **kwargs):
+        """
+        Returns cached value or calculates fn(asset, *args, **kwargs) and caches the result
+        :param asset: Asset class instance
+        :param name: indicator name (i.e. 'ma200')
+        :param fn: function (asset, *args, **kwargs) -> value
+        :return: fn() result
+        """
+        asset_key, quotes = self._asset_key(asset)
+        objects = [quotes]
+        key = (asset_key, name, _fn_fingerprint(fn, objects), _value_fingerprint(args, objects),
+               _value_fingerprint(kwargs, objects))
+
+        with self._lock:
+            entry = self._data.get(key, None)
+            # Quotes and other identity-keyed objects id() might be reused by new objects after garbage collection,
+            # check the instances are the same
+            if entry is not None and all(r() is obj for r, obj in zip(entry[0], objects)):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = fn(asset, *args, **kwargs)
+        self._put(key, objects, value)
+        return value
+
+    def _put(self, key, objects, value):
+        size = _nbytes(value)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._nbytes -= old[2]
+
+            if size > self.max_bytes:
+                return
+
+            self._data[key] = (tuple(_ref(obj) for obj in objects), value, size)
+            self._nbytes += size
+
+            while self._nbytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._nbytes -= evicted_size
+
+    def clear(self):
+        """
+        Removes all cached values
+        :return:
+        """
+        with self._lock:
+            self._data.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+_default_cache = IndicatorCache()
+
+
+def default_cache() -> IndicatorCache:
+    """
+    Process-wide indicator cache used by strategies by default
+    """
+    return _default_cache
@@ -11,7 +11,7 @@ from math import nan
 
 @numba.jit(nopython=True)
 def _unstack(values, n_assets, n_fields):  # pragma: no cover
-    result = np.full((n_assets, n_fields), nan)
+    result = np.empty((n_assets, n_fields), dtype=values.dtype)
 
     for i in range(n_assets):
         for j in range(n_fields):
@@ -45,6 +45,42 @@ class PositionInfo:
         return self.__str__()
 
 
+class PositionDelta:
+    """
+    Portfolio changes, alternative return type of Strategy.compose_portfolio(), assets which are not mentioned keep
+    their current position
+
+    delta = PositionDelta()
+    delta[asset] = 2.0  # set new qty
+    delta[asset] = (2.0, {'tag': 'ctx'})  # set new qty with context
+    delta.close(asset)  # close position
+    """
+    __slots__ = ['changes']
+
+    def __init__(self, changes=None):
+        self.changes = {} if changes is None else dict(changes)
+        """dict of {asset: qty or tuple (qty, context) or None (close position)}"""
+
+    def __setitem__(self, asset, qty):
+        self.changes[asset] = qty
+
+    def close(self, asset):
+        """
+        Closes the position of the asset
+        """
+        self.changes[asset] = None
+        return self
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __str__(self):
+        return f"PositionDelta<{self.changes}>"
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class RowTuple:
     """
     Fast named key-value row wrapper around np.ndarray
@@ -62,13 +98,229 @@ class RowTuple:
         return self.values[self.names[key]]
 
 
+class UniversePanel:
+    """
+    Quotes of all assets in the universe aligned by the common datetime index, every field is (time x assets) array
+    """
+    def __init__(self, asset_universe):
+        self.assets = list(asset_universe)
+        """List of assets (columns order of the arrays)"""
+
+        index = self.assets[0].quotes().index
+        for a in self.assets[1:]:
+            if not index.equals(a.quotes().index):
+                index = index.union(a.quotes().index)
+        self.index = index
+        """Common datetime index of all assets"""
+
+        self._fields = {}
+
+    @property
+    def shape(self):
+        return len(self.index), len(self.assets)
+
+    def __getitem__(self, field) -> np.ndarray:
+        """
+        Get aligned quotes field of all assets, values are built at the first request
+        :param field: quotes column name ('o', 'h', 'l', 'c', 'exec', etc.), missing columns are filled by NaN
+        :return: np.ndarray (time x assets)
+        """
+        result = self._fields.get(field, None)
+        if result is None:
+            result = np.full(self.shape, nan)
+            for i, a in enumerate(self.assets):
+                q = a.quotes()
+                if field in q:
+                    ser = q[field]
+                    result[:, i] = ser.values if ser.index.equals(self.index) else ser.reindex(self.index).values
+            self._fields[field] = result
+        return result
+
+    @property
+    def open(self) -> np.ndarray:
+        return self['o']
+
+    @property
+    def high(self) -> np.ndarray:
+        return self['h']
+
+    @property
+    def low(self) -> np.ndarray:
+        return self['l']
+
+    @property
+    def close(self) -> np.ndarray:
+        return self['c']
+
+    @property
+    def exec(self) -> np.ndarray:
+        return self['exec']
+
+
+class ExecutionPanel:
+    """
+    Market data of assets aligned by the backtest index (time x assets arrays), used by vectorized account engine
+    (see. Asset._aligned_arrays())
+    """
+    FIELDS = ('c', 'exec', 'point_value', 'costs_c', 'costs_exec', 'margin')
+
+    def __init__(self, assets, index):
+        self.assets = np.array(list(assets), dtype=object)
+        """Assets array (the same order as MFrame.assets)"""
+
+        self.index = index
+        self.asset_index = {a: k for k, a in enumerate(self.assets)}
+        self.is_synthetic = np.array([a.is_synthetic for a in self.assets], dtype=bool)
+
+        self.first_bar = np.array([index.searchsorted(a._data_start()) for a in self.assets], dtype=np.int64)
+        """Index of the first bar with market data of the asset (late starting assets have NaN values before it)"""
+
+        arrays = {f: np.full((len(index), len(self.assets)), np.nan) for f in self.FIELDS}
+        for k, asset in enumerate(self.assets):
+            for f, arr in asset._aligned_arrays(index[self.first_bar[k]:]).items():
+                arrays[f][self.first_bar[k]:, k] = arr
+
+        self.close = arrays['c']
+        self.exec = arrays['exec']
+        self.point_value = arrays['point_value']
+        self.costs_close = arrays['costs_c']
+        """Transaction costs per 1 unit of qty (at close)"""
+        self.costs_exec = arrays['costs_exec']
+        """Transaction costs per 1 unit of qty (at execution)"""
+        self.margin = arrays['margin']
+        """Margin requirements per 1 unit of qty"""
+
+
+class MetricStore:
+    """
+    Column-oriented metrics storage which keeps every metric in its native dtype (bool, int8, float32, etc),
+    boolean metrics are optionally bit-packed along the assets axis (1 bit per cell)
+    """
+    def __init__(self, index, assets, columns, arrays, packed=()):
+        """
+        :param index: datetime index of metrics
+        :param assets: list of assets
+        :param columns: list of metric names
+        :param arrays: list of np.ndarray (one per column) of shape (len(index), len(assets)),
+                       or (len(index), ceil(len(assets) / 8)) for bit-packed columns
+        :param packed: indexes of bit-packed columns
+        """
+        self.index = index
+        self.assets = assets
+        self.columns = tuple(columns)
+        self._arrays = arrays
+        self._packed = frozenset(packed)
+        self._n_assets = len(assets)
+
+    @classmethod
+    def from_frames(cls, asset_metrics, columns, bitpack=True, float_dtype=None):
+        """
+        Build metric store from per-asset metrics
+        :param asset_metrics: OrderedDict of {asset: pd.DataFrame}, all dataframes must have the same columns
+        :param columns: list of metric names
+        :param bitpack: pack boolean columns into bits
+        :param float_dtype: (optional) cast float columns to this dtype (for example np.float32)
+        :return: MetricStore
+        """
+        frames = list(asset_metrics.values())
+        index = frames[0].index
+        is_aligned = True
+        for df in frames[1:]:
+            if not index.equals(df.index):
+                index = index.union(df.index)
+                is_aligned = False
+        if not is_aligned:
+            is_aligned = all(index.equals(df.index) for df in frames)
+
+        arrays = OrderedDict()
+        for c in columns:
+            dtype = np.result_type(*[df[c].dtype for df in frames])
+            if not is_aligned and dtype.kind in 'biu':
+                # Missing values introduced by the alignment, only floats can keep NaNs
+                dtype = np.dtype(np.float32) if dtype.itemsize <= 2 else np.dtype(np.float64)
+
+            arr = np.empty((len(index), len(frames)), dtype=dtype)
+            for i, df in enumerate(frames):
+                ser = df[c] if is_aligned else df[c].reindex(index)
+                arr[:, i] = ser.values
+            arrays[c] = arr
+
+        return cls.from_arrays(index, list(asset_metrics.keys()), arrays, bitpack=bitpack, float_dtype=float_dtype)
+
+    @classmethod
+    def from_arrays(cls, index, assets, arrays, bitpack=True, float_dtype=None):
+        """
+        Build metric store from the metric cube
+        :param index: datetime index
+        :param assets: list of assets
+        :param arrays: OrderedDict of {column: np.ndarray (time x assets)}
+        :param bitpack: pack boolean columns into bits
+        :param float_dtype: (optional) cast float columns to this dtype (for example np.float32)
+        :return: MetricStore
+        """
+        result = []
+        packed = []
+        for j, arr in enumerate(arrays.values()):
+            if float_dtype is not None and arr.dtype.kind == 'f':
+                arr = arr.astype(float_dtype, copy=False)
+            if bitpack and arr.dtype.kind == 'b':
+                arr = np.packbits(arr, axis=1)
+                packed.append(j)
+            result.append(arr)
+        return cls(index, list(assets), list(arrays.keys()), result, packed)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def dtypes(self):
+        """
+        Native dtypes of metrics
+        :return: dict of {column: np.dtype}
+        """
+        return {c: np.dtype(np.bool_) if j in self._packed else self._arrays[j].dtype
+                for j, c in enumerate(self.columns)}
+
+    @property
+    def nbytes(self):
+        """
+        Total memory consumed by metric arrays
+        :return:
+        """
+        return sum(a.nbytes for a in self._arrays)
+
+    def get(self, col_idx, i) -> np.ndarray:
+        """
+        Get metric values across all assets at row 'i'
+        :param col_idx: column index
+        :param i: row index
+        :return: np.ndarray of native dtype
+        """
+        if col_idx in self._packed:
+            return np.unpackbits(self._arrays[col_idx][i], count=self._n_assets).view(np.bool_)
+        return self._arrays[col_idx][i]
+
+    def row_matrix(self, i) -> np.ndarray:
+        """
+        Get float64 matrix (assets x columns) of all metrics at row 'i'
+        :param i: row index
+        :return:
+        """
+        result = np.empty((self._n_assets, len(self.columns)))
+        for j in range(len(self.columns)):
+            result[:, j] = self.get(j, i)
+        return result
+
+
 class MFrame:
     """
     Strategy metric frame
     """
     def __init__(self, assets, columns):
         self.shape = (len(assets), len(columns))
-        self._data = np.full(self.shape, nan)
+        self._matrix = np.full(self.shape, nan)
+        self._store = None
+        self._store_i = -1
         self._columns = OrderedDict([(c, i) for i, c in enumerate(columns)])
         self._columns_list = tuple(columns)
         self._assets = OrderedDict([(a, i) for i, a in enumerate(assets)])
@@ -81,7 +333,22 @@ class MFrame:
         _shape = self.shape
         _unst = _unstack(metric_matrix, _shape[0], _shape[1])
         assert _shape == _unst.shape
-        self._data = _unst
+        self._matrix = _unst
+
+    def _fill_store(self, store: MetricStore, i):
+        """
+        Point MFrame to the row 'i' of typed metrics storage
+        """
+        self._store = store
+        self._store_i = i
+        self._matrix = None
+
+    @property
+    def _data(self):
+        if self._matrix is None:
+            # Typed storage: the float matrix is materialized only if row-wise access is requested
+            self._matrix = self._store.row_matrix(self._store_i)
+        return self._matrix
 
     def items(self) -> Tuple[Asset, RowTuple]:
         """
@@ -123,6 +390,8 @@ class MFrame:
         :param key: column name
         :return: np.ndarray length of assets
         """
+        if self._store is not None:
+            return self._store.get(self._columns[key], self._store_i)
         return self._data[:, self._columns[key]]
 
     def get_at(self, asset, metric) -> float:
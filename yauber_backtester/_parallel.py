@@ -0,0 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor
+import io
+import pickle
+from ._asset import Asset
+
+
+def pool_map(func, items, n_jobs, initializer=None, initargs=()):
+    """
+    Maps func over items in the process pool (or serially if n_jobs <= 1), results are in the order of items
+    :param func: picklable module level function
+    :param items: list of arguments
+    :param n_jobs: number of processes
+    :return: list
+    """
+    if n_jobs <= 1 or len(items) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [func(it) for it in items]
+
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(items)), initializer=initializer, initargs=initargs) as pool:
+        return list(pool.map(func, items, chunksize=max(1, len(items) // (n_jobs * 4))))
+
+
+class _AssetPickler(pickle.Pickler):
+    """
+    Pickles assets by ticker, so objects returned from worker processes refer to the parent's asset instances
+    """
+    def persistent_id(self, obj):
+        if isinstance(obj, Asset):
+            return 'asset', obj.ticker
+        return None
+
+
+class _AssetUnpickler(pickle.Unpickler):
+    def __init__(self, file, assets_map=None):
+        super().__init__(file)
+        self._assets_map = assets_map
+
+    def persistent_load(self, pid):
+        # Without assets map the tickers are loaded instead of assets
+        return pid[1] if self._assets_map is None else self._assets_map[pid[1]]
+
+
+def dumps_by_ticker(obj) -> bytes:
+    """
+    Pickles the object, assets are pickled by ticker (without quotes)
+    """
+    buf = io.BytesIO()
+    _AssetPickler(buf, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return buf.getvalue()
+
+
+def loads_by_ticker(data: bytes, assets_map: dict = None):
+    """
+    Loads the object pickled by dumps_by_ticker()
+    :param assets_map: dict of {ticker: asset}, if None assets are replaced by tickers
+    """
+    return _AssetUnpickler(io.BytesIO(data), assets_map).load()
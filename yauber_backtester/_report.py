@@ -1,15 +1,154 @@
 from typing import Iterable, Tuple
 from ._account import Account
+from ._asset import Asset
 import pandas as pd
 import numpy as np
-from math import isfinite
+import numba
+from math import isfinite, nan, inf
+import warnings
 from collections import OrderedDict
+from ._parallel import pool_map, dumps_by_ticker, loads_by_ticker
 
 
 TRADE_KEYS = ('asset', 'date_entry', 'date_exit', 'side', 'n_transactions', 'wavg_price_entered', 'wavg_price_exited',
               'qty_entered', 'qty_exited', 'pnl', 'pnl_perc', 'costs', 'context')
 """Trade records static keys for export"""
 
+TRADE_ERR_NOT_OPENING = 1
+TRADE_ERR_REVERSAL = 2
+
+
+@numba.jit(nopython=True, cache=True)
+def _trades_kernel(asset_ids, n_assets, position_action, qty, price_close, price_exec,
+                   costs_close, costs_exec, pnl_close, pnl_execution):  # pragma: no cover
+    """
+    Pairs transactions into trades (open / add / reduce / close per asset), the same logic as Trade class
+    :return: tuple of trade arrays (indexed by trade id in order of opening) and error info
+    """
+    n = len(asset_ids)
+    open_trade = np.full(n_assets, -1)
+
+    entry_idx = np.zeros(n, dtype=np.int64)
+    exit_idx = np.zeros(n, dtype=np.int64)
+    close_seq = np.full(n, -1)
+    side = np.zeros(n, dtype=np.int64)
+    n_trans = np.zeros(n, dtype=np.int64)
+    entry_qty = np.zeros(n)
+    entry_value = np.zeros(n)
+    exit_qty = np.zeros(n)
+    exit_value = np.zeros(n)
+    pnl = np.zeros(n)
+    costs = np.zeros(n)
+    t_qty = np.zeros(n)
+
+    n_trades = 0
+    n_closed = 0
+
+    for i in range(n):
+        a = asset_ids[i]
+        t = open_trade[a]
+        q = qty[i]
+
+        if t < 0:
+            # New trade
+            if position_action[i] != 1:
+                return n_trades, entry_idx, exit_idx, close_seq, side, n_trans, entry_qty, entry_value, exit_qty, \
+                       exit_value, pnl, costs, i, TRADE_ERR_NOT_OPENING
+            t = n_trades
+            n_trades += 1
+            open_trade[a] = t
+
+            pnl[t] = pnl_execution[i]
+            n_trans[t] = 1
+            entry_qty[t] = abs(q)
+            entry_value[t] = price_exec[i] * abs(q)
+            costs[t] = costs_exec[i]
+            entry_idx[t] = i
+            exit_idx[t] = i
+            side[t] = 1 if q > 0 else -1
+            t_qty[t] = q
+            continue
+
+        prev_q = t_qty[t]
+        if (prev_q > 0 and prev_q + q < 0) or (prev_q < 0 and prev_q + q > 0):
+            return n_trades, entry_idx, exit_idx, close_seq, side, n_trans, entry_qty, entry_value, exit_qty, \
+                   exit_value, pnl, costs, i, TRADE_ERR_REVERSAL
+
+        exec_px = price_exec[i]
+        if np.isfinite(pnl_execution[i]):
+            pnl[t] += pnl_execution[i]
+        elif np.isfinite(pnl_close[i]):
+            pnl[t] += pnl_close[i]
+            exec_px = price_close[i]
+
+        if np.isfinite(costs_exec[i]):
+            costs[t] += costs_exec[i]
+        elif np.isfinite(costs_close[i]):
+            costs[t] += costs_close[i]
+
+        t_qty[t] = prev_q + q
+        exit_idx[t] = i
+
+        if position_action[i] == 1:
+            entry_qty[t] += abs(q)
+            entry_value[t] += exec_px * abs(q)
+            n_trans[t] += 1
+        elif position_action[i] == -1:
+            exit_qty[t] += abs(q)
+            exit_value[t] += exec_px * abs(q)
+            n_trans[t] += 1
+
+            if t_qty[t] == 0:
+                close_seq[t] = n_closed
+                n_closed += 1
+                open_trade[a] = -1
+
+    return n_trades, entry_idx, exit_idx, close_seq, side, n_trans, entry_qty, entry_value, exit_qty, \
+           exit_value, pnl, costs, -1, 0
+
+
+def _calc_trades(asset_ids, n_assets, position_action, qty, price_close, price_exec,
+                 costs_close, costs_exec, pnl_close, pnl_execution):
+    """
+    Calculates trades arrays from columnar transactions arrays
+    :return: dict of numeric trade arrays, trades are ordered as closed trades (by closing time) and then open trades
+    (by opening time), 'entry_idx' / 'exit_idx' are transaction indexes
+    """
+    (
+        n_trades, entry_idx, exit_idx, close_seq, side, n_trans, entry_qty, entry_value, exit_qty, exit_value,
+        pnl, costs, err_idx, err_code
+    ) = _trades_kernel(asset_ids, n_assets, position_action, qty, price_close, price_exec,
+                       costs_close, costs_exec, pnl_close, pnl_execution)
+
+    assert err_code != TRADE_ERR_NOT_OPENING, f'Must be opening transaction (transaction #{err_idx})'
+    assert err_code != TRADE_ERR_REVERSAL, f'Reversal transaction detected! (transaction #{err_idx})'
+
+    close_seq = close_seq[:n_trades]
+    is_closed = close_seq >= 0
+    order = np.concatenate([np.flatnonzero(is_closed)[np.argsort(close_seq[is_closed])], np.flatnonzero(~is_closed)])
+
+    entry_qty = entry_qty[order]
+    exit_qty = exit_qty[order]
+    side = side[order]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entry_avg_px = np.where(entry_qty > 0, entry_value[order] / entry_qty, nan)
+        exit_avg_px = np.where(exit_qty > 0, exit_value[order] / exit_qty, nan)
+        pnl_perc = (exit_avg_px / entry_avg_px - 1) * side
+
+    return {
+        'entry_idx': entry_idx[order],
+        'exit_idx': exit_idx[order],
+        'side': side,
+        'n_transactions': n_trans[order],
+        'wavg_price_entered': entry_avg_px,
+        'wavg_price_exited': exit_avg_px,
+        'qty_entered': entry_qty,
+        'qty_exited': exit_qty,
+        'pnl': pnl[order],
+        'pnl_perc': pnl_perc,
+        'costs': costs[order],
+    }
+
 
 class Trade:
     def __init__(self, dt, transaction):
@@ -105,6 +244,704 @@ class Trade:
                 self._exit_date = dt
 
 
+STATS_KEYS = ('CAGR %', 'NetProfit $', 'NetProfit %', 'MaxDD $', 'MaxDD %', 'NumberOfTrades', 'WinRate',
+              'Trade % Mean', 'Trade % StDev')
+"""Report stats keys"""
+
+NS_PER_DAY = 86400 * 10**9
+
+
+@numba.jit(nopython=True, error_model='numpy', cache=True)
+def _stats_kernel(dates, n_bars, equity, capital_invested, trade_pnl, trade_pnl_perc, trade_offsets):  # pragma: no cover
+    """
+    Calculates stats of multiple accounts in a single pass over equity and trades arrays
+    :param dates: (n_accounts, time) int64 timestamps in nanoseconds
+    :param n_bars: (n_accounts, ) number of valid bars of each account
+    :param equity: (n_accounts, time) equity arrays
+    :param capital_invested: (n_accounts, time) capital invested arrays
+    :param trade_pnl: flat array of trades $ PnL of all accounts
+    :param trade_pnl_perc: flat array of trades % PnL of all accounts
+    :param trade_offsets: (n_accounts + 1, ) trades of account k are trade_pnl[trade_offsets[k]:trade_offsets[k+1]]
+    :return: (n_accounts, len(STATS_KEYS)) array (win rate and percentages are fractions)
+    """
+    n_acc = equity.shape[0]
+    result = np.full((n_acc, len(STATS_KEYS)), nan)
+
+    for k in range(n_acc):
+        t0 = trade_offsets[k]
+        n_trades = trade_offsets[k + 1] - t0
+        n = n_bars[k]
+        result[k, 5] = n_trades
+
+        if n_trades == 0 or n == 0:
+            continue
+
+        # Trades stats
+        n_win = 0
+        sum_perc = 0.0
+        for t in range(t0, t0 + n_trades):
+            if trade_pnl[t] > 0:
+                n_win += 1
+            if not np.isnan(trade_pnl_perc[t]):
+                sum_perc += trade_pnl_perc[t]
+        trade_avg = sum_perc / n_trades
+
+        sum_sq = 0.0
+        for t in range(t0, t0 + n_trades):
+            p = 0.0 if np.isnan(trade_pnl_perc[t]) else trade_pnl_perc[t]
+            sum_sq += (p - trade_avg) ** 2
+
+        # Equity stats: forward filled equity and capital, running maximum of equity (np.fmax.accumulate)
+        eq = nan
+        cap = nan
+        cap_sum = 0.0
+        cap_cnt = 0
+        eq_max = nan
+        mdd = nan
+        mdd_pct = nan
+        for i in range(n):
+            if not np.isnan(equity[k, i]):
+                eq = equity[k, i]
+            if not np.isnan(capital_invested[k, i]):
+                cap = capital_invested[k, i]
+            if not np.isnan(cap):
+                cap_sum += cap
+                cap_cnt += 1
+
+            if not np.isnan(eq):
+                if np.isnan(eq_max) or eq > eq_max:
+                    eq_max = eq
+                dd = eq - eq_max
+                if np.isnan(mdd) or dd < mdd:
+                    mdd = dd
+                dd_pct = eq / eq_max - 1
+                if not np.isnan(dd_pct) and (np.isnan(mdd_pct) or dd_pct < mdd_pct):
+                    mdd_pct = dd_pct
+
+        capital_invested_avg = cap_sum / cap_cnt if cap_cnt > 0 else nan
+        if capital_invested_avg == 0:
+            capital_invested_avg = nan
+        netprofit = eq - capital_invested_avg
+
+        difference_in_years = ((dates[k, n - 1] - dates[k, 0]) // NS_PER_DAY) / 365.2425
+        if eq > 0:
+            cagr = (eq / equity[k, 0]) ** (1 / difference_in_years) - 1
+        else:
+            cagr = -1.0
+
+        result[k, 0] = cagr
+        result[k, 1] = netprofit
+        result[k, 2] = netprofit / capital_invested_avg
+        result[k, 3] = mdd
+        result[k, 4] = mdd_pct
+        result[k, 6] = n_win / n_trades
+        result[k, 7] = trade_avg
+        result[k, 8] = (sum_sq / (n_trades - 1)) ** 0.5 if n_trades > 1 else nan
+
+    return result
+
+
+def calc_stats_batch(dates, equity, capital_invested, trade_pnl, trade_pnl_perc, trade_offsets, n_bars=None) -> np.ndarray:
+    """
+    Calculates stats of multiple accounts (see. _stats_kernel)
+    :param dates: int64 timestamps (nanoseconds) or datetime64 array, (time, ) if shared by all accounts or (n_accounts, time)
+    :param equity: (n_accounts, time) equity arrays
+    :param capital_invested: (n_accounts, time) capital invested arrays
+    :param trade_pnl: flat array of trades $ PnL of all accounts
+    :param trade_pnl_perc: flat array of trades % PnL of all accounts
+    :param trade_offsets: (n_accounts + 1, ) offsets of account trades in the flat trades arrays
+    :param n_bars: (optional) number of valid bars of each account (if accounts have different length)
+    :return: (n_accounts, len(STATS_KEYS)) array
+    """
+    equity = np.atleast_2d(np.asarray(equity, dtype=np.float64))
+    capital_invested = np.atleast_2d(np.asarray(capital_invested, dtype=np.float64))
+    dates = np.asarray(dates)
+    if dates.dtype.kind == 'M':
+        dates = dates.astype('M8[ns]').view(np.int64)
+    dates = np.broadcast_to(dates.astype(np.int64), equity.shape)
+
+    if n_bars is None:
+        n_bars = np.full(equity.shape[0], equity.shape[1], dtype=np.int64)
+
+    return _stats_kernel(dates, np.asarray(n_bars, dtype=np.int64), equity, capital_invested,
+                         np.asarray(trade_pnl, dtype=np.float64), np.asarray(trade_pnl_perc, dtype=np.float64),
+                         np.asarray(trade_offsets, dtype=np.int64))
+
+
+ROLLING_KEYS = ('return', 'volatility', 'sharpe', 'current_drawdown', 'max_drawdown', 'winrate')
+"""Report rolling stats keys"""
+
+
+@numba.jit(nopython=True)
+def _window_moments(x, i0, i1):  # pragma: no cover
+    """
+    Two-pass count, mean and sum of squared deviations of finite x[i0:i1] (exact restart of running updates)
+    """
+    cnt = 0
+    total = 0.0
+    for t in range(i0, i1):
+        if np.isfinite(x[t]):
+            cnt += 1
+            total += x[t]
+    if cnt == 0:
+        return 0, 0.0, 0.0
+    mean = total / cnt
+    m2 = 0.0
+    for t in range(i0, i1):
+        if np.isfinite(x[t]):
+            m2 += (x[t] - mean) ** 2
+    return cnt, mean, m2
+
+
+# Running variance is recomputed from the window when removals cancelled this fraction of its peak (lost precision)
+_M2_CANCEL_RATIO = 1e-6
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def _drawdown_combine(a_max, a_min, a_dd, b_max, b_min, b_dd):  # pragma: no cover
+    """
+    Max drawdown summary (equity maximum, minimum, max drawdown) of two consecutive ranges of positive equity,
+    empty range is (-inf, inf, 0)
+    """
+    dd = min(a_dd, b_dd)
+    if a_max > -inf and b_min < inf:
+        dd = min(dd, b_min / a_max - 1)
+    return max(a_max, b_max), min(a_min, b_min), dd
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def _rolling_stats_kernel(equity, window, min_periods, periods_per_year):  # pragma: no cover
+    """
+    Calculates rolling stats of multiple accounts, every bar is O(1) update (Welford mean / variance with removal,
+    monotonic deque of maximums, and max drawdown summaries of the window kept by two stacks queue: summaries of the
+    older bars are suffix combined once, when they are moved from the stack of newer bars, amortized O(1))
+    :param equity: (n_accounts, time) equity arrays
+    :param window: window length in bars
+    :param min_periods: minimal number of valid returns in window
+    :param periods_per_year: annualization factor
+    :return: (len(ROLLING_KEYS), n_accounts, time) array
+        - 'return' - equity change in window (fraction)
+        - 'volatility' - annualized standard deviation of bar returns
+        - 'sharpe' - annualized mean / standard deviation of bar returns
+        - 'current_drawdown' - drawdown of the last equity from the window maximum (fraction)
+        - 'max_drawdown' - maximum drawdown within the window (fraction), drawdowns are defined for positive equity
+        - 'winrate' - fraction of positive returns among non-zero returns
+    """
+    n_acc, n = equity.shape
+    result = np.full((len(ROLLING_KEYS), n_acc, n), nan)
+    rets = np.empty(n)
+    deque = np.empty(n, dtype=np.int64)
+    # Max drawdown summaries of the older window bars [f_head, f_end), each one is the summary of [bar, f_end)
+    f_max = np.empty(n)
+    f_min = np.empty(n)
+    f_dd = np.empty(n)
+
+    for k in range(n_acc):
+        eq = equity[k]
+        for i in range(n):
+            rets[i] = eq[i] / eq[i - 1] - 1 if i > 0 else nan
+
+        r_mean = 0.0
+        r_m2 = 0.0
+        r_m2_peak = 0.0
+        r_cnt = 0
+        n_win = 0
+        n_nonzero = 0
+        dq_head = 0
+        dq_tail = 0
+        f_head = 0
+        f_end = 0
+        # Summary of the newer window bars [f_end, i]
+        b_max, b_min, b_dd = -inf, inf, 0.0
+
+        for i in range(n):
+            # Add new bar
+            r = rets[i]
+            if np.isfinite(r):
+                r_cnt += 1
+                delta = r - r_mean
+                r_mean += delta / r_cnt
+                r_m2 += delta * (r - r_mean)
+                r_m2_peak = max(r_m2_peak, r_m2)
+                if r != 0:
+                    n_nonzero += 1
+                    if r > 0:
+                        n_win += 1
+
+            if not np.isnan(eq[i]):
+                while dq_tail > dq_head and eq[deque[dq_tail - 1]] <= eq[i]:
+                    dq_tail -= 1
+                deque[dq_tail] = i
+                dq_tail += 1
+                b_max, b_min, b_dd = _drawdown_combine(b_max, b_min, b_dd, eq[i], eq[i], 0.0)
+
+            # Remove bar which left the window
+            j = i - window
+            if j >= 0:
+                if f_head == f_end:
+                    # Move newer bars to the older bars stack
+                    s_max, s_min, s_dd = -inf, inf, 0.0
+                    for t in range(i, f_end - 1, -1):
+                        if not np.isnan(eq[t]):
+                            s_max, s_min, s_dd = _drawdown_combine(eq[t], eq[t], 0.0, s_max, s_min, s_dd)
+                        f_max[t], f_min[t], f_dd[t] = s_max, s_min, s_dd
+                    f_end = i + 1
+                    b_max, b_min, b_dd = -inf, inf, 0.0
+                f_head += 1
+
+                r = rets[j]
+                if np.isfinite(r):
+                    r_cnt -= 1
+                    if r_cnt == 0:
+                        r_mean = 0.0
+                        r_m2 = 0.0
+                        r_m2_peak = 0.0
+                    else:
+                        delta = r - r_mean
+                        r_mean -= delta / r_cnt
+                        r_m2 -= delta * (r - r_mean)
+                        if r_m2 < r_m2_peak * _M2_CANCEL_RATIO:
+                            r_cnt, r_mean, r_m2 = _window_moments(rets, j + 1, i + 1)
+                            r_m2_peak = r_m2
+                    if r != 0:
+                        n_nonzero -= 1
+                        if r > 0:
+                            n_win -= 1
+            while dq_tail > dq_head and deque[dq_head] <= j:
+                dq_head += 1
+
+            if j >= 0:
+                result[0, k, i] = eq[i] / eq[j] - 1
+
+            if dq_tail > dq_head and not np.isnan(eq[i]):
+                result[3, k, i] = eq[i] / eq[deque[dq_head]] - 1
+
+            if dq_tail > dq_head:
+                # Window equity points are (j, i]
+                if f_head < f_end:
+                    result[4, k, i] = _drawdown_combine(f_max[f_head], f_min[f_head], f_dd[f_head],
+                                                        b_max, b_min, b_dd)[2]
+                else:
+                    result[4, k, i] = b_dd
+
+            if r_cnt >= min_periods and r_cnt > 0:
+                if r_cnt > 1:
+                    vol = (max(r_m2, 0.0) / (r_cnt - 1)) ** 0.5
+                    result[1, k, i] = vol * periods_per_year ** 0.5
+                    result[2, k, i] = r_mean / vol * periods_per_year ** 0.5
+                if n_nonzero > 0:
+                    result[5, k, i] = n_win / n_nonzero
+
+    return result
+
+
+BOOTSTRAP_KEYS = ('CAGR %', 'MaxDD %', 'Return %', 'Trade % Mean', 'WinRate %')
+"""Report bootstrap stats keys"""
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def _bootstrap_kernel(rets, trade_rets, seeds, block_size, is_stationary, years):  # pragma: no cover
+    """
+    Bootstrap resampling of bar returns (block or stationary bootstrap) and trade returns (iid)
+    :param rets: bar returns array
+    :param trade_rets: trades % returns array
+    :param seeds: random seeds of resampled paths (one stream per path)
+    :param block_size: block length (mean block length for stationary bootstrap)
+    :param is_stationary: use stationary bootstrap (geometric block lengths) instead of fixed blocks
+    :param years: length of the period in years (for CAGR)
+    :return: (len(seeds), len(BOOTSTRAP_KEYS)) array of resampled stats (fractions)
+    """
+    n = len(seeds)
+    result = np.full((n, len(BOOTSTRAP_KEYS)), nan)
+    n_rets = len(rets)
+    n_trades = len(trade_rets)
+    p_new_block = 1.0 / block_size
+
+    for k in range(n):
+        np.random.seed(seeds[k])
+        if n_rets > 0:
+            equity = 1.0
+            equity_max = 1.0
+            mdd = 0.0
+            pos = np.random.randint(0, n_rets)
+            block_left = block_size
+
+            for i in range(n_rets):
+                if is_stationary:
+                    if i > 0 and np.random.random() < p_new_block:
+                        pos = np.random.randint(0, n_rets)
+                else:
+                    if block_left == 0:
+                        pos = np.random.randint(0, n_rets)
+                        block_left = block_size
+                    block_left -= 1
+
+                equity *= 1 + rets[pos]
+                if equity > equity_max:
+                    equity_max = equity
+                dd = equity / equity_max - 1
+                if dd < mdd:
+                    mdd = dd
+                # Circular blocks
+                pos = pos + 1 if pos + 1 < n_rets else 0
+
+            result[k, 0] = equity ** (1 / years) - 1 if equity > 0 else -1.0
+            result[k, 1] = mdd
+            result[k, 2] = equity - 1
+
+        if n_trades > 0:
+            t_sum = 0.0
+            n_win = 0
+            for i in range(n_trades):
+                r = trade_rets[np.random.randint(0, n_trades)]
+                t_sum += r
+                if r > 0:
+                    n_win += 1
+            result[k, 3] = t_sum / n_trades
+            result[k, 4] = n_win / n_trades
+
+    return result
+
+
+def _bootstrap_worker(args):
+    """
+    Process pool worker of Report.bootstrap()
+    """
+    return _bootstrap_kernel(*args)
+
+
+BENCHMARK_KEYS = ('beta', 'alpha', 'correlation', 'tracking_error', 'information_ratio')
+"""Report benchmark stats keys"""
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def _benchmark_from_moments(cnt, mean_x, mean_y, m2_x, m2_y, c_xy, periods_per_year):  # pragma: no cover
+    """
+    Benchmark stats from moments of account returns (x) and benchmark returns (y), works for scalars and arrays
+    :param cnt: number of returns
+    :param mean_x: mean of x
+    :param mean_y: mean of y
+    :param m2_x: sum of squared deviations of x from the mean
+    :param m2_y: sum of squared deviations of y from the mean
+    :param c_xy: sum of products of x and y deviations from the means
+    :return: tuple (beta, alpha, correlation, tracking_error, information_ratio), alpha and tracking error are annualized
+    """
+    cov = c_xy / (cnt - 1)
+    var_x = np.maximum(m2_x / (cnt - 1), 0.0)
+    var_y = np.maximum(m2_y / (cnt - 1), 0.0)
+    # Active returns: d = x - y
+    mean_d = mean_x - mean_y
+    var_d = np.maximum(var_x + var_y - 2 * cov, 0.0)
+
+    beta = cov / var_y
+    alpha = (mean_x - beta * mean_y) * periods_per_year
+    correlation = cov / np.sqrt(var_x * var_y)
+    tracking_error = np.sqrt(var_d * periods_per_year)
+    information_ratio = mean_d * periods_per_year / tracking_error
+    return beta, alpha, correlation, tracking_error, information_ratio
+
+
+@numba.jit(nopython=True)
+def _window_comoments(x, y, i0, i1):  # pragma: no cover
+    """
+    Two-pass count, means and sums of squared / cross deviations of finite (x, y) pairs in [i0, i1) (exact restart of
+    running updates)
+    """
+    cnt = 0
+    sx = 0.0
+    sy = 0.0
+    for t in range(i0, i1):
+        if np.isfinite(x[t]) and np.isfinite(y[t]):
+            cnt += 1
+            sx += x[t]
+            sy += y[t]
+    if cnt == 0:
+        return 0, 0.0, 0.0, 0.0, 0.0, 0.0
+    mean_x = sx / cnt
+    mean_y = sy / cnt
+    m2_x = 0.0
+    m2_y = 0.0
+    c_xy = 0.0
+    for t in range(i0, i1):
+        if np.isfinite(x[t]) and np.isfinite(y[t]):
+            m2_x += (x[t] - mean_x) ** 2
+            m2_y += (y[t] - mean_y) ** 2
+            c_xy += (x[t] - mean_x) * (y[t] - mean_y)
+    return cnt, mean_x, mean_y, m2_x, m2_y, c_xy
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def _rolling_benchmark_kernel(rets, bench_rets, window, min_periods, periods_per_year):  # pragma: no cover
+    """
+    Rolling benchmark stats of multiple accounts by Welford co-moments updates with removal (O(1) update per bar),
+    the moments are recomputed from the window when removals cancel most of their peak (lost precision)
+    :param rets: (n_accounts, time) account returns
+    :param bench_rets: (time, ) benchmark returns
+    :return: (len(BENCHMARK_KEYS), n_accounts, time) array
+    """
+    n_acc, n = rets.shape
+    result = np.full((len(BENCHMARK_KEYS), n_acc, n), nan)
+
+    for k in range(n_acc):
+        x_arr = rets[k]
+        cnt = 0
+        mean_x = 0.0
+        mean_y = 0.0
+        m2_x = 0.0
+        m2_y = 0.0
+        c_xy = 0.0
+        m2_x_peak = 0.0
+        m2_y_peak = 0.0
+        for i in range(n):
+            x = x_arr[i]
+            y = bench_rets[i]
+            if np.isfinite(x) and np.isfinite(y):
+                cnt += 1
+                dx = x - mean_x
+                dy = y - mean_y
+                mean_x += dx / cnt
+                mean_y += dy / cnt
+                m2_x += dx * (x - mean_x)
+                m2_y += dy * (y - mean_y)
+                c_xy += dx * (y - mean_y)
+                m2_x_peak = max(m2_x_peak, m2_x)
+                m2_y_peak = max(m2_y_peak, m2_y)
+            j = i - window
+            if j >= 0:
+                x = x_arr[j]
+                y = bench_rets[j]
+                if np.isfinite(x) and np.isfinite(y):
+                    cnt -= 1
+                    if cnt == 0:
+                        mean_x = mean_y = m2_x = m2_y = c_xy = m2_x_peak = m2_y_peak = 0.0
+                    else:
+                        dx = x - mean_x
+                        dy = y - mean_y
+                        mean_x -= dx / cnt
+                        mean_y -= dy / cnt
+                        m2_x -= dx * (x - mean_x)
+                        m2_y -= dy * (y - mean_y)
+                        c_xy -= dx * (y - mean_y)
+                        if m2_x < m2_x_peak * _M2_CANCEL_RATIO or m2_y < m2_y_peak * _M2_CANCEL_RATIO:
+                            cnt, mean_x, mean_y, m2_x, m2_y, c_xy = _window_comoments(x_arr, bench_rets, j + 1, i + 1)
+                            m2_x_peak = m2_x
+                            m2_y_peak = m2_y
+
+            if cnt >= min_periods and cnt > 1:
+                stats = _benchmark_from_moments(cnt, mean_x, mean_y, m2_x, m2_y, c_xy, periods_per_year)
+                for m in range(len(BENCHMARK_KEYS)):
+                    result[m, k, i] = stats[m]
+
+    return result
+
+
+EXPOSURE_KEYS = ('gross', 'net', 'long', 'short', 'turnover', 'concentration', 'n_positions', 'holding_bars')
+"""Report exposure series keys"""
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def _exposure_kernel(indptr, ids, qty, value, n_assets):  # pragma: no cover
+    """
+    Exposure analytics from position history in CSR format (see. Account._positions_csr())
+    :return: (len(EXPOSURE_KEYS), n_bars) array
+        - 'gross' - sum of absolute position values
+        - 'net' - sum of signed position values
+        - 'long' / 'short' - sum of long / short position values
+        - 'turnover' - traded dollar value (position changes valued at the current unit value, or at the previous one
+                       for closed positions)
+        - 'concentration' - Herfindahl index of position weights by absolute value (1 - single position)
+        - 'n_positions' - number of opened positions
+        - 'holding_bars' - average number of bars since position opening (weighted by absolute position value)
+    """
+    n = len(indptr) - 1
+    result = np.zeros((len(EXPOSURE_KEYS), n))
+    prev_qty = np.zeros(n_assets)
+    unit_value = np.zeros(n_assets)
+    age = np.zeros(n_assets)
+    last_bar = np.full(n_assets, -1)
+
+    for i in range(n):
+        gross = 0.0
+        net = 0.0
+        long = 0.0
+        short = 0.0
+        traded = 0.0
+        sum_sq = 0.0
+        sum_age = 0.0
+
+        for p in range(indptr[i], indptr[i + 1]):
+            a = ids[p]
+            q = qty[p]
+            v = value[p]
+            abs_v = abs(v)
+            gross += abs_v
+            net += v
+            if v > 0:
+                long += v
+            else:
+                short += v
+            sum_sq += v * v
+
+            unit_value[a] = abs_v / abs(q)
+            traded += abs(q - prev_qty[a]) * unit_value[a]
+
+            if (q > 0 and prev_qty[a] > 0) or (q < 0 and prev_qty[a] < 0):
+                age[a] += 1
+            else:
+                age[a] = 1
+            sum_age += age[a] * abs_v
+
+            prev_qty[a] = q
+            last_bar[a] = i
+
+        if i > 0:
+            # Positions closed at bar i
+            for p in range(indptr[i - 1], indptr[i]):
+                a = ids[p]
+                if last_bar[a] != i and prev_qty[a] != 0:
+                    traded += abs(prev_qty[a]) * unit_value[a]
+                    prev_qty[a] = 0.0
+                    age[a] = 0
+
+        result[0, i] = gross
+        result[1, i] = net
+        result[2, i] = long
+        result[3, i] = short
+        result[4, i] = traded
+        result[5, i] = sum_sq / (gross * gross) if gross > 0 else nan
+        result[6, i] = indptr[i + 1] - indptr[i]
+        result[7, i] = sum_age / gross if gross > 0 else nan
+
+    return result
+
+
+def _stats_series(stats_row) -> pd.Series:
+    """
+    Converts stats array row into the report stats series
+    """
+    return pd.Series(OrderedDict([
+        ('CAGR %', stats_row[0] * 100),
+        ('NetProfit $', stats_row[1]),
+        ('NetProfit %', stats_row[2] * 100),
+        ('MaxDD $', stats_row[3]),
+        ('MaxDD %', stats_row[4] * 100),
+        ('NumberOfTrades', int(stats_row[5])),
+        ('WinRate', f'{stats_row[6] * 100:0.2f}%'),
+        ('Trade % Mean', stats_row[7] * 100),
+        ('Trade % StDev', stats_row[8] * 100),
+    ]))
+
+
+def _account_arrays(account) -> dict:
+    """
+    Numeric arrays of account required to build stats
+    :return: dict of arrays
+    """
+    n = account._buf_cnt
+    return {
+        'dates': account._date_array[:n].astype('M8[ns]').view(np.int64),
+        'equity': account._equity_array_exec[:n],
+        'capital_invested': account._capital_invested_array[:n],
+    }
+
+
+def _transactions_arrays(transactions) -> Tuple[dict, int]:
+    """
+    Numeric columns of transactions log required to build trades (dates and contexts are not converted)
+    :param transactions: list of transactions (see. Account._transactions_log())
+    :return: tuple (dict of arrays, number of unique assets)
+    """
+    keys = ('qty', 'price_close', 'price_exec', 'costs_close', 'costs_exec', 'pnl_close', 'pnl_execution')
+    if len(transactions) == 0:
+        arrays = {'tx_' + k: np.zeros(0) for k in keys}
+        arrays['tx_asset_ids'] = arrays['tx_position_action'] = np.zeros(0, dtype=np.int64)
+        return arrays, 0
+
+    columns = list(zip(*transactions))
+    assets = np.empty(len(transactions), dtype=object)
+    assets[:] = columns[1]
+    asset_ids, uniques = pd.factorize(assets)
+
+    arrays = {
+        'tx_asset_ids': asset_ids.astype(np.int64),
+        'tx_position_action': np.array(columns[2], dtype=np.int64),
+    }
+    for k, col in zip(keys, columns[3:10]):
+        arrays['tx_' + k] = np.array(col, dtype=np.float64)
+    return arrays, len(uniques)
+
+
+def _build_trades_arrays(transactions) -> dict:
+    """
+    Calculates trades from account transactions log
+    :return: trades arrays dict
+    """
+    arrays, n_assets = _transactions_arrays(transactions)
+    return _calc_trades(arrays['tx_asset_ids'], n_assets, arrays['tx_position_action'], arrays['tx_qty'],
+                        arrays['tx_price_close'], arrays['tx_price_exec'], arrays['tx_costs_close'],
+                        arrays['tx_costs_exec'], arrays['tx_pnl_close'], arrays['tx_pnl_execution'])
+
+
+def _stats_arrays(arrays_list, trades_list):
+    """
+    Packs arrays of multiple accounts into Report.calc_stats() arguments, shorter accounts are padded by NaNs
+    :param arrays_list: list of account arrays (see. _account_arrays())
+    :param trades_list: list of trades arrays
+    :return: dict of Report.calc_stats() kwargs
+    """
+    n_acc = len(arrays_list)
+    n_bars = np.array([len(a['equity']) for a in arrays_list], dtype=np.int64)
+    max_bars = max(n_bars.max(), 1) if n_acc > 0 else 1
+
+    dates = np.zeros((n_acc, max_bars), dtype=np.int64)
+    equity = np.full((n_acc, max_bars), np.nan)
+    capital_invested = np.full((n_acc, max_bars), np.nan)
+    for k, a in enumerate(arrays_list):
+        dates[k, :n_bars[k]] = a['dates']
+        equity[k, :n_bars[k]] = a['equity']
+        capital_invested[k, :n_bars[k]] = a['capital_invested']
+
+    trade_offsets = np.zeros(n_acc + 1, dtype=np.int64)
+    trade_offsets[1:] = np.cumsum([len(t['pnl']) for t in trades_list])
+    trade_pnl = np.concatenate([t['pnl'] for t in trades_list] + [np.zeros(0)])
+    trade_pnl_perc = np.concatenate([t['pnl_perc'] for t in trades_list] + [np.zeros(0)])
+
+    return dict(dates=dates, equity=equity, capital_invested=capital_invested, trade_pnl=trade_pnl,
+                trade_pnl_perc=trade_pnl_perc, trade_offsets=trade_offsets, n_bars=n_bars)
+
+
+class _TransactionsPayload:
+    """
+    Transactions logs of accounts for the process pool initializer: forked workers inherit the logs without
+    pickling, otherwise the logs are pickled with assets by ticker
+    """
+    def __init__(self, logs):
+        self.logs = logs
+
+    def __reduce__(self):
+        return _TransactionsPayload._loads, (dumps_by_ticker(self.logs),)
+
+    @staticmethod
+    def _loads(data):
+        return _TransactionsPayload(loads_by_ticker(data))
+
+
+# Transactions logs of the worker process (set by pool initializer), see. Report._build_trades()
+_worker_logs = None
+
+
+def _trades_init(payload):
+    global _worker_logs
+    _worker_logs = payload.logs
+
+
+def _build_trades_worker(k):
+    """
+    Process pool worker of Report parallel build, converts transactions log k into trades arrays
+    """
+    return _build_trades_arrays(_worker_logs[k])
+
+
 class Report:
     """
     Generic backtester report
@@ -113,22 +950,351 @@ class Report:
         """
         Build backtester report after initialization
         :param accounts: list of accounts
+        :param kwargs:
+            - 'n_jobs' - number of processes used to build trades of accounts (default: 1)
+            - 'lazy' - if True, nothing is built at initialization, stats table is built on the first
+                       Report.stats() request, trades lists and series of the account are built on the first
+                       Report.trades() / Report.series() request (default: False)
+            - 'benchmark' - benchmark Asset for Report.benchmark_stats() / Report.benchmark_rolling()
         """
         self.accounts = accounts
         self.results = {}
+        self.kwargs = kwargs
+
+        self._accounts = OrderedDict()
+        self._stats = OrderedDict()
+        self._trades_arrays = {}
+        self._transactions = {}
+        self._rolling = {}
+        self._exposure = {}
+        self._benchmark = None
+
+        self.benchmark = kwargs.get('benchmark', None)
+        if self.benchmark is not None and not isinstance(self.benchmark, Asset):
+            raise ValueError(f"'benchmark' must be an Asset, got {type(self.benchmark)}")
 
         for acc in accounts:
-            if acc in self.results:
+            if acc in self._accounts:
                 raise ValueError(f"Duplicated account name '{acc}'")
+            self._accounts[acc] = acc
+
+        if not kwargs.get('lazy', False):
+            self._build_stats()
+            for acc in self._accounts:
+                self._get_result(acc)
+
+    def _build_trades(self, accounts):
+        """
+        Calculates trades of accounts (in the process pool if 'n_jobs' > 1), the transactions logs are converted to
+        arrays by workers
+        :param accounts: list of accounts
+        """
+        accounts = [acc for acc in accounts if acc not in self._trades_arrays]
+        logs = [acc._transactions_log() for acc in accounts]
+
+        n_jobs = self.kwargs.get('n_jobs', 1)
+        if n_jobs > 1 and len(accounts) > 1:
+            trades_list = pool_map(_build_trades_worker, list(range(len(logs))), n_jobs, initializer=_trades_init,
+                                   initargs=(_TransactionsPayload(logs),))
+        else:
+            trades_list = [_build_trades_arrays(log) for log in logs]
+
+        for acc, log, trades in zip(accounts, logs, trades_list):
+            self._transactions[acc] = log
+            self._trades_arrays[acc] = trades
+
+    def _build_stats(self, accounts=None):
+        """
+        Calculates stats of accounts (all accounts by default) by a single kernel call
+        """
+        accounts = [acc for acc in (self._accounts if accounts is None else accounts) if acc not in self._stats]
+        if len(accounts) == 0:
+            return
+        self._build_trades(accounts)
+        df_stats = Report.calc_stats(**_stats_arrays([_account_arrays(acc) for acc in accounts],
+                                                     [self._trades_arrays[acc] for acc in accounts]))
+        for k, acc in enumerate(accounts):
+            self._stats[acc] = df_stats[k]
+
+    @staticmethod
+    def calc_stats(dates, equity, capital_invested, trade_pnl, trade_pnl_perc, trade_offsets, names=None,
+                   n_bars=None) -> pd.DataFrame:
+        """
+        Calculates report stats of multiple accounts from raw arrays by a single compiled pass, i.e. for summarizing
+        large parameter sweeps without building Account / Report objects
+        :param dates: datetime64 or int64 (ns) array, (time, ) if shared by all accounts or (n_accounts, time)
+        :param equity: (n_accounts, time) equity arrays
+        :param capital_invested: (n_accounts, time) capital invested arrays
+        :param trade_pnl: flat array of trades $ PnL of all accounts
+        :param trade_pnl_perc: flat array of trades % PnL of all accounts
+        :param trade_offsets: (n_accounts + 1, ) trades of account k are trade_pnl[trade_offsets[k]:trade_offsets[k+1]]
+        :param names: (optional) account names
+        :param n_bars: (optional) (n_accounts, ) number of valid bars of each account, if accounts of different length
+                       are padded to the same time axis (the padding is not a part of the account period, i.e. CAGR)
+        :return: pd.DataFrame of stats (same as Report.stats())
+        """
+        stats = calc_stats_batch(dates, equity, capital_invested, trade_pnl, trade_pnl_perc, trade_offsets,
+                                 n_bars=n_bars)
+        if names is None:
+            names = range(len(stats))
+        return pd.DataFrame(OrderedDict((name, _stats_series(row)) for name, row in zip(names, stats)),
+                            index=list(STATS_KEYS), columns=list(names))
+
+    def _aligned_arrays(self, key) -> pd.DataFrame:
+        """
+        Raw account arrays aligned by dates of all accounts
+        :param key: Account attribute name (i.e. '_equity_array_exec')
+        :return: pd.DataFrame (dates x accounts)
+        """
+        return pd.DataFrame({acc: pd.Series(getattr(acc, key)[:acc._buf_cnt], index=acc._date_array[:acc._buf_cnt])
+                             for acc in self._accounts})
 
+    def rolling(self, stat_name, window, min_periods=None, periods_per_year=252) -> pd.DataFrame:
+        """
+        Rolling performance stats of all accounts (calculated by running window updates, based on equity at exec time)
+        :param stat_name: stat name:
+            - 'return' - equity change in window (%)
+            - 'volatility' - annualized standard deviation of bar returns (%)
+            - 'sharpe' - annualized Sharpe ratio of bar returns (zero risk free rate)
+            - 'current_drawdown' - drawdown of the last equity from the window maximum (%)
+            - 'max_drawdown' - maximum drawdown within the window (%)
+            - 'winrate' - percentage of positive bar returns (among non-zero returns)
+        :param window: window length in bars
+        :param min_periods: minimal number of valid bar returns in the window (default: window)
+        :param periods_per_year: bars per year for annualization (default: 252)
+        :return: pd.DataFrame (dates x accounts)
+        """
+        if stat_name not in ROLLING_KEYS:
+            raise ValueError(f"Unknown rolling stat '{stat_name}', supported: {ROLLING_KEYS}")
+        if window < 2:
+            raise ValueError("'window' must be >= 2")
+
+        min_periods = window if min_periods is None else min_periods
+        cache_key = (window, min_periods, periods_per_year)
+        if cache_key not in self._rolling:
+            df_equity = self._aligned_arrays('_equity_array_exec')
+            values = _rolling_stats_kernel(np.ascontiguousarray(df_equity.values.T), window, min_periods,
+                                           periods_per_year)
+            self._rolling[cache_key] = (df_equity.index, df_equity.columns, values)
+
+        index, columns, values = self._rolling[cache_key]
+        k = ROLLING_KEYS.index(stat_name)
+        result = values[k].T
+        if stat_name != 'sharpe':
+            result = result * 100
+        return pd.DataFrame(result, index=index, columns=columns)
+
+    def bootstrap(self, n=10000, block_size=None, method='stationary', percentiles=(5, 25, 50, 75, 95),
+                  n_jobs=1, seed=None) -> pd.DataFrame:
+        """
+        Bootstrap confidence intervals of account stats, resamples bar returns (equity at exec time) by blocks to keep
+        autocorrelation and trades % returns (iid), every resampled path has the same length as the account
+        :param n: number of resampled paths per account
+        :param block_size: (mean) block length in bars (default: cube root of account length)
+        :param method: 'stationary' - random block lengths with mean 'block_size', 'block' - fixed length blocks
+        :param percentiles: percentiles of resampled stats to report
+        :param n_jobs: number of processes, paths are split into chunks among processes
+        :param seed: random seed (for reproducible results), every account and path has its own random stream derived
+                     from the seed, so results don't depend on n_jobs
+        :return: pd.DataFrame of resampled stats percentiles, columns are (account, percentile):
+            - 'CAGR %'
+            - 'MaxDD %'
+            - 'Return %' - total return of the path
+            - 'Trade % Mean'
+            - 'WinRate %' - percentage of winning trades
+        """
+        if method not in ('stationary', 'block'):
+            raise ValueError(f"Unknown bootstrap method '{method}', supported: 'stationary', 'block'")
+
+        n_chunks = max(1, min(n_jobs * 4, n // 1000)) if n_jobs > 1 else 1
+        acc_seeds = np.random.SeedSequence(seed).spawn(len(self._accounts))
+
+        self._build_trades(list(self._accounts))
+        tasks = []
+        for acc, acc_seed in zip(self._accounts, acc_seeds):
+            equity = acc._equity_array_exec[:acc._buf_cnt]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rets = equity[1:] / equity[:-1] - 1
+            rets = rets[np.isfinite(rets)]
+
+            dates = acc._date_array[:acc._buf_cnt]
+            years = (dates[-1] - dates[0]) / np.timedelta64(1, 'D') / 365.2425 if len(dates) > 1 else nan
+
+            trade_rets = self._trades_arrays[acc]['pnl_perc']
+            trade_rets = np.where(np.isnan(trade_rets), 0.0, trade_rets)
+
+            acc_block_size = block_size if block_size is not None else max(1, int(round(len(rets) ** (1 / 3))))
+            path_seeds = acc_seed.generate_state(n)
+            for chunk_seeds in np.array_split(path_seeds, n_chunks):
+                tasks.append((rets, trade_rets, chunk_seeds, acc_block_size, method == 'stationary', years))
+
+        results = pool_map(_bootstrap_worker, tasks, n_jobs)
+
+        tables = OrderedDict()
+        for k, acc in enumerate(self._accounts):
+            values = np.vstack(results[k * n_chunks:(k + 1) * n_chunks])
+            # All-NaN stats (e.g. no trades) are reported as NaN
+            with np.errstate(invalid='ignore'), warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                perc = np.nanpercentile(values, percentiles, axis=0) * 100
+            tables[acc] = pd.DataFrame(perc.T, index=BOOTSTRAP_KEYS, columns=[f'{p}%' for p in percentiles])
+
+        return pd.concat(tables, axis=1)
+
+    def _benchmark_returns(self) -> Tuple[pd.DataFrame, np.ndarray]:
+        """
+        Account returns and benchmark returns aligned by dates of all accounts (calculated once)
+        :return: tuple (pd.DataFrame of account returns (dates x accounts), benchmark returns array)
+        """
+        if self.benchmark is None:
+            raise ValueError("Report has no benchmark, use Report(accounts, benchmark=<Asset>)")
+
+        if self._benchmark is None:
+            df_equity = self._aligned_arrays('_equity_array_exec')
+            bench_px = self.benchmark.quotes()['exec']
+            bench_px = bench_px.reindex(df_equity.index.union(bench_px.index), method='ffill').reindex(df_equity.index)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bench_rets = bench_px.values[1:] / bench_px.values[:-1] - 1
+                df_rets = df_equity / df_equity.shift(1).values - 1
+            self._benchmark = (df_rets, np.concatenate([[nan], bench_rets]))
+        return self._benchmark
+
+    def benchmark_stats(self, periods_per_year=252) -> pd.DataFrame:
+        """
+        Full-period benchmark relative stats of all accounts (bar returns of equity at exec time vs benchmark
+        'exec' prices)
+        :param periods_per_year: bars per year for annualization (default: 252)
+        :return: pd.DataFrame (stats x accounts):
+            - 'beta'
+            - 'alpha' - annualized alpha (fraction)
+            - 'correlation'
+            - 'tracking_error' - annualized standard deviation of active returns (fraction)
+            - 'information_ratio' - annualized mean active return / tracking error
+        """
+        df_rets, bench_rets = self._benchmark_returns()
+
+        x = df_rets.values
+        valid = np.isfinite(x) & np.isfinite(bench_rets)[:, None]
+        y = np.where(valid, bench_rets[:, None], 0.0)
+        x = np.where(valid, x, 0.0)
+
+        cnt = valid.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_x = x.sum(axis=0) / cnt
+            mean_y = y.sum(axis=0) / cnt
+        dx = np.where(valid, x - mean_x, 0.0)
+        dy = np.where(valid, y - mean_y, 0.0)
+        stats = _benchmark_from_moments(cnt.astype(np.float64), mean_x, mean_y, (dx * dx).sum(axis=0),
+                                        (dy * dy).sum(axis=0), (dx * dy).sum(axis=0), float(periods_per_year))
+        return pd.DataFrame(np.vstack(stats), index=BENCHMARK_KEYS, columns=df_rets.columns)
+
+    def benchmark_rolling(self, stat_name, window, min_periods=None, periods_per_year=252) -> pd.DataFrame:
+        """
+        Rolling benchmark relative stats of all accounts (see. Report.benchmark_stats())
+        :param stat_name: 'beta', 'alpha', 'correlation', 'tracking_error', 'information_ratio'
+        :param window: window length in bars
+        :param min_periods: minimal number of valid returns in the window (default: window)
+        :param periods_per_year: bars per year for annualization (default: 252)
+        :return: pd.DataFrame (dates x accounts)
+        """
+        if stat_name not in BENCHMARK_KEYS:
+            raise ValueError(f"Unknown benchmark stat '{stat_name}', supported: {BENCHMARK_KEYS}")
+        if window < 2:
+            raise ValueError("'window' must be >= 2")
+
+        df_rets, bench_rets = self._benchmark_returns()
+        min_periods = window if min_periods is None else min_periods
+        values = _rolling_benchmark_kernel(np.ascontiguousarray(df_rets.values.T), bench_rets, window, min_periods,
+                                           periods_per_year)
+        return pd.DataFrame(values[BENCHMARK_KEYS.index(stat_name)].T, index=df_rets.index, columns=df_rets.columns)
+
+    def exposure(self, series_name) -> pd.DataFrame:
+        """
+        Position exposure series of all accounts (based on position history recorded by the account)
+        :param series_name:
+            - 'gross' - sum of absolute position values ($)
+            - 'net' - sum of signed position values ($)
+            - 'long' - sum of long position values ($)
+            - 'short' - sum of short position values ($, negative)
+            - 'turnover' - traded value ($)
+            - 'concentration' - Herfindahl index of position weights (1 - single position, 1/N - equal weights)
+            - 'n_positions' - number of opened positions
+            - 'holding_bars' - value weighted average number of bars since opening of positions
+        :return: pd.DataFrame (dates x accounts)
+        """
+        if series_name not in EXPOSURE_KEYS:
+            raise ValueError(f"Unknown exposure series '{series_name}', supported: {EXPOSURE_KEYS}")
+
+        k = EXPOSURE_KEYS.index(series_name)
+        result = {}
+        for acc in self._accounts:
+            if acc not in self._exposure:
+                indptr, ids, qty, value = acc._positions_csr()
+                self._exposure[acc] = _exposure_kernel(indptr, ids, qty, value, len(acc._assets))
+            result[acc] = pd.Series(self._exposure[acc][k], index=acc._date_array[:acc._buf_cnt])
+        return pd.DataFrame(result)
+
+    def attribution(self, acc_name, by='asset') -> pd.DataFrame:
+        """
+        PnL and costs (at exec time) attribution of the account, based on per asset PnL recorded by the account
+        :param acc_name: account name
+        :param by: grouping of attribution:
+            - 'asset' - by asset
+            - 'month' - by calendar month
+            - 'year' - by calendar year
+            - dict of {asset or ticker: group name} - by user defined groups (i.e. sectors), unmapped assets are
+              grouped as 'N/A'
+            - callable(asset) -> group name - by user defined groups
+        :return: pd.DataFrame with columns ['pnl', 'costs'] indexed by group
+        """
+        acc = self._accounts[acc_name]
+        indptr, ids, pnl, costs = acc._attribution_csr()
+        pnl = np.where(np.isnan(pnl), 0.0, pnl)
+        costs = np.where(np.isnan(costs), 0.0, costs)
+        assets = np.empty(len(acc._assets), dtype=object)
+        for i, a in enumerate(acc._assets):
+            assets[i] = a
+
+        if isinstance(by, str) and by in ('month', 'year'):
+            dates = acc._date_array[:acc._buf_cnt].astype('M8[M]' if by == 'month' else 'M8[Y]')
+            periods, bar_period_ids = np.unique(dates, return_inverse=True)
+            group_ids = bar_period_ids[np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))]
+            index = pd.PeriodIndex(periods, freq='M' if by == 'month' else 'A')
+        elif isinstance(by, str) and by == 'asset':
+            group_ids = ids
+            index = pd.Index(assets, dtype=object)
+        elif isinstance(by, dict) or callable(by):
+            if isinstance(by, dict):
+                groups = [by.get(a, by.get(str(a), 'N/A')) for a in assets]
+            else:
+                groups = [by(a) for a in assets]
+            asset_group_ids, index = pd.factorize(pd.Series(groups, dtype=object))
+            group_ids = asset_group_ids.take(ids)
+        else:
+            raise ValueError(f"Unknown attribution grouping '{by}', supported: 'asset', 'month', 'year', "
+                             f"dict or callable")
+
+        return pd.DataFrame({
+            'pnl': np.bincount(group_ids, weights=pnl, minlength=len(index)),
+            'costs': np.bincount(group_ids, weights=costs, minlength=len(index)),
+        }, index=index)
+
+    def _get_result(self, acc_name) -> Tuple[pd.Series, pd.DataFrame, pd.DataFrame]:
+        """
+        Returns (stats, series, trades) for account, builds series and trades list on the first request
+        """
+        acc = self._accounts[acc_name]
+        if acc not in self.results:
             self.results[acc] = self._build(acc)
+        return self.results[acc]
 
     def stats(self) -> pd.DataFrame:
         """
         Re
         :return:
         """
-        return pd.DataFrame({acc: r[0] for acc, r in self.results.items()})
+        self._build_stats()
+        return pd.DataFrame({acc: self._stats[acc] for acc in self._accounts})
 
     def series(self, series_name) -> pd.DataFrame:
         """
@@ -142,7 +1308,7 @@ class Report:
         - 'pnl' (at exec time)
         :return:
         """
-        return pd.DataFrame({acc: r[1][series_name] for acc, r in self.results.items()})
+        return pd.DataFrame({acc: self._get_result(acc)[1][series_name] for acc in self._accounts})
 
     def trades(self, acc_name) -> pd.DataFrame:
         """
@@ -150,7 +1316,7 @@ class Report:
         :param acc_name: account name
         :return:
         """
-        return self.results[acc_name][2]
+        return self._get_result(acc_name)[2]
 
 
     @staticmethod
@@ -182,69 +1348,68 @@ class Report:
         trade_tuples = [t.as_tuple() for t in closed_trades]
         return pd.DataFrame(trade_tuples, columns=TRADE_KEYS)
 
-    def _build(self, account) -> Tuple[dict, pd.DataFrame, pd.DataFrame]:
+    @staticmethod
+    def _trades_frame(transactions, trades) -> pd.DataFrame:
+        """
+        Converts trades arrays to trades list dataframe
+        :param transactions: transactions log (see. Account._transactions_log())
+        :param trades: trades arrays (see. _calc_trades())
+        :return:
+        """
+        entry_idx = trades['entry_idx'].tolist()
+        asset = np.empty(len(entry_idx), dtype=object)
+        context = np.empty(len(entry_idx), dtype=object)
+        for k, i in enumerate(entry_idx):
+            trans = transactions[i]
+            asset[k] = trans[1]
+            # Transactions without context
+            context[k] = trans[10] if len(trans) > 10 else None
+        context[pd.isnull(context)] = np.nan
+
+        return pd.DataFrame(OrderedDict([
+            ('asset', asset),
+            ('date_entry', pd.DatetimeIndex([transactions[i][0] for i in entry_idx])),
+            ('date_exit', pd.DatetimeIndex([transactions[i][0] for i in trades['exit_idx'].tolist()])),
+            ('side', trades['side']),
+            ('n_transactions', trades['n_transactions']),
+            ('wavg_price_entered', trades['wavg_price_entered']),
+            ('wavg_price_exited', trades['wavg_price_exited']),
+            ('qty_entered', trades['qty_entered']),
+            ('qty_exited', trades['qty_exited']),
+            ('pnl', trades['pnl']),
+            ('pnl_perc', trades['pnl_perc']),
+            ('costs', trades['costs']),
+            ('context', context),
+        ]), columns=TRADE_KEYS)
+
+    @staticmethod
+    def _produce_trades_list_fast(account) -> pd.DataFrame:
+        """
+        Produces trades list using account transactions (compiled version of Report._produce_trades_list())
+        :param account:
+        :return:
+        """
+        transactions = account._transactions_log()
+        return Report._trades_frame(transactions, _build_trades_arrays(transactions))
+
+    def _build(self, account) -> Tuple[pd.Series, pd.DataFrame, pd.DataFrame]:
         """
         Builds backtesting report statistics
         :return:
         """
+        self._build_stats([account])
+        stats = self._stats[account]
         acc_df = account.as_dataframe()
-        acc_trades = Report._produce_trades_list(account)
-
-        # Calculate stats
-        trade_pnl = acc_trades['pnl'].fillna(0)
-        trade_pnl_perc = acc_trades['pnl_perc'].fillna(0)
-
-        mdd = np.nan
-        mdd_pct = np.nan
-        winrate = np.nan
-        netprofit = np.nan
-        netprofit_perc = np.nan
-        cagr = np.nan
-        trade_avg = np.nan
-        trade_std = np.nan
-
-        if len(trade_pnl) > 0 and len(acc_df) > 0:
+        acc_trades = Report._trades_frame(self._transactions[account], self._trades_arrays[account])
+
+        if len(acc_trades) > 0 and len(acc_df) > 0:
+            # Replace account series by %
             equity = acc_df['equity'].ffill()
             capital_invested = acc_df['capital_invested'].ffill()
-            capital_invested_avg = capital_invested.mean()
-            capital_invested_avg = np.nan if capital_invested_avg == 0 else capital_invested_avg
-            pnl_series_perc = acc_df['pnl'].fillna(0) / equity
-            equity_perc = equity / capital_invested * 100
-
-            winrate = len(trade_pnl[trade_pnl > 0]) / len(trade_pnl)
-            netprofit = equity[-1] - capital_invested_avg
-            netprofit_perc = (netprofit / capital_invested_avg)
-            mdd_arr = (equity - equity.expanding().max())
-            mdd = mdd_arr.min()
-            mdd_pct_arr = (equity / equity.expanding().max() - 1)
-            mdd_pct = mdd_pct_arr.min()
-
-            difference_in_years = (equity.index[-1] - equity.index[0]).days / 365.2425
-            if equity[-1] > 0:
-                cagr = (equity[-1] / equity[0]) ** (1 / difference_in_years) - 1
-            else:
-                cagr = -1.0
 
-            trade_avg = trade_pnl_perc.mean()
-            trade_std = trade_pnl_perc.std()
-
-            # Replace account series by %
-            acc_df['equity'] = equity_perc
-            acc_df['pnl'] = pnl_series_perc
-            acc_df['mdd'] = mdd_pct_arr * 100
-
-
-        stats = pd.Series(OrderedDict([
-            ('CAGR %', cagr*100),
-            ('NetProfit $', netprofit),
-            ('NetProfit %', netprofit_perc * 100),
-            ('MaxDD $', mdd),
-            ('MaxDD %', mdd_pct * 100),
-            ('NumberOfTrades', len(acc_trades)),
-            ('WinRate', f'{winrate * 100:0.2f}%'),
-            ('Trade % Mean', trade_avg * 100),
-            ('Trade % StDev', trade_std * 100),
-            ]))
+            acc_df['equity'] = equity / capital_invested * 100
+            acc_df['pnl'] = acc_df['pnl'].fillna(0) / equity
+            # Running maximum of equity which skips NaN, the same drawdown as of the stats kernel
+            acc_df['mdd'] = (equity / np.fmax.accumulate(equity.values) - 1) * 100
 
         return stats, acc_df, acc_trades
-
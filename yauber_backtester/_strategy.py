@@ -3,7 +3,8 @@ import pandas as pd
 import numpy as np
 from ._asset import Asset
 from ._account import Account
-from ._containers import MFrame
+from ._containers import MFrame, UniversePanel
+from ._cache import default_cache
 from datetime import datetime
 
 
@@ -13,6 +14,25 @@ class Strategy:
     """
     name = 'BaseStrategy'
 
+    rebalance_trigger = None
+    """(Optional) metric column name, compose_portfolio() is called only at bars where the metric is non-zero
+    (at least for one asset), at other bars the position is carried forward"""
+
+    rebalance_calendar = None
+    """(Optional) rebalance calendar, compose_portfolio() is called only at the first bar of each period:
+    pandas period alias (i.e. 'W' - weekly, 'M' - monthly) or list of dates (the first bar on or after each date).
+    If both rebalance_trigger and rebalance_calendar are set, compose_portfolio() is called when any of them fires"""
+
+    warmup = None
+    """(Optional) number of warm-up bars (i.e. lookback of the longest indicator), compose_portfolio() is not called at
+    these bars and the account has no positions"""
+
+    compose_kernel = None
+    """(Optional) numba.njit compiled alternative of compose_portfolio(), if set the whole backtest loop runs in the
+    compiled code: compose_kernel(i_bar, metrics, qty, equity) -> qty array aligned with mf.assets
+        i_bar - bar index, metrics - np.ndarray (assets x columns) of metrics at the bar (columns order as in mf.columns),
+        qty - current position quantities aligned with mf.assets, equity - account equity at the previous bar"""
+
     def __init__(self, **kwargs):
         self.kwargs = kwargs
         """Strategy initial dictionary"""
@@ -20,6 +40,15 @@ class Strategy:
         self.params = self.kwargs.get('params', {})
         """Strategy default params dict"""
 
+        self.rebalance_trigger = self.kwargs.get('rebalance_trigger', self.rebalance_trigger)
+        self.rebalance_calendar = self.kwargs.get('rebalance_calendar', self.rebalance_calendar)
+        self.warmup = self.kwargs.get('warmup', self.warmup)
+
+        self.cache = self.kwargs.get('cache', None)
+        """Indicator cache (IndicatorCache), by default the cache is shared across all strategies in the process"""
+        if self.cache is None:
+            self.cache = default_cache()
+
     def __str__(self):
         return self.name
 
@@ -37,9 +66,24 @@ class Strategy:
         """
         Calculates main logic of the strategy, this method must return pd.DataFrame or None (if asset is filtered at all)
         This information is used by portfolio composition stage
+
+        Heavy indicators could be shared across strategies via the cache:
+            ma200 = self.cache.get_or_compute(asset, 'ma200', lambda a: a.quotes()['c'].rolling(200).mean())
         """
         raise NotImplementedError('You should implement calculate() method for every strategy class')
 
+    def calculate_universe(self, panel: UniversePanel) -> dict:
+        """
+        (Optional) Vectorized alternative of calculate(), computes metrics of all assets at once. If this method is
+        overridden, the backtester uses it instead of calculate(), and skips per-asset pd.DataFrame construction.
+        :param panel: quotes of all assets aligned by the common index (time x assets arrays)
+                      panel.close, panel.exec, panel.open, panel.high, panel.low, or panel['quotes_column']
+                      panel.index - datetime index, panel.assets - list of assets (columns order)
+
+        :return: OrderedDict of {metric_name: np.ndarray (time x assets) of numbers (int, float, bool), ...}
+        """
+        raise NotImplementedError('calculate_universe() is optional, override it for vectorized calculations')
+
     def compose_portfolio(self, date: datetime, account: Account, mf: MFrame) -> dict:
         """
         Returns a dictionary of portfolio composition at specific 'date'
@@ -48,6 +92,9 @@ class Strategy:
         :param mf: composite of metrics returned by self.calculate() method at 'date'
 
         :return: dictionary of  {asset_class_instance: float_opened_quantity, ... }
+                 or PositionDelta with changes only (assets which are not mentioned keep their current position)
+                 or np.ndarray of quantities aligned with mf.assets (zero - no position), or tuple (qty_array,
+                 context_array) - the fastest way for wide portfolios, the bar is processed by vector operations
 
         -----------
         mf - cheat sheet